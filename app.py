@@ -3,20 +3,72 @@ Flask应用主文件
 校园二手交易平台
 """
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import json
+import math
+from flask import (Flask, Response, abort, render_template, request, redirect, url_for, flash, jsonify,
+                   stream_with_context)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-from config import Config
-from models import db, User, Product, Category, Order, Favorite, SystemLog
+from config import config
+from models import db, User, Product, ProductImage, Category, Order, Favorite, IdempotencyKey, Conversation
+from db_profile import init_db_profile
+from search import apply_keyword_filter, ensure_search_index
+import suggest
+from pagination import paginate_listing, invalidate_counts
+import queries
+import user_stats
+import ranking
+from view_counter import view_counter
+from audit import audit
+from cache import cache
+from images import image_pipeline
+import reservations
+import order_state
+import payments
+import messaging
+import favorites
+import browse
+from profiler import profiler
+from passwords import password_hasher
+from identity import identity_cache, load_current_user
+from reservations import order_sweeper
 from datetime import datetime
+import time
 import uuid
 
 # 创建Flask应用
 app = Flask(__name__)
-app.config.from_object(Config)
+app.config.from_object(config[os.environ.get('APP_CONFIG', 'default')])
 
 # 初始化数据库
 db.init_app(app)
+init_db_profile(app, db)
+
+# 请求级SQL剖析与监控指标（按抽样率启用）
+profiler.init_app(app)
+
+# 浏览量写回缓冲
+view_counter.init_app(app)
+
+# 审计日志（后台批量写入）
+audit.init_app(app)
+
+# 两级缓存（分类列表、首页商品列表片段）
+cache.init_app(app)
+
+# 图片上传与缩略图生成
+image_pipeline.init_app(app)
+
+# 密码哈希（进程池计算 + 并发上限）
+password_hasher.init_app(app)
+
+# 超时订单清理
+order_sweeper.init_app(app)
+
+# 私信推送（信箱代数与等待队列）
+messaging.hub.init_app(app)
+
+# 登录用户身份缓存
+identity_cache.init_app(app)
 
 # 初始化登录管理器
 login_manager = LoginManager()
@@ -27,8 +79,8 @@ login_manager.login_message = '请先登录'
 
 @login_manager.user_loader
 def load_user(user_id):
-    """加载用户"""
-    return User.query.get(int(user_id))
+    """加载用户快照（进程内缓存，不加载完整的 User 对象）"""
+    return identity_cache.load(int(user_id))
 
 
 def allowed_file(filename):
@@ -37,32 +89,77 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 
-# ==================== 路由定义 ====================
+def get_categories():
+    """分类列表（几乎不变化，缓存为普通字典，可在进程间共享）"""
+    def load():
+        return [{'id': c.id, 'name': c.name, 'icon': c.icon}
+                for c in Category.query.order_by(Category.sort_order).all()]
+    return cache.get_or_set('categories', 'all', load, app.config['CACHE_CATEGORY_TTL'])
 
-@app.route('/')
-def index():
-    """首页 - 展示最新商品"""
-    page = request.args.get('page', 1, type=int)
-    category_id = request.args.get('category', type=int)
-    keyword = request.args.get('keyword', '')
 
-    query = Product.query.filter_by(is_deleted=False, status='available')
+def invalidate_listings():
+    """商品上下架后使首页列表片段与热门列表失效"""
+    cache.invalidate('product_grid')
+    ranking.invalidate_trending()
 
-    if category_id:
-        query = query.filter_by(category_id=category_id)
 
-    if keyword:
-        query = query.filter(Product.title.contains(keyword) |
-                           Product.description.contains(keyword))
+@order_sweeper.on_expired
+def release_expired_orders(expired):
+    """超时订单取消后：商品重新出现在搜索建议与首页列表中"""
+    for order in expired:
+        product = db.session.get(Product, order.product_id)
+        if product is not None and product.status == 'available':
+            suggest.product_listed(product)
+    invalidate_listings()
 
-    products = query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False
-    )
 
-    categories = Category.query.order_by(Category.sort_order).all()
+# ==================== 路由定义 ====================
 
-    return render_template('index.html', products=products, categories=categories,
-                         current_category=category_id, keyword=keyword)
+@app.route('/')
+def index():
+    """首页 - 在售商品，支持分类、价格区间、新旧程度、校区筛选与排序"""
+    page = request.args.get('page', type=int)
+    keyword = request.args.get('keyword', '').strip()
+    cursor = request.args.get('cursor')
+    filters = browse.BrowseFilters.from_args(request.args)
+    sort_col, descending = filters.sort_column
+    # 关键词搜索的总数由分页查询统计，分面计数只在浏览时显示
+    facets = None if keyword else browse.facet_counts(filters)
+    link_args = filters.url_args(keyword=keyword or None)
+
+    def render_grid():
+        query = browse.listing_query(filters, facets, app.config['ITEMS_PER_PAGE'])
+
+        if keyword:
+            # 全文检索（按相关度排序），非SQLite时回退为LIKE；选择了排序方式时按所选排序
+            query = apply_keyword_filter(query, keyword)
+            if filters.sort != 'newest':
+                query = query.order_by(None).order_by(
+                    sort_col.desc() if descending else sort_col.asc(), Product.id.desc())
+            products = query.paginate(
+                page=page or 1, per_page=app.config['ITEMS_PER_PAGE'], error_out=False
+            )
+        else:
+            products = paginate_listing(
+                query, sort_col, Product.id,
+                page=page, cursor=cursor,
+                per_page=app.config['ITEMS_PER_PAGE'],
+                total=facets['total'], descending=descending
+            )
+        return render_template('_product_grid.html', products=products, link_args=link_args)
+
+    # 列表片段对所有访客相同，只有空列表提示与收藏按钮区分是否登录
+    grid_key = (filters.key(), keyword, page, cursor, current_user.is_authenticated)
+    product_grid = cache.get_or_set('product_grid', grid_key, render_grid,
+                                    app.config['CACHE_GRID_TTL'])
+
+    trending = [] if keyword or filters.is_filtered else ranking.trending(
+        filters.category_id, app.config['HOT_TRENDING_LIMIT'])
+
+    return render_template('index.html', product_grid=product_grid, categories=get_categories(),
+                         trending=trending, current_category=filters.category_id, keyword=keyword,
+                         filters=filters, facets=facets, campuses=browse.campuses(),
+                         conditions=browse.CONDITIONS, sort_labels=browse.SORT_LABELS)
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -102,15 +199,13 @@ def register():
             phone=phone,
             campus=campus
         )
-        user.set_password(password)
+        user.password_hash = password_hasher.hash(password)
 
         db.session.add(user)
         db.session.commit()
 
         # 记录日志
-        log = SystemLog(user_id=user.id, action='register', description='用户注册')
-        db.session.add(log)
-        db.session.commit()
+        audit.log('register', user_id=user.id, description='用户注册')
 
         flash('注册成功，请登录', 'success')
         return redirect(url_for('login'))
@@ -131,7 +226,7 @@ def login():
 
         user = User.query.filter_by(username=username).first()
 
-        if user is None or not user.check_password(password):
+        if user is None or not password_hasher.verify(user.password_hash, password):
             flash('用户名或密码错误', 'danger')
             return redirect(url_for('login'))
 
@@ -139,12 +234,17 @@ def login():
             flash('账户已被禁用，请联系管理员', 'danger')
             return redirect(url_for('login'))
 
+        # 旧参数的哈希按当前配置重新计算（哈希服务繁忙时跳过，下次登录再升级）
+        if password_hasher.needs_rehash(user.password_hash):
+            upgraded = password_hasher.rehash(password)
+            if upgraded:
+                user.password_hash = upgraded
+                db.session.commit()
+
         login_user(user, remember=remember)
 
         # 记录日志
-        log = SystemLog(user_id=user.id, action='login', description='用户登录')
-        db.session.add(log)
-        db.session.commit()
+        audit.log('login', user_id=user.id, description='用户登录')
 
         next_page = request.args.get('next')
         if next_page:
@@ -166,33 +266,28 @@ def logout():
 @app.route('/product/<int:product_id>')
 def product_detail(product_id):
     """商品详情"""
-    product = Product.query.get_or_404(product_id)
+    product = queries.product_detail_query().get_or_404(product_id)
 
     if product.is_deleted:
         flash('该商品不存在', 'warning')
         return redirect(url_for('index'))
 
-    # 增加浏览次数
-    product.view_count += 1
-    db.session.commit()
+    # 增加浏览次数（进程内累加，后台批量写回）
+    view_counter.record(product_id)
 
     # 检查是否已收藏
-    is_favorited = False
-    if current_user.is_authenticated:
-        is_favorited = Favorite.query.filter_by(
-            user_id=current_user.id, product_id=product_id
-        ).first() is not None
+    is_favorited = current_user.is_authenticated and favorites.is_favorited(current_user.id, product_id)
 
     # 获取卖家其他商品
     other_products = Product.query.filter(
         Product.seller_id == product.seller_id,
         Product.id != product_id,
-        Product.is_deleted == False,
-        Product.status == 'available'
+        Product.listed()
     ).limit(4).all()
 
     return render_template('product_detail.html', product=product,
-                         is_favorited=is_favorited, other_products=other_products)
+                         is_favorited=is_favorited, other_products=other_products,
+                         view_count=product.view_count + view_counter.pending(product_id))
 
 
 @app.route('/product/publish', methods=['GET', 'POST'])
@@ -213,12 +308,12 @@ def publish_product():
         files = request.files.getlist('images')
         for file in files:
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filename = f"{uuid.uuid4().hex}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                file.save(filepath)
-                images.append(filename)
+                # 按内容哈希存储并去除元数据，缩略图在后台生成
+                image = image_pipeline.save_upload(file)
+                if image is None:
+                    flash(f'图片 {file.filename} 无法识别或尺寸过大，已忽略', 'warning')
+                elif image['filename'] not in [i['filename'] for i in images]:
+                    images.append(image)
 
         product = Product(
             title=title,
@@ -229,52 +324,60 @@ def publish_product():
             seller_id=current_user.id,
             condition=condition,
             trade_location=trade_location,
-            images=','.join(images) if images else None
+            images=','.join(i['filename'] for i in images) if images else None,
+            cover_image=images[0]['filename'] if images else None,
+            image_records=[ProductImage(position=position, **image)
+                           for position, image in enumerate(images)]
         )
 
         db.session.add(product)
+        db.session.flush()
+        user_stats.bump(current_user.id, product_count=1)
+        browse.bump_facet(product.id, 1)
         db.session.commit()
+        suggest.product_listed(product)
+        invalidate_counts('user_products')
+        invalidate_listings()
 
         # 记录日志
-        log = SystemLog(user_id=current_user.id, action='publish_product',
-                       table_name='products', record_id=product.id,
-                       description=f'发布商品：{title}')
-        db.session.add(log)
-        db.session.commit()
+        audit.log('publish_product', user_id=current_user.id,
+                  table_name='products', record_id=product.id,
+                  description=f'发布商品：{title}')
 
         flash('商品发布成功', 'success')
         return redirect(url_for('product_detail', product_id=product.id))
 
-    categories = Category.query.order_by(Category.sort_order).all()
-    return render_template('publish_product.html', categories=categories)
+    return render_template('publish_product.html', categories=get_categories())
 
 
 @app.route('/product/<int:product_id>/favorite', methods=['POST'])
 @login_required
 def toggle_favorite(product_id):
-    """收藏/取消收藏商品"""
-    product = Product.query.get_or_404(product_id)
-
-    favorite = Favorite.query.filter_by(
-        user_id=current_user.id, product_id=product_id
-    ).first()
-
-    if favorite:
-        db.session.delete(favorite)
-        product.favorite_count -= 1
-        is_favorited = False
-        message = '已取消收藏'
+    """收藏/取消收藏商品；请求中带 favorited（1/0）时设为该状态，重复提交结果不变，否则切换当前状态"""
+    if db.session.execute(db.select(Product.id).where(Product.id == product_id)).first() is None:
+        abort(404)
+
+    data = request.get_json(silent=True) or request.form
+    favorited = data.get('favorited')
+    if favorited is None:
+        favorited = not favorites.is_favorited(current_user.id, product_id)
     else:
-        favorite = Favorite(user_id=current_user.id, product_id=product_id)
-        db.session.add(favorite)
-        product.favorite_count += 1
-        is_favorited = True
-        message = '收藏成功'
+        favorited = str(favorited).lower() in ('1', 'true')
 
-    db.session.commit()
+    _, favorite_count = favorites.set_favorite(current_user.id, product_id, favorited)
+    return jsonify({'success': True, 'is_favorited': favorited,
+                    'message': '收藏成功' if favorited else '已取消收藏',
+                    'favorite_count': favorite_count})
 
-    return jsonify({'success': True, 'is_favorited': is_favorited,
-                   'message': message, 'favorite_count': product.favorite_count})
+
+@app.route('/api/favorites/state')
+def favorite_state():
+    """一页商品的收藏状态：?ids=1,2,3，返回其中已收藏的商品ID；未登录时为空列表"""
+    if not current_user.is_authenticated:
+        return jsonify({'success': True, 'favorited': []})
+    ids = [int(part) for part in request.args.get('ids', '').split(',') if part.strip().isdigit()]
+    return jsonify({'success': True,
+                    'favorited': sorted(favorites.favorite_states(current_user.id, ids))})
 
 
 @app.route('/order/create/<int:product_id>', methods=['POST'])
@@ -282,8 +385,15 @@ def toggle_favorite(product_id):
 def create_order(product_id):
     """创建订单"""
     product = Product.query.get_or_404(product_id)
+    idempotency_key = request.form.get('idempotency_key')
+
+    # 重复提交（双击、刷新重发）：直接跳转到第一次创建的订单
+    previous = db.session.get(IdempotencyKey, idempotency_key) if idempotency_key else None
+    if previous is not None and previous.order_id:
+        flash('订单已提交，请勿重复下单', 'info')
+        return redirect(url_for('order_detail', order_id=previous.order_id))
 
-    if product.status != 'available':
+    if product.status != 'available' or product.is_deleted:
         flash('商品已售出或下架', 'warning')
         return redirect(url_for('product_detail', product_id=product_id))
 
@@ -291,24 +401,49 @@ def create_order(product_id):
         flash('不能购买自己的商品', 'warning')
         return redirect(url_for('product_detail', product_id=product_id))
 
-    # 生成订单号
-    order_no = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6].upper()}"
-
-    order = Order(
-        order_no=order_no,
-        product_id=product_id,
-        buyer_id=current_user.id,
-        seller_id=product.seller_id,
-        price=product.price,
-        trade_location=request.form.get('trade_location', product.trade_location),
-        buyer_note=request.form.get('buyer_note')
-    )
+    def place_order():
+        if idempotency_key:
+            claimed = order_state.claim_idempotency_key(idempotency_key, current_user.id, 'create_order')
+            if claimed is not None:
+                return db.session.get(Order, claimed.order_id) if claimed.order_id else None, False
+
+        # 上面的状态检查只用于提示，是否抢到以条件更新为准
+        if not reservations.reserve(product_id):
+            db.session.rollback()
+            return None, False
+
+        # 生成订单号
+        order_no = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6].upper()}"
+
+        order = Order(
+            order_no=order_no,
+            product_id=product_id,
+            buyer_id=current_user.id,
+            seller_id=product.seller_id,
+            price=product.price,
+            trade_location=request.form.get('trade_location', product.trade_location),
+            buyer_note=request.form.get('buyer_note')
+        )
+        db.session.add(order)
+        db.session.flush()
+        if idempotency_key:
+            db.session.get(IdempotencyKey, idempotency_key).order_id = order.id
+        user_stats.bump(current_user.id, buy_count=1)
+        user_stats.bump(product.seller_id, sell_count=1)
+        db.session.commit()
+        return order, True
 
-    # 更新商品状态
-    product.status = 'reserved'
+    order, created = reservations.with_busy_retry(place_order, app.config['ORDER_BUSY_RETRIES'],
+                                                  app.config['ORDER_BUSY_BACKOFF'])
+    if order is None:
+        flash('商品已被其他同学抢先下单', 'warning')
+        return redirect(url_for('product_detail', product_id=product_id))
+    if not created:
+        flash('订单已提交，请勿重复下单', 'info')
+        return redirect(url_for('order_detail', order_id=order.id))
 
-    db.session.add(order)
-    db.session.commit()
+    suggest.product_unlisted(product)
+    invalidate_listings()
 
     flash('订单创建成功，请尽快支付', 'success')
     return redirect(url_for('order_detail', order_id=order.id))
@@ -318,7 +453,7 @@ def create_order(product_id):
 @login_required
 def order_detail(order_id):
     """订单详情"""
-    order = Order.query.get_or_404(order_id)
+    order = queries.order_detail_query().get_or_404(order_id)
 
     # 只有买家和卖家可以查看
     if order.buyer_id != current_user.id and order.seller_id != current_user.id:
@@ -328,96 +463,110 @@ def order_detail(order_id):
     return render_template('order_detail.html', order=order)
 
 
-
-
-@app.route('/order/<int:order_id>/cancel', methods=['POST'])
-@login_required
-def cancel_order(order_id):
-    """取消订单"""
+def change_order_status(order_id, target, success_message):
+    """通过订单状态机执行一次状态转换，并刷新受影响的商品缓存"""
     order = Order.query.get_or_404(order_id)
 
-    #只有买家可以取消
-    if order.buyer_id != current_user.id:
-        flash('您无权取消该订单', 'danger')
+    if current_user.id not in (order.buyer_id, order.seller_id):
+        flash('您无权操作该订单', 'danger')
         return redirect(url_for('order_detail', order_id=order.id))
 
-    # 只有 'pending' (待处理) 状态的订单可以取消
-    if order.status != 'pending':
-        flash(f'该订单状态（{order.status}）无法取消', 'warning')
+    try:
+        applied = reservations.with_busy_retry(
+            lambda: order_state.transition(order, target, user_id=current_user.id,
+                                           idempotency_key=request.form.get('idempotency_key')),
+            app.config['ORDER_BUSY_RETRIES'], app.config['ORDER_BUSY_BACKOFF']
+        )
+    except order_state.OrderStateError as exc:
+        flash(str(exc), 'warning')
         return redirect(url_for('order_detail', order_id=order.id))
 
-    # 更新订单状态
-    order.status = 'cancelled'
-    order.cancelled_at = datetime.now()  #
+    if not applied:
+        # 重复提交：第一次提交已经处理
+        flash('该操作已处理', 'info')
+        return redirect(url_for('order_detail', order_id=order.id))
 
-    # 会在此时自动将 product.status 恢复为 'available'。
-    db.session.commit()
-    # 记录日志
-    log = SystemLog(user_id=current_user.id, action='cancel_order',
-                    table_name='orders', record_id=order.id,
-                    description=f'取消订单：{order.order_no}')  #
-    db.session.add(log)
-    db.session.commit()
+    if target in ('cancelled', 'refunded') and order.product:
+        suggest.product_listed(order.product)
+        invalidate_listings()
 
-    flash('订单已成功取消', 'success')
+    flash(success_message, 'success')
     return redirect(url_for('order_detail', order_id=order.id))
 
 
-# ... (在 app.py 的 cancel_order 函数之后) ...
+@app.route('/order/<int:order_id>/cancel', methods=['POST'])
+@login_required
+def cancel_order(order_id):
+    """取消订单（买家，待支付状态）"""
+    return change_order_status(order_id, 'cancelled', '订单已成功取消')
+
 
 @app.route('/order/<int:order_id>/complete', methods=['POST'])
 @login_required
 def complete_order(order_id):
-    """(卖家) 确认订单完成"""
+    """确认订单完成"""
+    return change_order_status(order_id, 'completed', '交易已成功确认完成！双方信用分已更新。')
 
+
+@app.route('/order/<int:order_id>/pay', methods=['POST'])
+@login_required
+def pay_order(order_id):
+    """买家使用账户余额支付订单，货款由平台托管到交易完成"""
     order = Order.query.get_or_404(order_id)
-    if order.seller_id != current_user.id:
+
+    if current_user.id != order.buyer_id:
         flash('您无权操作该订单', 'danger')
         return redirect(url_for('order_detail', order_id=order.id))
-     # 状态检查：只有 'pending' (或 'paid') 状态的订单可以被标记为完成
 
-    if order.status != 'pending':
-        flash(f'该订单状态（{order.status}）无法被标记为完成', 'warning')
+    try:
+        applied = reservations.with_busy_retry(
+            lambda: payments.pay(order, current_user.id, request.form.get('idempotency_key')),
+            app.config['ORDER_BUSY_RETRIES'], app.config['ORDER_BUSY_BACKOFF']
+        )
+    except (payments.PaymentError, order_state.OrderStateError) as exc:
+        flash(str(exc), 'warning')
         return redirect(url_for('order_detail', order_id=order.id))
 
+    if not applied:
+        flash('该操作已处理', 'info')
+    else:
+        flash('支付成功！货款将在交易完成后结算给卖家。', 'success')
+    return redirect(url_for('order_detail', order_id=order.id))
 
-    order.status = 'completed'
-    order.completed_at = datetime.now()  #
-
-    # 2. 更新商品状态
-    if order.product:
-        order.product.status = 'sold'
-        # 数据库触发器 'update_sold_time' 会自动更新 sold_at
-
-    # 3. 提交数据库
-    db.session.commit()
-    # 4. 记录日志
-    log = SystemLog(user_id=current_user.id, action='complete_order',
-                    table_name='orders', record_id=order.id,
-                    description=f'确认订单完成：{order.order_no}')
-    db.session.add(log)
-    db.session.commit()
 
-    flash('交易已成功确认完成！双方信用分已更新。', 'success')
-    return redirect(url_for('order_detail', order_id=order.id))
+@app.route('/order/<int:order_id>/status', methods=['POST'])
+@login_required
+def update_order_status(order_id):
+    """交付、申请退款、同意/拒绝退款等其他状态转换"""
+    target = request.form.get('target')
+    if target not in order_state.ACTIONS:
+        flash('未知的订单操作', 'danger')
+        return redirect(url_for('order_detail', order_id=order_id))
+    return change_order_status(order_id, target,
+                               f'{order_state.ACTIONS[target][1]}成功')
 
 
 @app.route('/user/profile')
 @login_required
 def user_profile():
     """用户个人中心"""
-    return render_template('user_profile.html', user=current_user)
+    return render_template('user_profile.html', user=load_current_user(),
+                           stats=user_stats.get_stats(current_user.id),
+                           recent_products=queries.recent_products(current_user.id),
+                           recent_orders=queries.recent_orders(current_user.id))
 
 
 @app.route('/user/products')
 @login_required
 def user_products():
     """我的商品"""
-    page = request.args.get('page', 1, type=int)
-    products = Product.query.filter_by(
-        seller_id=current_user.id, is_deleted=False
-    ).order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False
+    query = Product.query.filter_by(seller_id=current_user.id, is_deleted=False)
+    products = paginate_listing(
+        query, Product.created_at, Product.id,
+        page=request.args.get('page', type=int), cursor=request.args.get('cursor'),
+        per_page=app.config['ITEMS_PER_PAGE'],
+        count_key=('user_products', current_user.id),
+        count_ttl=app.config['PAGINATION_COUNT_TTL']
     )
     return render_template('user_products.html', products=products)
 
@@ -427,15 +576,16 @@ def user_products():
 def user_orders():
     """我的订单"""
     order_type = request.args.get('type', 'buy')  # buy or sell
-    page = request.args.get('page', 1, type=int)
 
     if order_type == 'buy':
-        orders = Order.query.filter_by(buyer_id=current_user.id)
+        query = queries.order_list_query().filter_by(buyer_id=current_user.id)
     else:
-        orders = Order.query.filter_by(seller_id=current_user.id)
+        query = queries.order_list_query().filter_by(seller_id=current_user.id)
 
-    orders = orders.order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False
+    orders = paginate_listing(
+        query, Order.created_at, Order.id,
+        page=request.args.get('page', type=int), cursor=request.args.get('cursor'),
+        per_page=app.config['ITEMS_PER_PAGE']
     )
 
     return render_template('user_orders.html', orders=orders, order_type=order_type)
@@ -445,14 +595,168 @@ def user_orders():
 @login_required
 def user_favorites():
     """我的收藏"""
-    page = request.args.get('page', 1, type=int)
-    favorites = Favorite.query.filter_by(user_id=current_user.id).order_by(
-        Favorite.created_at.desc()
-    ).paginate(page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False)
+    favorites = paginate_listing(
+        queries.favorite_list_query(current_user.id), Favorite.created_at, Favorite.id,
+        page=request.args.get('page', type=int), cursor=request.args.get('cursor'),
+        per_page=app.config['ITEMS_PER_PAGE']
+    )
 
     return render_template('user_favorites.html', favorites=favorites)
 
 
+# ==================== 私信 ====================
+
+@app.route('/messages')
+@login_required
+def message_inbox():
+    """私信收件箱"""
+    threads = messaging.inbox(current_user.id, app.config['MESSAGE_PAGE_SIZE'])
+    return render_template('messages.html', threads=threads)
+
+
+@app.route('/messages/<int:conversation_id>')
+@login_required
+def message_thread(conversation_id):
+    """会话详情，打开时把对方发来的消息标记为已读"""
+    conversation = Conversation.query.get_or_404(conversation_id)
+    if current_user.id not in (conversation.user_low_id, conversation.user_high_id):
+        flash('您无权查看该会话', 'danger')
+        return redirect(url_for('message_inbox'))
+
+    reservations.with_busy_retry(
+        lambda: messaging.mark_read(conversation.id, current_user.id),
+        app.config['ORDER_BUSY_RETRIES'], app.config['ORDER_BUSY_BACKOFF']
+    )
+    messages = messaging.conversation_messages(conversation.id, app.config['MESSAGE_PAGE_SIZE'])
+    return render_template('conversation.html', conversation=conversation, messages=messages,
+                           other=conversation.other_user(current_user.id))
+
+
+@app.route('/messages/send', methods=['POST'])
+@login_required
+def send_message():
+    """发送私信（商品详情页联系卖家、会话页回复）"""
+    receiver_id = request.form.get('receiver_id', type=int)
+    product_id = request.form.get('product_id', type=int)
+    content = request.form.get('content', '').strip()
+
+    if not content or len(content) > app.config['MESSAGE_MAX_LENGTH']:
+        flash(f'消息内容不能为空且不超过{app.config["MESSAGE_MAX_LENGTH"]}字', 'danger')
+        return redirect(request.referrer or url_for('message_inbox'))
+    if receiver_id == current_user.id or db.session.get(User, receiver_id) is None:
+        flash('收信人不存在', 'danger')
+        return redirect(request.referrer or url_for('message_inbox'))
+    if product_id and db.session.get(Product, product_id) is None:
+        product_id = None
+
+    message = reservations.with_busy_retry(
+        lambda: messaging.send_message(current_user.id, receiver_id, content, product_id),
+        app.config['ORDER_BUSY_RETRIES'], app.config['ORDER_BUSY_BACKOFF']
+    )
+    return redirect(url_for('message_thread', conversation_id=message.conversation_id))
+
+
+# ==================== API ====================
+
+@app.route('/api/search/suggestion')
+def search_suggestion():
+    """搜索建议（内存前缀索引，不访问数据库）"""
+    keyword = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', app.config['SUGGEST_LIMIT'], type=int),
+                app.config['SUGGEST_LIMIT'])
+    suggestions = suggest.suggest(app, keyword, limit) if keyword else []
+    return jsonify({'success': True, 'suggestions': suggestions})
+
+
+@app.route('/api/products/trending')
+def trending_products():
+    """热门商品（按时间衰减的热度排序）"""
+    category_id = request.args.get('category', type=int)
+    limit = min(request.args.get('limit', app.config['HOT_TRENDING_LIMIT'], type=int), 50)
+    products = ranking.trending(category_id, limit)
+    return jsonify({'success': True, 'products': [
+        dict(product, cover_image=image_pipeline.image_url(product['cover_image']))
+        for product in products
+    ]})
+
+
+@app.route('/api/messages/unread')
+@login_required
+def unread_messages():
+    """未读私信数；带 since（上次返回的 version）时为长轮询，信箱有变化或超时才返回"""
+    user_id = current_user.id
+    since = request.args.get('since', type=int)
+    retry = None
+    if since is not None:
+        if messaging.hub.enter():
+            # 等待期间不占用数据库连接
+            db.session.close()
+            cap = app.config['MESSAGE_LONGPOLL_TIMEOUT']
+            timeout = request.args.get('timeout', cap, type=float)
+            # nan 与任何数比较都为 False，会原样通过 min/max，先换成默认值再截断
+            if not math.isfinite(timeout):
+                timeout = cap
+            try:
+                messaging.hub.wait(user_id, since, max(min(timeout, cap), 0))
+            finally:
+                messaging.hub.leave()
+        else:
+            # 等待名额已满：立即返回，浏览器 retry 秒后再请求，不占住处理其他请求的线程
+            retry = app.config['MESSAGE_POLL_RETRY']
+    version = messaging.hub.version(user_id)
+    data = {'success': True, 'unread': messaging.unread_count(user_id), 'version': version}
+    if retry is not None:
+        data['retry'] = retry
+    return jsonify(data)
+
+
+@app.route('/api/messages/stream')
+@login_required
+def message_stream():
+    """未读私信数的 Server-Sent Events 推送；连接到期后由浏览器自动重连
+    未启用 SSE（MESSAGE_PUSH 不是 stream）或等待名额已满时返回 204，浏览器不再重连，改用长轮询"""
+    if app.config['MESSAGE_PUSH'] != 'stream' or not messaging.hub.enter():
+        return Response(status=204)
+    user_id = current_user.id
+    db.session.close()
+
+    def events():
+        try:
+            version = None
+            deadline = time.monotonic() + app.config['MESSAGE_STREAM_TIMEOUT']
+            yield 'retry: 3000\n\n'
+            while time.monotonic() < deadline:
+                current = messaging.hub.wait(user_id, version, app.config['MESSAGE_HEARTBEAT'])
+                if current == version:
+                    yield ': heartbeat\n\n'
+                    continue
+                version = current
+                data = json.dumps({'unread': messaging.unread_count(user_id), 'version': version})
+                db.session.close()
+                yield f'event: unread\ndata: {data}\n\n'
+        finally:
+            messaging.hub.leave()
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """缓存命中率统计（当前进程），访问控制与 /metrics 相同"""
+    if not profiler.authorized():
+        abort(403)
+    return jsonify({'success': True, 'cache': cache.stats()})
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标（当前进程）"""
+    if not profiler.authorized():
+        abort(403)
+    return Response(profiler.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 # ==================== 错误处理 ====================
 
 @app.errorhandler(404)
@@ -460,6 +764,11 @@ def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
+@app.errorhandler(429)
+def too_many_requests_error(error):
+    return render_template('errors/429.html', error=error), 429, {'Retry-After': '1'}
+
+
 @app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -473,7 +782,10 @@ def utility_processor():
     """模板上下文处理器"""
     return {
         'now': datetime.now,
-        'enumerate': enumerate
+        'enumerate': enumerate,
+        'idempotency_key': order_state.new_idempotency_key,
+        'order_transitions': order_state.available_transitions,
+        'order_actions': order_state.ACTIONS,
     }
 
 
@@ -481,6 +793,8 @@ if __name__ == '__main__':
     with app.app_context():
         db.create_all()
         print("数据库表创建成功！")
+        ensure_search_index()
 
+    # 开发服务器（单进程、带调试器）；生产环境使用 python serve.py（多进程多线程、优雅退出）
     app.run(debug=True, host='0.0.0.0', port=5001)
 
@@ -0,0 +1,233 @@
+"""
+ASGI 入口（可选）：python serve.py --asgi，或 uvicorn asgi:application --workers 4
+- 私信推送的两个长连接端点（/api/messages/stream 的 SSE、带 since 参数的 /api/messages/unread 长轮询）在事件循环中等待：
+  每个连接只是一个协程，每隔 MESSAGE_WAKE_INTERVAL 秒检查一次内存中的信箱代数，不占线程也不占数据库连接；
+  校验登录、读取未读数这些短操作放到线程池中，在 Flask 请求上下文里执行
+- 其他请求交给 Flask 应用：读完请求体后在线程池（SERVE_THREADS 个线程）中执行，整个响应体生成后一次发送
+- 长连接不占线程，未通过环境变量 MESSAGE_PUSH 指定时浏览器默认使用 SSE（/api/messages/stream）
+- lifespan 启动时编译模板，关闭时与 serve.py 一样写回浏览量、审计日志等缓冲
+"""
+import asyncio
+import io
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from flask_login import current_user
+
+from app import app
+import messaging
+import serve
+
+STREAM_PATH = '/api/messages/stream'
+UNREAD_PATH = '/api/messages/unread'
+
+app.config['MESSAGE_PUSH'] = os.environ.get('MESSAGE_PUSH', 'stream')
+
+_executor = None
+
+
+def _run_sync(func, *args):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=app.config['SERVE_THREADS'], thread_name_prefix='asgi')
+    return asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+def _environ(scope, body):
+    """由 ASGI scope 构造 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def _call_flask(environ):
+    """在线程池中执行 Flask 应用，返回 (状态码, 响应头, 响应体)"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                              for name, value in headers]
+        return lambda data: None
+
+    result = app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started['status'], started['headers'], body
+
+
+async def _send_response(send, status, headers, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _flask(scope, body, send):
+    status, headers, content = await _run_sync(_call_flask, _environ(scope, body))
+    await _send_response(send, status, headers, content)
+
+
+def _current_user_id(environ):
+    """按请求中的会话 Cookie 校验登录，返回用户ID，未登录返回 None"""
+    with app.request_context(environ):
+        return current_user.id if current_user.is_authenticated else None
+
+
+def _unread(user_id):
+    with app.app_context():
+        return {'unread': messaging.unread_count(user_id), 'version': messaging.hub.version(user_id)}
+
+
+async def _wait_version(user_id, since, timeout, disconnected):
+    """协程版的 MessageHub.wait()：信箱代数与 since 不同、超时或客户端断开时返回当前代数"""
+    deadline = time.monotonic() + timeout
+    interval = app.config['MESSAGE_WAKE_INTERVAL']
+    while True:
+        current = messaging.hub.version(user_id)
+        remaining = deadline - time.monotonic()
+        if current != since or remaining <= 0 or disconnected.is_set():
+            return current
+        await asyncio.sleep(min(interval, remaining))
+
+
+async def _watch_disconnect(receive, disconnected):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnected.set()
+
+
+async def _long_poll(user_id, since, timeout, receive, send):
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+    try:
+        await _wait_version(user_id, since, timeout, disconnected)
+    finally:
+        watcher.cancel()
+    if disconnected.is_set():
+        return
+    data = await _run_sync(_unread, user_id)
+    await _send_response(send, 200, [(b'content-type', b'application/json')],
+                         json.dumps({'success': True, **data}, separators=(',', ':')).encode())
+
+
+async def _stream(user_id, receive, send):
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    try:
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        version = None
+        deadline = time.monotonic() + app.config['MESSAGE_STREAM_TIMEOUT']
+        while time.monotonic() < deadline and not disconnected.is_set():
+            current = await _wait_version(user_id, version, app.config['MESSAGE_HEARTBEAT'], disconnected)
+            if disconnected.is_set():
+                return
+            if current == version:
+                chunk = ': heartbeat\n\n'
+            else:
+                version = current
+                chunk = f'event: unread\ndata: {json.dumps(await _run_sync(_unread, user_id))}\n\n'
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+
+
+async def _http(scope, receive, send):
+    path, method = scope['path'], scope['method']
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    long_lived = method == 'GET' and (path == STREAM_PATH or (path == UNREAD_PATH and 'since' in query))
+    body = b'' if long_lived else await _read_body(receive)
+    if body is None:
+        return
+    if not long_lived:
+        await _flask(scope, body, send)
+        return
+
+    user_id = await _run_sync(_current_user_id, _environ(scope, b''))
+    if user_id is None:
+        # 未登录：按 Flask 路由的 login_required 处理（跳转登录页）
+        await _flask(scope, b'', send)
+        return
+    if path == STREAM_PATH:
+        await _stream(user_id, receive, send)
+        return
+    try:
+        since = int(query['since'][0])
+        timeout = float(query.get('timeout', [app.config['MESSAGE_LONGPOLL_TIMEOUT']])[0])
+    except ValueError:
+        await _flask(scope, b'', send)
+        return
+    # nan/inf 能被 float() 解析且会原样通过 min/max，与 WSGI 路由一样换成默认值
+    if not math.isfinite(timeout):
+        timeout = app.config['MESSAGE_LONGPOLL_TIMEOUT']
+    timeout = max(min(timeout, app.config['MESSAGE_LONGPOLL_TIMEOUT']), 0)
+    await _long_poll(user_id, since, timeout, receive, send)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            serve.preload()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await _run_sync(serve.shutdown_app)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await _http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
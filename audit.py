@@ -0,0 +1,181 @@
+"""
+审计日志
+业务路由调用 audit.log() 只是把日志放入进程内的有界队列，由后台线程批量写入 system_logs，
+业务事务提交后不再为日志单独提交一次；请求中的IP、User-Agent与耗时在请求结束时自动补全
+队列满时丢弃并计数，不阻塞请求；AUDIT_SYNC=True 时同步写入，便于测试
+必须与业务数据同时提交的日志（订单状态转换）用 log_in_transaction() 加入当前会话事务，字段与异步日志相同，
+耗时为记录时请求已经过的时间
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_request_context, request
+
+from models import db, SystemLog
+
+
+class AuditLog:
+    """异步审计日志写入器"""
+
+    def __init__(self, app=None):
+        self._queue = None
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        self.app = None
+        self.batch_size = 200
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.in_transaction = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config['AUDIT_BATCH_SIZE']
+        self._queue = queue.Queue(maxsize=app.config['AUDIT_QUEUE_SIZE'])
+        app.extensions['audit_log'] = self
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        atexit.register(self.flush)
+
+    # ==================== 记录 ====================
+
+    def log(self, action, user_id=None, table_name=None, record_id=None, description=None):
+        """记录一条审计日志；在请求中时延迟到请求结束再入队，以便补全请求元数据"""
+        entry = self._entry(action, user_id, table_name, record_id, description)
+        if has_request_context():
+            g.setdefault('audit_entries', []).append(entry)
+        else:
+            self._submit([entry])
+
+    def log_in_transaction(self, action, user_id=None, table_name=None, record_id=None, description=None,
+                           created_at=None):
+        """把一条审计日志加入当前会话事务（随业务数据一起提交或回滚），立即补全请求元数据；由调用方提交"""
+        entry = self._entry(action, user_id, table_name, record_id, description)
+        if created_at is not None:
+            entry['created_at'] = created_at
+        if has_request_context():
+            self._fill_request(entry)
+        db.session.add(SystemLog(**entry))
+        with self._lock:
+            self.in_transaction += 1
+
+    @staticmethod
+    def _entry(action, user_id, table_name, record_id, description):
+        return {
+            'user_id': user_id,
+            'action': action,
+            'table_name': table_name,
+            'record_id': record_id,
+            'description': description,
+            'ip_address': None,
+            'user_agent': None,
+            'latency_ms': None,
+            'created_at': datetime.now(),
+        }
+
+    @staticmethod
+    def _fill_request(entry):
+        """补全请求的IP、User-Agent与到目前为止的耗时"""
+        entry.update(
+            ip_address=request.remote_addr,
+            user_agent=(request.user_agent.string or '')[:200] or None,
+            latency_ms=int((time.perf_counter() - g.get('audit_started', time.perf_counter())) * 1000),
+        )
+
+    def _start_request(self):
+        g.audit_started = time.perf_counter()
+
+    def _finish_request(self, exc=None):
+        entries = g.pop('audit_entries', None)
+        if not entries:
+            return
+        for entry in entries:
+            self._fill_request(entry)
+        self._submit(entries)
+
+    def _submit(self, entries):
+        if self.app.config['AUDIT_SYNC']:
+            self._write(entries)
+            return
+        self._ensure_worker()
+        enqueued = 0
+        for entry in entries:
+            try:
+                self._queue.put_nowait(entry)
+                enqueued += 1
+            except queue.Full:
+                # 背压：写入跟不上时丢弃，而不是拖慢请求
+                break
+        with self._lock:
+            self.enqueued += enqueued
+            self.dropped += len(entries) - enqueued
+
+    # ==================== 写入 ====================
+
+    def _write(self, entries):
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(SystemLog.__table__.insert(), entries)
+            with self._lock:
+                self.written += len(entries)
+        except Exception:
+            with self._lock:
+                self.failed += len(entries)
+            self.app.logger.exception('审计日志写入失败，丢弃 %d 条', len(entries))
+
+    def _drain(self, block):
+        """从队列取出至多 batch_size 条日志"""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=1) if block else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def flush(self):
+        """同步写完队列中的所有日志（测试或进程退出时调用）"""
+        if self._queue is None:
+            return
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                break
+            self._write(batch)
+
+    def stats(self):
+        return {
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'in_transaction': self.in_transaction,
+            'queued': self._queue.qsize() if self._queue else 0,
+        }
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='audit-log-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = self._drain(block=True)
+            if batch:
+                self._write(batch)
+
+
+audit = AuditLog()
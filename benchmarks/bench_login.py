@@ -0,0 +1,211 @@
+"""
+登录吞吐测试
+在临时数据库中创建一批用户，N 个线程（各自一个测试客户端）在限定时间内反复登录、退出，
+按哈希进程数分别统计每秒登录次数与每个CPU核心的登录次数；同时用一个线程持续请求不需要哈希的页面（GET /login），
+统计其延迟，观察登录高峰对其他路由的影响。随后检查：
+- 哈希名额只有 1 个时并发登录，超出的请求立即得到 429，且响应时间远小于一次哈希
+- 旧参数（pbkdf2）的密码哈希在登录成功后升级为当前配置的参数，之后仍能登录
+
+用法: python benchmarks/bench_login.py [--threads 8] [--seconds 5] [--workers 0,1,2,4]
+      PASSWORD_HASH_METHOD=pbkdf2:sha256:600000 python benchmarks/bench_login.py   # 测试其他哈希参数
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'login.db')
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User  # noqa: E402
+from passwords import password_hasher  # noqa: E402
+import init_db  # noqa: E402
+
+PASSWORD = 'bench-123456'
+LEGACY_METHOD = 'pbkdf2:sha256:1000'
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def prepare(count):
+    """创建 count 个用户（共用一个按当前参数计算的哈希），返回用户名列表"""
+    password_hash = generate_password_hash(PASSWORD, method=password_hasher.method)
+    with app.app_context():
+        db.session.add_all([User(student_id=f'L{i:05d}', username=f'login{i}', real_name=f'用户{i}',
+                                 email=f'login{i}@example.com', password_hash=password_hash)
+                            for i in range(count)])
+        db.session.commit()
+    return [f'login{i}' for i in range(count)]
+
+
+def configure(workers, max_pending):
+    """切换哈希进程数与名额（关闭旧的进程池），并预先启动子进程"""
+    password_hasher.shutdown()
+    password_hasher.workers = workers
+    password_hasher._slots = threading.BoundedSemaphore(max_pending)
+    if workers > 0:
+        executor = password_hasher._get_executor()
+        for future in [executor.submit(abs, 0) for _ in range(workers * 2)]:
+            future.result()
+
+
+def login(client, username):
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    return response.status_code, response.headers.get('Location', '')
+
+
+def run(usernames, threads, seconds):
+    """threads 个线程反复登录/退出 seconds 秒，返回 (成功登录次数, 429次数, 耗时, 探测请求延迟列表)"""
+    deadline = time.perf_counter() + seconds
+    counts = {'ok': 0, 'busy': 0}
+    lock = threading.Lock()
+    probes = []
+    stop = threading.Event()
+
+    def worker(n):
+        client = app.test_client()
+        ok = busy = 0
+        while time.perf_counter() < deadline:
+            status, location = login(client, usernames[n % len(usernames)])
+            if status == 429:
+                busy += 1
+                continue
+            if status != 302 or location.endswith('/login'):
+                raise AssertionError(f'登录失败：{status} {location}')
+            ok += 1
+            client.get('/logout')
+        with lock:
+            counts['ok'] += ok
+            counts['busy'] += busy
+
+    def probe():
+        client = app.test_client()
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get('/login')
+            probes.append(time.perf_counter() - started)
+            stop.wait(0.01)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    prober = threading.Thread(target=probe)
+    started = time.perf_counter()
+    prober.start()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    prober.join()
+    return counts['ok'], counts['busy'], elapsed, probes
+
+
+def probe_idle(samples=100):
+    client = app.test_client()
+    latencies = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        client.get('/login')
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def check_saturation(usernames, threads):
+    """名额为 1 时 threads 个线程同时登录，返回 (成功数, 429数, 429响应的最长耗时)"""
+    configure(1, 1)
+    barrier = threading.Barrier(threads)
+    results = []
+
+    def worker(n):
+        client = app.test_client()
+        barrier.wait()
+        started = time.perf_counter()
+        status, _ = login(client, usernames[n % len(usernames)])
+        results.append((status, time.perf_counter() - started))
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    rejected = [elapsed for status, elapsed in results if status == 429]
+    return len(results) - len(rejected), len(rejected), max(rejected, default=0.0)
+
+
+def check_rehash():
+    """把一个用户的哈希改为旧参数，登录后检查已升级且仍能登录，返回 (升级前方法, 升级后方法, 再次登录状态码)"""
+    configure(1, 8)
+    with app.app_context():
+        user = User.query.filter_by(username='login0').first()
+        user.password_hash = generate_password_hash(PASSWORD, method=LEGACY_METHOD)
+        db.session.commit()
+    client = app.test_client()
+    login(client, 'login0')
+    client.get('/logout')
+    with app.app_context():
+        upgraded = User.query.filter_by(username='login0').first().password_hash.split('$', 1)[0]
+    status, location = login(client, 'login0')
+    return LEGACY_METHOD, upgraded, status if not location.endswith('/login') else 401
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', default='0,1,2,4', help='逗号分隔的哈希进程数，0 表示在请求线程中计算')
+    args = parser.parse_args()
+
+    app.config['TESTING'] = True
+    app.config['AUDIT_SYNC'] = True
+    init_db.init_database()
+    usernames = prepare(args.threads * 4)
+    cores = os.cpu_count() or 1
+    failures = 0
+
+    idle = probe_idle()
+    print(f'哈希方法 {password_hasher.method}，{cores} 个CPU核心，{args.threads} 个登录线程')
+    print(f'空闲时 GET /login 延迟 p50 {percentile(idle, 0.5) * 1000:.1f}ms p95 {percentile(idle, 0.95) * 1000:.1f}ms')
+    for workers in (int(value) for value in args.workers.split(',')):
+        configure(workers, args.threads * 2)
+        ok, busy, elapsed, probes = run(usernames, args.threads, args.seconds)
+        used = min(workers or args.threads, cores)
+        label = f'{workers} 个哈希进程' if workers else '请求线程中计算'
+        print(f'{label}：{ok / elapsed:.1f} 次登录/秒，每核 {ok / elapsed / used:.1f} 次/秒，429 {busy} 次；'
+              f'同时 GET /login 延迟 p50 {percentile(probes, 0.5) * 1000:.1f}ms '
+              f'p95 {percentile(probes, 0.95) * 1000:.1f}ms')
+        if busy:
+            print(f'FAIL 名额充足时出现 {busy} 次429')
+            failures += 1
+
+    hash_started = time.perf_counter()
+    generate_password_hash(PASSWORD, method=password_hasher.method)
+    hash_time = time.perf_counter() - hash_started
+    ok, rejected, slowest = check_saturation(usernames, args.threads)
+    print(f'名额为 1 时 {args.threads} 个并发登录：成功 {ok} 次，429 {rejected} 次，'
+          f'429 最长耗时 {slowest * 1000:.1f}ms（一次哈希 {hash_time * 1000:.1f}ms）')
+    if args.threads > 1 and (not rejected or slowest >= hash_time):
+        print('FAIL 哈希名额已满时没有立即返回429')
+        failures += 1
+
+    before, after, status = check_rehash()
+    print(f'旧哈希 {before} 登录后升级为 {after}，再次登录状态码 {status}')
+    if after != password_hasher.method or status != 302:
+        print('FAIL 旧参数的密码哈希没有升级')
+        failures += 1
+
+    password_hasher.shutdown()
+    print('OK' if not failures else f'{failures} 项检查失败')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
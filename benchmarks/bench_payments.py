@@ -0,0 +1,189 @@
+"""
+余额支付并发吞吐测试
+在临时数据库中为每个买家准备若干待支付订单，N 个线程各自代表一个买家并发支付，统计每秒支付笔数；
+再让一个余额只够支付一半订单的买家并发支付全部订单，检查恰好一半成功、余额不为负；
+最后把已支付订单确认完成并批量结算给卖家，统计结算吞吐，并核对：
+每个用户的流水合计与最后一条快照等于余额，所有余额之和等于充值总额（托管资金已全部结算）
+
+用法: python benchmarks/bench_payments.py [--threads 8] [--orders 50]
+      APP_CONFIG=production python benchmarks/bench_payments.py   # 使用 WAL 与连接池配置
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'payments.db')
+
+from app import app  # noqa: E402
+from models import db, User, Product, Order  # noqa: E402
+import init_db  # noqa: E402
+import order_state  # noqa: E402
+import payments  # noqa: E402
+import reservations  # noqa: E402
+
+PRICE = 12.34
+SELLERS = 4
+
+
+def prepare(prefix, buyers, orders_per_buyer, funds):
+    """创建卖家、买家（充值 funds 分）和待支付订单，返回 {buyer_id: [order_id]}"""
+    with app.app_context():
+        users = [User(student_id=f'{prefix}{i:05d}', username=f'{prefix}{i}', real_name=f'用户{i}',
+                      email=f'{prefix}{i}@example.com', password_hash='-')
+                 for i in range(SELLERS + buyers)]
+        db.session.add_all(users)
+        db.session.commit()
+        sellers, buyer_ids = users[:SELLERS], [user.id for user in users[SELLERS:]]
+        for buyer_id, amount in zip(buyer_ids, funds):
+            payments.deposit(buyer_id, amount, commit=False)
+
+        plan = {}
+        for n, buyer_id in enumerate(buyer_ids):
+            for i in range(orders_per_buyer):
+                seller = sellers[(n + i) % SELLERS]
+                product = Product(title=f'支付测试{n}-{i}', description='压力测试', price=PRICE,
+                                  category_id=1, seller_id=seller.id, status='reserved')
+                db.session.add(product)
+                db.session.flush()
+                order = Order(order_no=f'{prefix}{n:03d}{i:05d}', product_id=product.id, buyer_id=buyer_id,
+                              seller_id=seller.id, price=PRICE)
+                db.session.add(order)
+                db.session.flush()
+                plan.setdefault(buyer_id, []).append(order.id)
+        db.session.commit()
+        return plan
+
+
+def pay_all(plan):
+    """每个买家一个线程，屏障对齐后依次支付自己的订单，返回 (成功笔数, 余额不足笔数, 耗时)"""
+    barrier = threading.Barrier(len(plan))
+    paid, declined = [], []
+
+    def worker(buyer_id, order_ids):
+        with app.app_context():
+            barrier.wait()
+            for order_id in order_ids:
+                order = db.session.get(Order, order_id)
+                try:
+                    reservations.with_busy_retry(lambda: payments.pay(order, buyer_id),
+                                                 app.config['ORDER_BUSY_RETRIES'],
+                                                 app.config['ORDER_BUSY_BACKOFF'])
+                    paid.append(order_id)
+                except payments.PaymentError:
+                    declined.append(order_id)
+
+    threads = [threading.Thread(target=worker, args=item) for item in plan.items()]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(paid), len(declined), time.perf_counter() - started
+
+
+def contend(orders):
+    """一个买家余额只够一半订单，每个订单一个线程同时支付，返回 (成功笔数, 最终余额)"""
+    amount = payments.to_cents(PRICE)
+    plan = prepare('C', 1, orders, [amount * (orders // 2)])
+    (buyer_id, order_ids), = plan.items()
+    barrier = threading.Barrier(len(order_ids))
+    paid = []
+
+    def worker(order_id):
+        with app.app_context():
+            # 先对齐再取连接，等待期间不占用连接池
+            barrier.wait()
+            order = db.session.get(Order, order_id)
+            try:
+                reservations.with_busy_retry(lambda: payments.pay(order, buyer_id),
+                                             app.config['ORDER_BUSY_RETRIES'],
+                                             app.config['ORDER_BUSY_BACKOFF'])
+                paid.append(order_id)
+            except payments.PaymentError:
+                pass
+
+    threads = [threading.Thread(target=worker, args=(order_id,)) for order_id in order_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        return len(paid), db.session.get(User, buyer_id).balance_cents
+
+
+def complete_paid_orders():
+    with app.app_context():
+        order_ids = db.session.execute(db.select(Order.id).where(Order.status == 'paid')).scalars().all()
+        for order_id in order_ids:
+            order = db.session.get(Order, order_id)
+            order_state.transition(order, 'completed', user_id=order.buyer_id)
+        return len(order_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=50, help='每个买家的订单数')
+    args = parser.parse_args()
+
+    app.config['TESTING'] = True
+    app.config['AUDIT_SYNC'] = True
+    init_db.init_database()
+    init_db.create_triggers()
+    amount = payments.to_cents(PRICE)
+    failures = 0
+
+    plan = prepare('P', args.threads, args.orders, [amount * args.orders] * args.threads)
+    paid, declined, elapsed = pay_all(plan)
+    print(f'{args.threads} 线程并发支付 {paid + declined} 笔，成功 {paid} 笔，'
+          f'耗时 {elapsed:.2f}s（{paid / elapsed:.0f} 笔/秒），数据库忙重试 {reservations.busy_retries} 次')
+    if paid != args.threads * args.orders:
+        print(f'FAIL 余额充足的支付中有 {declined} 笔被拒绝')
+        failures += 1
+
+    contended = max(args.threads, 2)
+    won, balance = contend(contended)
+    print(f'余额只够 {contended // 2} 笔时并发支付 {contended} 笔：成功 {won} 笔，剩余余额 {balance} 分')
+    if won != contended // 2 or balance != 0:
+        print('FAIL 余额不足时的并发扣款结果不正确')
+        failures += 1
+
+    completed = complete_paid_orders()
+    started = time.perf_counter()
+    with app.app_context():
+        settled = payments.settle_all(app.config['PAYMENT_SETTLE_BATCH'])
+    elapsed = time.perf_counter() - started
+    print(f'批量结算 {settled} 笔已完成订单，耗时 {elapsed:.3f}s（{settled / max(elapsed, 1e-9):.0f} 笔/秒）')
+    if settled != completed:
+        print(f'FAIL 已完成 {completed} 笔，结算 {settled} 笔')
+        failures += 1
+
+    with app.app_context():
+        drift = payments.reconcile_ledger()
+        for user_id, balance, total, snapshot in drift:
+            print(f'FAIL 用户 {user_id}: 余额 {balance}，流水合计 {total}，最后快照 {snapshot}')
+        failures += len(drift)
+        deposits = db.session.execute(
+            db.text("SELECT SUM(amount_cents) FROM ledger_entries WHERE entry_type = 'deposit'")).scalar()
+        balances = db.session.execute(db.select(db.func.sum(User.balance_cents))).scalar()
+        if deposits != balances:
+            print(f'FAIL 充值总额 {deposits} 分，余额合计 {balances} 分')
+            failures += 1
+        try:
+            db.session.execute(db.text('DELETE FROM ledger_entries'))
+            print('FAIL 资金流水可以被删除')
+            failures += 1
+        except Exception:
+            db.session.rollback()
+
+    print('OK' if not failures else f'{failures} 项检查失败')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+"""
+页面路由基准测试
+在 seed_data.py 生成的大数据集上压测主要路由：首页（无条件 / 关键词 / 分类 / 关键词+分类）、商品详情、
+收藏切换、下单、我的订单（买入 / 卖出）与个人中心，统计每个路由的吞吐量、p50/p95/p99 延迟与每次请求的SQL语句数
+- inproc：Flask 测试客户端在进程内逐个请求，SQL语句数精确到单次请求（只统计请求线程）
+- server：在本地启动多线程 WSGI 服务器，--concurrency 个线程各自登录不同用户并发请求，
+  SQL语句数为测试期间引擎执行的总数除以请求数（包含后台线程）
+结果可用 --output 保存为 JSON，下次用 --baseline 对比：p95 变慢或吞吐下降超过 --tolerance，
+或每次请求的SQL语句数增加，即视为退化（退出码1）
+
+用法: python benchmarks/bench_routes.py [--mode inproc|server] [--scale small|medium|large]
+                                      [--requests 200] [--concurrency 8] [--routes index,product_detail]
+                                      [--output result.json] [--baseline baseline.json]
+      python benchmarks/bench_routes.py --database instance/seed.db   # 使用已生成的数据库（复制后再测）
+      APP_CONFIG=production python benchmarks/bench_routes.py --mode server   # 使用 WAL 与连接池配置
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp()
+DATABASE = os.path.join(WORKDIR, 'routes.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE
+# 共享文件缓存放在临时目录，避免读到其他数据库的缓存结果
+os.environ['CACHE_DIR'] = os.path.join(WORKDIR, 'cache')
+
+from werkzeug.serving import make_server, WSGIRequestHandler  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User, Category, Product, Order  # noqa: E402
+from query_counter import QueryCounter  # noqa: E402
+import init_db  # noqa: E402
+import seed_data  # noqa: E402
+
+SCALES = {
+    'small': dict(users=2000, products=50000, orders=100000, favorites=60000, messages=20000, logs=50000),
+    'medium': dict(users=20000, products=400000, orders=1000000, favorites=600000, messages=200000,
+                   logs=500000),
+    'large': dict(users=100000, products=2000000, orders=5000000, favorites=3000000, messages=2000000,
+                  logs=5000000),
+}
+ORDER_URL = re.compile(r'/order/\d+$')
+
+
+class Workload:
+    """从数据库中选出的请求参数：登录用户、商品池、可下单商品、关键词与分类"""
+
+    def __init__(self, clients, requests, seed):
+        self.rng = random.Random(seed)
+        with app.app_context():
+            # 订单最多的用户，"我的订单"是满页
+            buyers = db.session.execute(
+                db.select(Order.buyer_id).group_by(Order.buyer_id)
+                .order_by(db.func.count().desc(), Order.buyer_id).limit(clients)
+            ).scalars().all()
+            if len(buyers) < clients:
+                buyers += db.session.execute(
+                    db.select(User.id).where(User.id.not_in(buyers)).order_by(User.id).limit(clients - len(buyers))
+                ).scalars().all()
+            self.usernames = db.session.execute(
+                db.select(User.username).where(User.id.in_(buyers))
+            ).scalars().all()
+            self.categories = db.session.execute(db.select(Category.id)).scalars().all()
+            listed = db.select(Product.id).where(Product.status == 'available', Product.is_deleted == False)
+            # 详情与收藏：一半请求落在最热门的商品上，其余在全部在售商品中均匀抽取
+            self.hot_products = db.session.execute(
+                listed.order_by(Product.hot_score.desc()).limit(100)).scalars().all()
+            total = db.session.execute(db.select(db.func.max(Product.id))).scalar() or 0
+            self.product_ids = sorted(self.rng.sample(range(1, total + 1), min(total, 5000)))
+            # 下单会占用商品：每次下单使用一个不同的、不属于登录用户的在售商品
+            self.orderable = db.session.execute(
+                listed.where(Product.seller_id.not_in(buyers)).order_by(Product.id.desc()).limit(requests)
+            ).scalars().all()
+        self.keywords = seed_data.ITEMS + seed_data.BRANDS
+        self.lock = threading.Lock()
+
+    def product(self):
+        if self.hot_products and self.rng.random() < 0.5:
+            return self.rng.choice(self.hot_products)
+        return self.rng.choice(self.product_ids)
+
+    def next_orderable(self):
+        with self.lock:
+            return self.orderable.pop() if self.orderable else None
+
+    def idempotency_key(self):
+        return f'bench{self.rng.getrandbits(64):016x}'
+
+    def browse_args(self, filtered=True):
+        """首页筛选参数：随机排序，filtered 时再随机组合分类、价格区间、新旧程度与校区"""
+        args = {'sort': self.rng.choice(['newest', 'price_asc', 'price_desc', 'popular'])}
+        if not filtered:
+            return args
+        if self.rng.random() < 0.5:
+            args['category'] = self.rng.choice(self.categories)
+        if self.rng.random() < 0.5:
+            low = self.rng.choice([0, 20, 50, 100, 300])
+            args.update(min_price=low, max_price=low * 3 + 100)
+        if self.rng.random() < 0.3:
+            args['condition'] = self.rng.choice(seed_data.CONDITIONS)
+        if self.rng.random() < 0.3:
+            args['campus'] = self.rng.choice(seed_data.CAMPUSES)
+        return args
+
+
+# 路由名 -> (是否需要登录, 生成请求的函数 workload -> (方法, URL, 表单))
+ROUTES = {
+    'index': (False, lambda w: ('GET', '/', None)),
+    'index_keyword': (False, lambda w: ('GET', '/?' + urlencode({'keyword': w.rng.choice(w.keywords)}), None)),
+    'index_category': (False, lambda w: ('GET', f'/?category={w.rng.choice(w.categories)}', None)),
+    'index_keyword_category': (False, lambda w: (
+        'GET', '/?' + urlencode({'keyword': w.rng.choice(w.keywords), 'category': w.rng.choice(w.categories)}),
+        None)),
+    'index_sorted': (False, lambda w: ('GET', '/?' + urlencode(w.browse_args(filtered=False)), None)),
+    'index_filtered': (False, lambda w: ('GET', '/?' + urlencode(w.browse_args()), None)),
+    'product_detail': (False, lambda w: ('GET', f'/product/{w.product()}', None)),
+    'toggle_favorite': (True, lambda w: ('POST', f'/product/{w.product()}/favorite', {})),
+    'favorite_state': (True, lambda w: (
+        'GET', '/api/favorites/state?ids=' + ','.join(str(w.product()) for _ in range(12)), None)),
+    'create_order': (True, lambda w: ('POST', f'/order/create/{w.next_orderable()}',
+                                      {'idempotency_key': w.idempotency_key()})),
+    'user_orders_buy': (True, lambda w: ('GET', '/user/orders?type=buy', None)),
+    'user_orders_sell': (True, lambda w: ('GET', '/user/orders?type=sell', None)),
+    'user_profile': (True, lambda w: ('GET', '/user/profile', None)),
+}
+
+
+def succeeded(route, status, location):
+    if route == 'create_order':
+        return status == 302 and bool(ORDER_URL.search(location))
+    return status == 200
+
+
+class TestClient:
+    """进程内请求：Flask 测试客户端"""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, url, data=None):
+        response = self.client.open(url, method=method, data=data)
+        return response.status_code, response.headers.get('Location', '')
+
+
+class HttpClient:
+    """通过 HTTP/1.1 长连接请求本地服务器，自行保存会话 Cookie"""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookies = SimpleCookie()
+
+    def request(self, method, url, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v.value}' for k, v in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.connection.request(method, url, body, headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # 服务器关闭了空闲连接，重连一次
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.connection.request(method, url, body, headers)
+            response = self.connection.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+        return response.status, response.headers.get('Location', '')
+
+    def close(self):
+        self.connection.close()
+
+
+class QuietHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def login(client, username):
+    status, location = client.request('POST', '/login', {'username': username,
+                                                         'password': seed_data.DEFAULT_PASSWORD})
+    if status != 302 or 'login' in location:
+        raise SystemExit(f'用户 {username} 登录失败')
+
+
+class StatementCounter:
+    """统计所有数据库引擎（包括生产配置中 GET 请求使用的只读连接池）执行的SQL语句数"""
+
+    def __init__(self, current_thread=False):
+        with app.app_context():
+            engines = list(db.engines.values())
+        self.counters = [QueryCounter(engine, current_thread) for engine in engines]
+        self.stack = ExitStack()
+
+    @property
+    def count(self):
+        return sum(counter.count for counter in self.counters)
+
+    def __enter__(self):
+        for counter in self.counters:
+            self.stack.enter_context(counter)
+        return self
+
+    def __exit__(self, *exc):
+        return self.stack.__exit__(*exc)
+
+
+def percentile(values, q):
+    """最近秩法百分位数，values 需已排序"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(latencies, errors, elapsed, statements):
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': round(count / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'sql_per_request': round(sum(statements) / count, 2) if count else 0.0,
+        'sql_max': max(statements) if statements else 0,
+    }
+
+
+def run_inproc(route, workload, clients, anonymous, requests, warmup):
+    needs_login, make = ROUTES[route]
+    latencies, statements = [], []
+    errors = 0
+    for i in range(warmup + requests):
+        client = clients[i % len(clients)] if needs_login else anonymous
+        method, url, data = make(workload)
+        with StatementCounter(current_thread=True) as counter:
+            started = time.perf_counter()
+            status, location = client.request(method, url, data)
+            elapsed = time.perf_counter() - started
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        statements.append(counter.count)
+        errors += not succeeded(route, status, location)
+    return summarize(latencies, errors, sum(latencies), statements)
+
+
+def run_server(route, workload, clients, anonymous, requests, warmup):
+    """每个客户端一个线程，屏障对齐后并发请求；SQL语句数按引擎总数平均"""
+    needs_login, make = ROUTES[route]
+    pool = clients if needs_login else anonymous
+    per_client = max(1, requests // len(pool))
+    barrier = threading.Barrier(len(pool) + 1)
+    latencies = []
+    errors = []
+
+    def worker(client):
+        for i in range(warmup // len(pool) + 1 + per_client):
+            method, url, data = make(workload)
+            started = time.perf_counter()
+            status, location = client.request(method, url, data)
+            elapsed = time.perf_counter() - started
+            if i == warmup // len(pool):
+                # 预热结束，等所有线程就绪后同时开始计时
+                barrier.wait()
+            if i > warmup // len(pool):
+                latencies.append(elapsed)
+                if not succeeded(route, status, location):
+                    errors.append(url)
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in pool]
+    for thread in threads:
+        thread.start()
+    counter = StatementCounter()
+    barrier.wait()
+    with counter:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    statements = [counter.count / max(len(latencies), 1)] * len(latencies)
+    result = summarize(latencies, len(errors), elapsed, statements)
+    result['sql_max'] = None
+    return result
+
+
+def prepare_dataset(args):
+    if args.database:
+        shutil.copy(args.database, DATABASE)
+        print(f'使用已有数据库 {args.database}（副本: {DATABASE}）')
+        return 'custom'
+    init_db.init_database()
+    init_db.create_triggers()
+    with app.app_context():
+        seed_data.seed(**SCALES[args.scale], seed=args.seed)
+    return args.scale
+
+
+def compare(result, baseline, tolerance):
+    """与基准结果逐路由对比，返回退化项列表"""
+    if baseline['meta'].get('mode') != result['meta']['mode'] or \
+            baseline['meta'].get('dataset') != result['meta']['dataset']:
+        print('注意：基准结果的模式或数据集与本次不同，对比仅供参考')
+    regressions = []
+    print(f'\n{"路由":<24}{"p95 变化":>12}{"吞吐变化":>12}{"SQL/请求":>14}')
+    for route, current in result['routes'].items():
+        previous = baseline['routes'].get(route)
+        if previous is None:
+            continue
+        p95 = current['p95_ms'] / previous['p95_ms'] - 1 if previous['p95_ms'] else 0.0
+        throughput = current['throughput'] / previous['throughput'] - 1 if previous['throughput'] else 0.0
+        sql = f'{previous["sql_per_request"]:g} -> {current["sql_per_request"]:g}'
+        print(f'{route:<24}{p95:>+12.1%}{throughput:>+12.1%}{sql:>14}')
+        # 1 毫秒以内的波动不计
+        if p95 > tolerance and current['p95_ms'] - previous['p95_ms'] > 1:
+            regressions.append(f'{route}: p95 {previous["p95_ms"]}ms -> {current["p95_ms"]}ms')
+        if throughput < -tolerance:
+            regressions.append(f'{route}: 吞吐 {previous["throughput"]} -> {current["throughput"]} 次/秒')
+        if current['sql_per_request'] > previous['sql_per_request'] + 0.5:
+            regressions.append(f'{route}: SQL/请求 {sql}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['inproc', 'server'], default='inproc')
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--database', help='已生成的 SQLite 数据库文件（复制后使用，不修改原文件）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--routes', default=','.join(ROUTES), help='逗号分隔的路由名')
+    parser.add_argument('--requests', type=int, default=200, help='每个路由计时的请求数')
+    parser.add_argument('--warmup', type=int, default=20, help='每个路由不计时的预热请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='server 模式的并发客户端数')
+    parser.add_argument('--output', help='保存结果的 JSON 文件')
+    parser.add_argument('--baseline', help='用于对比的基准结果 JSON 文件')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许的 p95 / 吞吐变化比例')
+    args = parser.parse_args()
+    routes = [route for route in args.routes.split(',') if route]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f'未知路由: {", ".join(sorted(unknown))}')
+
+    app.config['TESTING'] = True
+    dataset = prepare_dataset(args)
+    concurrency = args.concurrency if args.mode == 'server' else 1
+    # 每个登录用户一个客户端；server 模式下每个客户端是一个并发线程
+    workload = Workload(max(concurrency, 4), (args.requests + args.warmup) * 2, args.seed)
+
+    server = None
+    if args.mode == 'server':
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        clients = [HttpClient(server.port) for _ in workload.usernames]
+        anonymous = [HttpClient(server.port) for _ in range(concurrency)]
+        runner = run_server
+    else:
+        clients = [TestClient() for _ in workload.usernames]
+        anonymous = TestClient()
+        runner = run_inproc
+    for client, username in zip(clients, workload.usernames):
+        login(client, username)
+
+    results = {}
+    print(f'\n{"路由":<24}{"请求":>6}{"错误":>6}{"吞吐(次/秒)":>12}{"p50(ms)":>10}{"p95(ms)":>10}'
+          f'{"p99(ms)":>10}{"SQL/请求":>10}')
+    for route in routes:
+        results[route] = runner(route, workload, clients, anonymous, args.requests, args.warmup)
+        r = results[route]
+        print(f'{route:<24}{r["requests"]:>6}{r["errors"]:>6}{r["throughput"]:>12}{r["p50_ms"]:>10}'
+              f'{r["p95_ms"]:>10}{r["p99_ms"]:>10}{r["sql_per_request"]:>10}')
+
+    if server is not None:
+        server.shutdown()
+        for client in clients + anonymous:
+            client.close()
+
+    result = {
+        'meta': {
+            'mode': args.mode, 'dataset': dataset, 'seed': args.seed, 'requests': args.requests,
+            'concurrency': concurrency, 'config': os.environ.get('APP_CONFIG', 'default'),
+            'python': platform.python_version(), 'time': datetime.now().isoformat(timespec='seconds'),
+        },
+        'routes': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f'\n结果已保存到 {args.output}')
+
+    failures = sum(r['errors'] for r in results.values())
+    if failures:
+        print(f'\n{failures} 个请求失败')
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+    print('OK' if not failures and not regressions else 'FAIL')
+    sys.exit(1 if failures or regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+生产服务吞吐随核心数的扩展
+在临时数据库中造数，依次以 1、2、4……个 worker 进程（不超过CPU核心数）启动 serve.py（生产配置），
+用若干个客户端进程（每个进程多个线程、每个请求一个连接）在限定时间内请求首页、分类页、详情页、搜索建议与热门商品，
+统计每秒请求数、相对 1 个 worker 的加速比与并行效率、延迟百分位。每一轮结束时发送 SIGTERM，检查：
+- 服务在 SERVE_GRACEFUL_TIMEOUT 内退出，退出码为 0
+- 浏览量写回周期设为 1 小时，详情页的浏览量只在优雅退出时写回：数据库中增加的浏览量应等于成功的详情页请求数
+客户端与服务器运行在同一台机器上，客户端进程也占用CPU；核心数较少时加速比会低于实际部署
+
+用法: python benchmarks/bench_serve.py [--seconds 10] [--concurrency 32] [--workers 1,2,4] [--threads 8] [--asgi]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'serve.db')
+
+from app import app  # noqa: E402
+from models import db, Product  # noqa: E402
+import init_db  # noqa: E402
+import seed_data  # noqa: E402
+
+PRODUCTS = 5000
+DETAIL_SHARE = 0.4
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def prepare():
+    init_db.init_database()
+    init_db.create_triggers()
+    with app.app_context():
+        seed_data.seed(users=500, products=PRODUCTS, orders=3000, favorites=2000, messages=1000, logs=1000)
+        return db.session.execute(
+            db.select(Product.id).where(Product.listed()).order_by(Product.id).limit(500)
+        ).scalars().all()
+
+
+def total_views():
+    with app.app_context():
+        return db.session.execute(db.select(db.func.sum(Product.view_count))).scalar() or 0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers, threads, asgi):
+    env = dict(os.environ, APP_CONFIG='production', CACHE_DIR=os.path.join(WORKDIR, f'cache-{port}'),
+               VIEW_COUNT_FLUSH_INTERVAL='3600', PROFILE_SAMPLE_RATE='0', SERVE_GRACEFUL_TIMEOUT='10')
+    command = [sys.executable, os.path.join(ROOT, 'serve.py'), '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--threads', str(threads), '--server', 'builtin']
+    if asgi:
+        command = command[:-2] + ['--asgi']
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit(f'serve.py 启动失败（退出码 {process.returncode}）')
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit('serve.py 30 秒内没有开始监听')
+
+
+def client_process(port, product_ids, threads, seconds, seed):
+    """一个客户端进程：threads 个线程反复请求，返回 (各请求延迟, 成功的详情页请求数, 错误数)"""
+    rng = random.Random(seed)
+    paths = [f'/product/{product_id}' for product_id in product_ids]
+    others = ['/', '/?category=1', '/?category=3&sort=price_asc', '/api/search/suggestion?q=' + quote('手机'),
+              '/api/products/trending']
+    jobs = [[paths[rng.randrange(len(paths))] if rng.random() < DETAIL_SHARE else rng.choice(others)
+             for _ in range(5000)] for _ in range(threads)]
+    deadline = time.monotonic() + seconds
+    results = [([], 0, 0) for _ in range(threads)]
+
+    def worker(n):
+        latencies, details, errors = [], 0, 0
+        for i in range(len(jobs[n]) * 100):
+            if time.monotonic() >= deadline:
+                break
+            path = jobs[n][i % len(jobs[n])]
+            started = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                continue
+            if response.status != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            details += path.startswith('/product/')
+        results[n] = (latencies, details, errors)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return ([value for latencies, _, _ in results for value in latencies],
+            sum(details for _, details, _ in results), sum(errors for _, _, errors in results))
+
+
+def run_level(workers, args, product_ids, clients):
+    """启动 workers 个进程的服务并施压，返回 (每秒请求数, 延迟列表, 错误数, 详情页请求数, 退出码, 退出耗时)"""
+    port = free_port()
+    server = start_server(port, workers, args.threads, args.asgi)
+    # 预热：每个 worker 编译SQL、填充缓存
+    warmup_details = client_process(port, product_ids, workers * 2, 1, 0)[1]
+    views_before = total_views()
+
+    per_client = max(1, args.concurrency // clients)
+    context = multiprocessing.get_context('fork' if hasattr(os, 'fork') else 'spawn')
+    started = time.perf_counter()
+    with context.Pool(clients) as pool:
+        outputs = pool.starmap(client_process, [(port, product_ids, per_client, args.seconds, seed)
+                                                for seed in range(1, clients + 1)])
+    elapsed = time.perf_counter() - started
+    latencies = [value for output in outputs for value in output[0]]
+    details = sum(output[1] for output in outputs)
+    errors = sum(output[2] for output in outputs)
+
+    stop_started = time.perf_counter()
+    server.send_signal(signal.SIGTERM)
+    try:
+        code = server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        code = server.wait()
+    stop_elapsed = time.perf_counter() - stop_started
+    flushed = total_views() - views_before - warmup_details
+    return len(latencies) / elapsed, latencies, errors, details, flushed, code, stop_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=32, help='客户端并发连接数')
+    parser.add_argument('--workers', help='逗号分隔的 worker 进程数，默认 1、2、4……直到CPU核心数')
+    parser.add_argument('--threads', type=int, default=8, help='每个 worker 的线程数')
+    parser.add_argument('--clients', type=int, help='客户端进程数，默认CPU核心数的一半（至少1个）')
+    parser.add_argument('--asgi', action='store_true', help='以 ASGI 方式（uvicorn）运行服务')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if args.workers:
+        levels = [int(value) for value in args.workers.split(',')]
+    else:
+        levels = sorted({min(2 ** n, cores) for n in range(cores.bit_length() + 1)})
+    clients = args.clients or max(1, cores // 2)
+    if args.asgi:
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise SystemExit('ASGI 模式需要安装 uvicorn：pip install uvicorn')
+
+    product_ids = prepare()
+    print(f'{cores} 个CPU核心，{clients} 个客户端进程共 {args.concurrency} 个并发连接，'
+          f'每个 worker {args.threads} 个线程，每轮 {args.seconds:g}s')
+    print(f'{"worker":>6} {"请求/秒":>9} {"加速比":>7} {"效率":>6} {"p50(ms)":>8} {"p95(ms)":>8} {"p99(ms)":>8} '
+          f'{"错误":>5} {"退出(s)":>7}')
+    failures = 0
+    baseline = None
+    for workers in levels:
+        rate, latencies, errors, details, flushed, code, stop_elapsed = run_level(workers, args, product_ids,
+                                                                                  clients)
+        baseline = baseline or rate / workers
+        speedup = rate / baseline
+        print(f'{workers:>6} {rate:>9.1f} {speedup:>7.2f} {speedup / workers:>6.0%} '
+              f'{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} '
+              f'{percentile(latencies, 0.99) * 1000:>8.1f} {errors:>5} {stop_elapsed:>7.2f}')
+        if code != 0:
+            print(f'FAIL {workers} 个 worker 的服务退出码为 {code}')
+            failures += 1
+        if flushed != details:
+            print(f'FAIL 退出时写回浏览量 {flushed}，成功的详情页请求 {details} 次')
+            failures += 1
+        if errors:
+            print(f'FAIL {errors} 个请求失败')
+            failures += 1
+
+    print('OK' if not failures else f'{failures} 项检查失败')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
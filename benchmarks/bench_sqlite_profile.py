@@ -0,0 +1,127 @@
+"""
+SQLite 连接配置基准测试
+分别用默认配置与 ProductionConfig 的 PRAGMA / 连接池配置，启动 N 个写进程（可选 M 个读进程）
+并发执行“插入日志 + 更新商品计数”的小事务，比较吞吐量与 database is locked 错误数
+
+用法: python benchmarks/bench_sqlite_profile.py [--writers 8] [--readers 4] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from config import ProductionConfig  # noqa: E402
+from db_profile import apply_sqlite_pragmas  # noqa: E402
+from models import db  # noqa: E402
+
+PRODUCTS = 1000
+
+
+def make_engine(path, profile):
+    if profile == 'production':
+        engine = create_engine(f'sqlite:///{path}', **ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS)
+        apply_sqlite_pragmas(engine, ProductionConfig.SQLITE_PRAGMAS)
+    else:
+        engine = create_engine(f'sqlite:///{path}')
+    return engine
+
+
+def prepare(path, profile):
+    engine = make_engine(path, profile)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, student_id, username, password_hash, real_name, email) "
+                          "VALUES (1, '1', 'bench', 'x', 'bench', 'bench@example.com')"))
+        conn.execute(text("INSERT INTO categories (id, name) VALUES (1, 'bench')"))
+        conn.execute(text("INSERT INTO products (title, description, price, category_id, seller_id, "
+                          "view_count, favorite_count, status, is_deleted) "
+                          "VALUES ('p', 'd', 1, 1, 1, 0, 0, 'available', 0)"),
+                     [{}] * PRODUCTS)
+    engine.dispose()
+
+
+def writer(path, profile, deadline, results):
+    engine = make_engine(path, profile)
+    rng = random.Random(os.getpid())
+    ok = locked = 0
+    while time.time() < deadline:
+        try:
+            with engine.begin() as conn:
+                product_id = rng.randint(1, PRODUCTS)
+                conn.execute(text("UPDATE products SET view_count = view_count + 1 WHERE id = :id"),
+                             {'id': product_id})
+                conn.execute(text("INSERT INTO system_logs (user_id, action, record_id, created_at) "
+                                  "VALUES (1, 'bench', :id, CURRENT_TIMESTAMP)"), {'id': product_id})
+            ok += 1
+        except OperationalError as exc:
+            if 'locked' not in str(exc):
+                raise
+            locked += 1
+    results.put(('write', ok, locked))
+
+
+def reader(path, profile, deadline, results):
+    engine = make_engine(path, profile)
+    rng = random.Random(os.getpid())
+    ok = locked = 0
+    while time.time() < deadline:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT * FROM products WHERE status = 'available' "
+                                  "ORDER BY created_at DESC LIMIT 12 OFFSET :o"),
+                             {'o': rng.randint(0, PRODUCTS - 12)}).all()
+            ok += 1
+        except OperationalError as exc:
+            if 'locked' not in str(exc):
+                raise
+            locked += 1
+    results.put(('read', ok, locked))
+
+
+def run(profile, writers, readers, seconds):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    prepare(path, profile)
+    results = multiprocessing.Queue()
+    deadline = time.time() + seconds
+    procs = [multiprocessing.Process(target=writer, args=(path, profile, deadline, results))
+             for _ in range(writers)]
+    procs += [multiprocessing.Process(target=reader, args=(path, profile, deadline, results))
+              for _ in range(readers)]
+    for p in procs:
+        p.start()
+    totals = {'write': [0, 0], 'read': [0, 0]}
+    for _ in procs:
+        kind, ok, locked = results.get()
+        totals[kind][0] += ok
+        totals[kind][1] += locked
+    for p in procs:
+        p.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f'{args.writers} 个写进程, {args.readers} 个读进程, 每组 {args.seconds}s')
+    for profile in ('default', 'production'):
+        totals = run(profile, args.writers, args.readers, args.seconds)
+        (w_ok, w_locked), (r_ok, r_locked) = totals['write'], totals['read']
+        print(f'{profile:<11} 写: {w_ok / args.seconds:8.0f} tx/s (locked {w_locked})  '
+              f'读: {r_ok / args.seconds:8.0f} q/s (locked {r_locked})')
+
+
+if __name__ == '__main__':
+    main()
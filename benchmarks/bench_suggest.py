@@ -0,0 +1,77 @@
+"""
+搜索建议前缀索引基准测试
+生成100万条商品标题，测量 PrefixIndex.lookup 的 p50/p99 延迟
+
+用法: python benchmarks/bench_suggest.py [--titles 1000000] [--queries 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from suggest import PrefixIndex  # noqa: E402
+
+BRANDS = ['iPhone', 'iPad', 'MacBook', 'ThinkPad', '小米', '华为', '联想', '戴尔', '索尼', '佳能',
+          '美的', '雅马哈', '迪卡侬', '耐克', '阿迪达斯', '罗技', 'Kindle', 'Switch']
+ITEMS = ['手机', '平板', '笔记本', '耳机', '显示器', '键盘', '鼠标', '吉他', '自行车', '台灯',
+         '电热水壶', '篮球', '羽毛球拍', '教材', '考研资料', '小说', '外套', '运动鞋', '书包', '相机']
+ADJECTIVES = ['九成新', '全新未拆', '几乎全新', '轻微使用痕迹', '低价转让', '毕业甩卖', '急出', '']
+
+
+def make_titles(n, seed):
+    rng = random.Random(seed)
+    return [f'{rng.choice(BRANDS)} {rng.choice(ITEMS)} {rng.choice(ADJECTIVES)} {i}'
+            for i in range(n)]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--titles', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=20_000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    titles = make_titles(args.titles, args.seed)
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.load(enumerate(titles))
+    print(f'加载 {len(index)} 条标题耗时 {time.perf_counter() - start:.2f}s')
+
+    rng = random.Random(args.seed + 1)
+    prefixes = [t[:rng.randint(1, 6)] for t in rng.sample(titles, min(args.queries, len(titles)))]
+
+    latencies = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.lookup(prefix, args.limit)
+        latencies.append(time.perf_counter() - start)
+    print(f'查询 {len(latencies)} 次: p50={percentile(latencies, 50) * 1e6:.1f}us '
+          f'p99={percentile(latencies, 99) * 1e6:.1f}us max={max(latencies) * 1e6:.1f}us')
+
+    # 增量更新（发布、售出）混合查询
+    start = time.perf_counter()
+    for i in range(10_000):
+        index.add(len(titles) + i, f'新发布 商品 {i}')
+        index.remove(i, titles[i])
+    print(f'增量更新 20000 次耗时 {(time.perf_counter() - start) * 1e3:.1f}ms')
+
+    latencies = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.lookup(prefix, args.limit)
+        latencies.append(time.perf_counter() - start)
+    print(f'更新后查询: p50={percentile(latencies, 50) * 1e6:.1f}us '
+          f'p99={percentile(latencies, 99) * 1e6:.1f}us')
+
+
+if __name__ == '__main__':
+    main()
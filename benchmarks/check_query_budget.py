@@ -0,0 +1,90 @@
+"""
+页面SQL语句预算检查
+在临时数据库中造数后逐个请求列表/详情页，任何页面的SQL语句数超过预算即失败（退出码1）
+预算与每页条数无关，新增模板访问关联对象导致N+1时这里会第一时间报出
+
+用法: python benchmarks/check_query_budget.py
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'budget.db')
+
+from app import app  # noqa: E402
+from models import db, Product, Order, Favorite  # noqa: E402
+from query_counter import check_request_budget  # noqa: E402
+from user_stats import reconcile_user_stats  # noqa: E402
+from browse import rebuild_facet_counts, invalidate_facets  # noqa: E402
+import init_db  # noqa: E402
+import messaging  # noqa: E402
+
+# 页面 -> 允许的最大SQL语句数（登录后先访问一次，load_user 的用户快照已在缓存中，不计入；
+# 个人中心需要完整的 User 对象，按主键加载1条）
+BUDGETS = [
+    # 首页冷缓存：分面计数汇总表、列表、热门商品、分类、校区（列表之后的三项之后都走缓存）
+    ('/', 5),
+    ('/?category=1', 5),
+    ('/?keyword=笔记本', 3),
+    ('/product/1', 4),
+    ('/order/1', 1),
+    ('/user/profile', 4),
+    ('/user/products', 2),
+    ('/user/orders?type=buy', 1),
+    ('/user/orders?type=sell', 1),
+    ('/user/favorites', 1),
+    # 收件箱：会话（连接对方与商品）、最后一条消息、按会话的未读数
+    ('/messages', 3),
+]
+
+
+def seed(count=40):
+    """为 zhangsan(1) 生成足够多的商品、订单与收藏，使每页都是满页"""
+    with app.app_context():
+        for i in range(count):
+            db.session.add(Product(title=f'测试商品{i}', description='预算检查', price=10 + i,
+                                   category_id=1 + i % 8, seller_id=2 + i % 2))
+        db.session.commit()
+        products = Product.query.filter(Product.seller_id != 1).all()
+        for i, product in enumerate(products):
+            db.session.add(Order(order_no=f'BUDGET{i:05d}', product_id=product.id, buyer_id=1,
+                                 seller_id=product.seller_id, price=product.price))
+            db.session.add(Favorite(user_id=1, product_id=product.id))
+        db.session.commit()
+        for product in products:
+            messaging.send_message(product.seller_id, 1, '预算检查', product.id)
+        reconcile_user_stats()
+        # 商品直接经 ORM 插入，没有走 bump_facet()，与 seed_data.py 一样重新统计分面计数
+        rebuild_facet_counts()
+        db.session.commit()
+        invalidate_facets()
+
+
+def main():
+    app.config['TESTING'] = True
+    app.config['AUDIT_SYNC'] = True
+    init_db.init_database()
+    seed()
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'zhangsan', 'password': '123456'})
+    client.get('/login')
+
+    failures = 0
+    for url, budget in BUDGETS:
+        try:
+            response = check_request_budget(client, url, budget)
+            status = 'OK  ' if response.status_code == 200 else f'{response.status_code} '
+            print(f'{status} {url}')
+            failures += response.status_code != 200
+        except AssertionError as exc:
+            print(f'FAIL {exc}')
+            failures += 1
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+查询计划检查
+在临时数据库中造数并执行 ANALYZE，用测试客户端请求 app.py 中的每一个路由（含表单提交）以及定期任务，
+记录执行过的所有SQL语句，逐条执行 EXPLAIN QUERY PLAN：任何语句对数据表做全表扫描
+（计划中出现不带索引的 SCAN <表>，小表与 WHOLE_LISTING 除外）即失败（退出码1）；有路由没有被请求到时同样失败，提醒补充到 drive()
+
+用法: python benchmarks/check_query_plans.py [--verbose]   # --verbose 打印每条语句的查询计划
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'plans.db')
+
+from flask import request  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, Product  # noqa: E402
+from reservations import order_sweeper  # noqa: E402
+import init_db  # noqa: E402
+import payments  # noqa: E402
+import seed_data  # noqa: E402
+
+# 只有几十行的字典表与汇总表，全表扫描比走索引更快
+SMALL_TABLES = {'categories', 'product_facet_counts'}
+SCAN = re.compile(r'^SCAN (\S+)$')
+# 读取整个在售集合、没有其他条件的语句（列表总数、搜索建议词表）：结果有缓存，
+# 在售商品占大多数，扫描部分索引与全表扫描代价相当，SQLite 3.45 之前的规划器也不会用部分索引计数
+WHOLE_LISTING = re.compile(r"FROM products WHERE products\.is_deleted = 0 AND products\.status = 'available'"
+                           r"(\) AS anon_1)?$")
+
+
+class StatementLog:
+    """记录所有引擎执行的语句（去重，保留第一次的参数）"""
+
+    def __init__(self):
+        self.statements = {}
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and not statement.lstrip().upper().startswith(('PRAGMA', 'EXPLAIN')):
+            self.statements.setdefault(' '.join(statement.split()), parameters)
+
+    def install(self):
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+
+
+def prepare():
+    """造数（数据量足以让 ANALYZE 统计出真实的选择性），zhangsan(1) 作为登录用户"""
+    init_db.init_database()
+    init_db.create_triggers()
+    with app.app_context():
+        seed_data.seed(users=300, products=5000, orders=8000, favorites=4000, messages=2000, logs=2000)
+        # 连接池中已打开的连接在 ANALYZE 之前加载过统计信息，关闭后按新的统计信息选择索引
+        for engine in db.engines.values():
+            engine.dispose()
+        # 用于下单与支付：价格低于 zhangsan 余额、不属于 zhangsan 的在售商品
+        return db.session.execute(
+            db.select(Product.id).where(Product.listed(), Product.seller_id != 1, Product.price < 100)
+            .order_by(Product.id).limit(3)
+        ).scalars().all()
+
+
+def order_id_from(response):
+    match = re.search(r'/order/(\d+)$', response.headers.get('Location', ''))
+    return int(match.group(1)) if match else None
+
+
+def drive(client, candidates):
+    """请求每个路由，返回 [(描述, 状态码)]"""
+    results = []
+
+    def hit(method, url, **kwargs):
+        response = getattr(client, method)(url, **kwargs)
+        results.append((f'{method.upper()} {url}', response.status_code))
+        return response
+
+    hit('get', '/register')
+    hit('post', '/register', data={'student_id': 'P0001', 'username': 'plancheck', 'password': '123456',
+                                   'real_name': '计划检查', 'email': 'plancheck@example.com'})
+    hit('get', '/login')
+    hit('post', '/login', data={'username': 'zhangsan', 'password': '123456'})
+
+    first = hit('get', '/')
+    hit('get', '/?category=1')
+    hit('get', '/?keyword=手机')
+    hit('get', '/?keyword=手机&category=1')
+    hit('get', '/?page=2')
+    cursor = re.search(r'cursor=([\w-]+)', first.get_data(as_text=True))
+    if cursor:
+        hit('get', f'/?cursor={cursor.group(1)}')
+        hit('get', f'/?category=1&cursor={cursor.group(1)}')
+    # 分面浏览：每种排序（含翻页）与各过滤条件
+    for sort in ('price_asc', 'price_desc', 'popular'):
+        for query in (f'sort={sort}', f'category=1&sort={sort}'):
+            page = hit('get', f'/?{query}')
+            cursor = re.search(r'cursor=([\w-]+)', page.get_data(as_text=True))
+            if cursor:
+                hit('get', f'/?{query}&cursor={cursor.group(1)}')
+    hit('get', '/?min_price=20&max_price=200')
+    hit('get', '/?category=1&min_price=20&max_price=200&sort=price_asc')
+    hit('get', '/?condition=全新')
+    hit('get', '/?category=1&condition=全新')
+    hit('get', '/?campus=东区&sort=popular')
+    hit('get', '/?category=1&campus=东区&condition=几乎全新&min_price=10&max_price=500')
+    hit('get', '/?keyword=手机&sort=price_asc&min_price=10')
+
+    product_id, pay_product_id, cancel_product_id = candidates
+    hit('get', f'/product/{product_id}')
+    hit('post', f'/product/{product_id}/favorite')
+    hit('post', f'/product/{product_id}/favorite', json={'favorited': True})
+    hit('post', f'/product/{product_id}/favorite', data={'favorited': '0'})
+    hit('get', f'/api/favorites/state?ids={product_id},{pay_product_id},{cancel_product_id}')
+    hit('get', '/product/publish')
+    hit('post', '/product/publish', data={'title': '计划检查商品', 'description': '检查', 'price': '12',
+                                          'category_id': '1', 'condition': '全新', 'trade_location': '东门'})
+
+    order_id = order_id_from(hit('post', f'/order/create/{product_id}',
+                                 data={'idempotency_key': 'plan-check-create'}))
+    hit('get', f'/order/{order_id}')
+    hit('post', f'/order/{order_id}/pay', data={'idempotency_key': 'plan-check-pay'})
+    paid_id = order_id_from(hit('post', f'/order/create/{pay_product_id}'))
+    hit('post', f'/order/{paid_id}/pay')
+    hit('post', f'/order/{paid_id}/status', data={'target': 'refunding'})
+    cancel_id = order_id_from(hit('post', f'/order/create/{cancel_product_id}'))
+    hit('post', f'/order/{cancel_id}/cancel')
+    hit('post', f'/order/{order_id}/complete')
+
+    hit('get', '/user/profile')
+    hit('get', '/user/products')
+    hit('get', '/user/orders?type=buy')
+    hit('get', '/user/orders?type=sell')
+    hit('get', '/user/favorites')
+
+    thread = hit('post', '/messages/send', data={'receiver_id': '2', 'product_id': str(product_id),
+                                                 'content': '你好'})
+    hit('get', '/messages')
+    hit('get', thread.headers.get('Location', '/messages'))
+    hit('get', '/api/messages/unread')
+    hit('get', '/api/messages/unread?since=0&timeout=0')
+    stream = hit('get', '/api/messages/stream')
+    stream.get_data()
+
+    hit('get', '/api/search/suggestion?q=小米')
+    hit('get', '/api/products/trending')
+    hit('get', '/api/products/trending?category=1')
+    hit('get', '/api/cache/stats')
+    hit('get', '/metrics')
+    hit('get', '/product/999999999')
+    hit('get', '/logout')
+    return results
+
+
+def explain(statement, parameters):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            return connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters or ()).all()
+
+
+def full_scans(plan, tables):
+    """计划中对数据表的全表扫描；别名（users_1 等）还原为表名，子查询物化表不计"""
+    scanned = []
+    for row in plan:
+        match = SCAN.match(row[3])
+        if not match:
+            continue
+        name = match.group(1)
+        table = name if name in tables else re.sub(r'_\d+$', '', name)
+        if table in tables and table not in SMALL_TABLES:
+            scanned.append(table)
+    return scanned
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    app.config['TESTING'] = True
+    app.config['AUDIT_SYNC'] = True
+    app.config['ORDER_PENDING_TIMEOUT_MINUTES'] = app.config['ORDER_PENDING_TIMEOUT_MINUTES'] or 30
+    app.config['MESSAGE_STREAM_TIMEOUT'] = 0.2
+    app.config['MESSAGE_HEARTBEAT'] = 0.1
+    candidates = prepare()
+
+    endpoints = set()
+    app.before_request(lambda: endpoints.add(request.endpoint))
+    log = StatementLog()
+    log.install()
+
+    failures = 0
+    for label, status in drive(app.test_client(), candidates):
+        if status >= 500:
+            print(f'FAIL {label} 返回 {status}')
+            failures += 1
+    # 定期任务：超时订单清理与货款结算
+    order_sweeper.sweep()
+    with app.app_context():
+        payments.settle_all()
+
+    missing = {rule.endpoint for rule in app.url_map.iter_rules()} - endpoints - {'static'}
+    for endpoint in sorted(missing):
+        print(f'FAIL 路由 {endpoint} 没有被请求，请补充到 drive()')
+        failures += 1
+
+    tables = set(db.metadata.tables)
+    for statement, parameters in log.statements.items():
+        plan = explain(statement, parameters)
+        scans = [] if WHOLE_LISTING.search(statement) else full_scans(plan, tables)
+        if scans or args.verbose:
+            print(f'{"FAIL" if scans else "    "} {statement[:300]}')
+            for row in plan:
+                print(f'       {row[3]}')
+        if scans:
+            failures += 1
+
+    print(f'共检查 {len(log.statements)} 条不同的SQL语句，覆盖 {len(endpoints)} 个路由')
+    print('OK' if not failures else f'{failures} 项检查失败')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+下单并发压力测试
+在临时数据库中准备若干商品与买家，每一轮让 N 个线程（各自登录不同买家）同时对同一商品下单，
+检查每个商品恰好只产生一个订单、商品状态为 reserved，并统计数据库忙重试次数与耗时
+最后把所有订单的创建时间改到超时之前，执行一次超时清理，检查订单被取消、商品被释放
+
+用法: python benchmarks/stress_reserve.py [--threads 16] [--rounds 20]
+      APP_CONFIG=production python benchmarks/stress_reserve.py   # 使用 WAL 与连接池配置
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'stress.db')
+
+from app import app  # noqa: E402
+from models import db, User, Product, Order  # noqa: E402
+import init_db  # noqa: E402
+import reservations  # noqa: E402
+from reservations import order_sweeper  # noqa: E402
+
+
+def prepare(buyers, rounds):
+    with app.app_context():
+        for i in range(buyers):
+            user = User(student_id=f'S{i:05d}', username=f'buyer{i}', real_name=f'买家{i}',
+                        email=f'buyer{i}@example.com')
+            user.set_password('123456')
+            db.session.add(user)
+        products = [Product(title=f'抢购商品{i}', description='压力测试', price=1,
+                            category_id=1, seller_id=1) for i in range(rounds)]
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.id for product in products]
+
+
+def race(product_id, clients):
+    """所有线程在屏障处对齐后同时下单，返回成功创建订单的线程数"""
+    barrier = threading.Barrier(len(clients))
+    wins = []
+
+    def buy(client):
+        barrier.wait()
+        response = client.post(f'/order/create/{product_id}')
+        if re.search(r'/order/\d+$', response.headers.get('Location', '')):
+            wins.append(1)
+
+    threads = [threading.Thread(target=buy, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(wins)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    app.config['TESTING'] = True
+    app.config['AUDIT_SYNC'] = True
+    init_db.init_database()
+    product_ids = prepare(args.threads, args.rounds)
+
+    clients = []
+    for i in range(args.threads):
+        client = app.test_client()
+        client.post('/login', data={'username': f'buyer{i}', 'password': '123456'})
+        clients.append(client)
+
+    failures = 0
+    started = time.perf_counter()
+    for product_id in product_ids:
+        wins = race(product_id, clients)
+        if wins != 1:
+            print(f'FAIL 商品 {product_id}: {wins} 个买家下单成功')
+            failures += 1
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        for product_id in product_ids:
+            orders = Order.query.filter_by(product_id=product_id).count()
+            status = db.session.get(Product, product_id).status
+            if orders != 1 or status != 'reserved':
+                print(f'FAIL 商品 {product_id}: {orders} 个订单，状态 {status}')
+                failures += 1
+
+    requests = args.threads * args.rounds
+    print(f'{args.rounds} 轮 x {args.threads} 线程，共 {requests} 次下单请求，'
+          f'耗时 {elapsed:.2f}s（{requests / elapsed:.0f} 次/秒），数据库忙重试 {reservations.busy_retries} 次')
+
+    # 超时清理：把订单创建时间提前到超时之前
+    with app.app_context():
+        timeout = timedelta(minutes=app.config['ORDER_PENDING_TIMEOUT_MINUTES'] or 30)
+        db.session.execute(db.update(Order).values(created_at=datetime.now() - timeout * 2))
+        db.session.commit()
+    app.config['ORDER_PENDING_TIMEOUT_MINUTES'] = app.config['ORDER_PENDING_TIMEOUT_MINUTES'] or 30
+    expired = order_sweeper.sweep()
+    with app.app_context():
+        released = Product.query.filter(Product.id.in_(product_ids), Product.status == 'available').count()
+    print(f'超时清理：取消 {expired} 个订单，释放 {released} 个商品')
+    if expired != args.rounds or released != args.rounds:
+        failures += 1
+
+    print('OK' if not failures else f'{failures} 项检查失败')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+首页分面浏览
+- 过滤：分类、价格区间、新旧程度、校区（卖家的 users.campus）；排序：最新、价格升序/降序、最热
+- 每种排序都有对应的在售部分索引 ([category_id,] 排序列, id)，按排序列做游标分页，不使用 OFFSET
+- 分面计数（各分类、各新旧程度的在售商品数）：
+  只按分类、新旧程度过滤时直接读取 product_facet_counts 汇总表（几十行）。汇总表由写路径在同一事务内增量维护
+  （发布 +1，预订 -1，订单取消/退款释放商品 +1，见 bump_facet）；已有数据库由 init_db.py --migrate-facets 建表并统计一次；
+  带价格区间或校区时按其余条件各做一次 GROUP BY（只扫描 idx_products_listed_facets 覆盖索引），
+  结果放入两级缓存 FACET_CACHE_TTL 秒。列表总数直接由分类计数得出，不再单独 COUNT
+- 访问路径：SQLite 选择索引时不考虑 LIMIT，价格区间等条件命中很多行时会走条件列的索引再把全部结果排序。
+  已知总数后，结果足够多时屏蔽条件列上的索引（一元 +），沿排序索引读取、逐行检查条件，读满一页即停；
+  结果很少时仍走条件列的索引，只排序少量结果
+"""
+from flask import current_app
+from sqlalchemy.sql.expression import UnaryExpression
+from sqlalchemy.sql.operators import custom_op
+
+from models import db, Product, ProductFacetCount, User
+from cache import cache
+
+# 排序参数 -> (排序列, 是否倒序)
+SORTS = {
+    'newest': (Product.created_at, True),
+    'price_asc': (Product.price, False),
+    'price_desc': (Product.price, True),
+    'popular': (Product.hot_score, True),
+}
+SORT_LABELS = {'newest': '最新发布', 'price_asc': '价格从低到高', 'price_desc': '价格从高到低',
+               'popular': '最热'}
+CONDITIONS = ('全新', '几乎全新', '轻微使用痕迹', '明显使用痕迹')
+
+
+def _no_index(column):
+    """+column：值不变，但SQLite不会为这一条件使用 column 上的索引"""
+    return UnaryExpression(column, operator=custom_op('+'), type_=column.type)
+
+
+def _price(value):
+    try:
+        price = round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+    return price if 0 <= price < float('inf') else None
+
+
+class BrowseFilters:
+    """首页的过滤与排序参数（无效值按未设置处理）"""
+
+    def __init__(self, category_id=None, min_price=None, max_price=None, condition=None, campus=None,
+                 sort='newest'):
+        if min_price is not None and max_price is not None and min_price > max_price:
+            min_price, max_price = max_price, min_price
+        self.category_id = category_id
+        self.min_price = min_price
+        self.max_price = max_price
+        self.condition = condition if condition in CONDITIONS else None
+        self.campus = (campus or '').strip()[:50] or None
+        self.sort = sort if sort in SORTS else 'newest'
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(category_id=args.get('category', type=int),
+                   min_price=_price(args.get('min_price')),
+                   max_price=_price(args.get('max_price')),
+                   condition=args.get('condition'),
+                   campus=args.get('campus'),
+                   sort=args.get('sort'))
+
+    @property
+    def sort_column(self):
+        return SORTS[self.sort]
+
+    @property
+    def is_filtered(self):
+        """除分类外是否设置了其他过滤条件"""
+        return any(value is not None for value in (self.min_price, self.max_price, self.condition, self.campus))
+
+    def key(self):
+        return (self.category_id, self.min_price, self.max_price, self.condition, self.campus, self.sort)
+
+    def url_args(self, **overrides):
+        """生成链接用的查询参数（省略未设置的项），overrides 中值为 None 表示去掉该参数"""
+        args = {'category': self.category_id, 'min_price': self.min_price, 'max_price': self.max_price,
+                'condition': self.condition, 'campus': self.campus,
+                'sort': None if self.sort == 'newest' else self.sort}
+        args.update(overrides)
+        return {name: value for name, value in args.items() if value is not None}
+
+    def clauses(self, exclude=None, scan_sort_index=False):
+        """在售条件之外的过滤条件；exclude 为 'category' 或 'condition' 时省略该项（用于分面计数）
+        scan_sort_index 时排序列以外的条件列不使用索引，查询只能沿 ([category_id,] 排序列) 索引读取"""
+        sort_col = self.sort_column[0]
+
+        def column(col):
+            return _no_index(col) if scan_sort_index and col is not sort_col else col
+
+        clauses = []
+        if self.category_id and exclude != 'category':
+            clauses.append(Product.category_id == self.category_id)
+        if self.condition and exclude != 'condition':
+            clauses.append(column(Product.condition) == self.condition)
+        if self.min_price is not None:
+            clauses.append(column(Product.price) >= self.min_price)
+        if self.max_price is not None:
+            clauses.append(column(Product.price) <= self.max_price)
+        if self.campus:
+            clauses.append(column(Product.seller_id).in_(db.select(User.id).where(User.campus == self.campus)))
+        return clauses
+
+
+def listing_query(filters, facets=None, per_page=12):
+    """在售商品查询（未排序），由调用方分页
+    给出分面计数时据此选择访问路径：沿排序索引读一页约需读取 per_page * base / total 行，
+    走条件列索引需要排序 total 行，前者更少时屏蔽条件列的索引"""
+    scan = bool(facets) and facets['total'] ** 2 >= per_page * facets['base']
+    return Product.query.filter(Product.listed(), *filters.clauses(scan_sort_index=scan))
+
+
+def _facet(column, filters, exclude):
+    def load():
+        rows = db.session.execute(
+            db.select(column, db.func.count())
+            .where(Product.listed(), *filters.clauses(exclude=exclude))
+            .group_by(column)
+        ).all()
+        return {value: count for value, count in rows if value is not None}
+    # 分类计数与所选分类无关、新旧程度计数与所选新旧程度无关，缓存键中去掉对应的项
+    key = (exclude, filters.min_price, filters.max_price, filters.campus,
+           filters.condition if exclude == 'category' else filters.category_id)
+    return cache.get_or_set('facets', key, load, current_app.config['FACET_CACHE_TTL'])
+
+
+def facet_counts(filters):
+    """{'categories': {分类ID: 数量}, 'conditions': {新旧程度: 数量}, 'total': 当前条件下的商品总数,
+        'base': 所选分类（未选时为全部）的在售商品总数}"""
+    rows = db.session.execute(
+        db.select(ProductFacetCount.category_id, ProductFacetCount.condition, ProductFacetCount.listed_count)
+    ).all()
+    base = sum(count for category_id, _, count in rows
+               if not filters.category_id or category_id == filters.category_id)
+    if filters.min_price is None and filters.max_price is None and not filters.campus:
+        categories, conditions = {}, {}
+        for category_id, condition, count in rows:
+            if not filters.condition or condition == filters.condition:
+                categories[category_id] = categories.get(category_id, 0) + count
+            if condition and (not filters.category_id or category_id == filters.category_id):
+                conditions[condition] = conditions.get(condition, 0) + count
+    else:
+        categories = _facet(Product.category_id, filters, 'category')
+        conditions = _facet(Product.condition, filters, 'condition')
+    if filters.category_id:
+        total = categories.get(filters.category_id, 0)
+    else:
+        total = sum(categories.values())
+    return {'categories': categories, 'conditions': conditions, 'total': total, 'base': base}
+
+
+def rebuild_facet_counts():
+    """从 products 表重新统计分面计数汇总表（建表、导入数据后执行），返回在售商品总数；由调用方提交"""
+    db.session.execute(db.delete(ProductFacetCount))
+    condition = db.func.coalesce(Product.condition, '')
+    db.session.execute(db.insert(ProductFacetCount).from_select(
+        ['category_id', 'condition', 'listed_count'],
+        db.select(Product.category_id, condition, db.func.count())
+        .where(Product.listed()).group_by(Product.category_id, condition)
+    ))
+    return db.session.execute(db.select(db.func.sum(ProductFacetCount.listed_count))).scalar() or 0
+
+
+def bump_facet(product_id, delta):
+    """商品进入（delta=1）或离开（delta=-1）在售状态时，在当前会话事务中增减其 (分类, 新旧程度) 的计数；由调用方提交"""
+    category_id = db.select(Product.category_id).where(Product.id == product_id).scalar_subquery()
+    condition = db.select(db.func.coalesce(Product.condition, '')).where(Product.id == product_id).scalar_subquery()
+    result = db.session.execute(
+        db.update(ProductFacetCount)
+        .where(ProductFacetCount.category_id == category_id, ProductFacetCount.condition == condition)
+        .values(listed_count=ProductFacetCount.listed_count + delta)
+    )
+    if result.rowcount == 0:
+        # 该组合的第一个在售商品：补一行
+        db.session.execute(db.insert(ProductFacetCount).from_select(
+            ['category_id', 'condition', 'listed_count'],
+            db.select(Product.category_id, db.func.coalesce(Product.condition, ''), db.literal(max(delta, 0)))
+            .where(Product.id == product_id)
+        ))
+
+
+def campuses():
+    """有用户登记过的校区列表（走 idx_users_campus，与分类列表一样长时间缓存）"""
+    def load():
+        return list(db.session.execute(
+            db.select(User.campus).where(User.campus.is_not(None), User.campus != '')
+            .distinct().order_by(User.campus)
+        ).scalars())
+    return cache.get_or_set('campuses', 'all', load, current_app.config['CACHE_CATEGORY_TTL'])
+
+
+def invalidate_facets():
+    cache.invalidate('facets')
@@ -0,0 +1,258 @@
+"""
+两级缓存
+- 一级：进程内 LRU + TTL（OrderedDict），命中时不做任何IO
+- 二级（可选）：本地文件目录，多个 worker 进程共享同一份渲染结果
+失效采用"命名空间代数"：每个命名空间有一个代数计数器，写路径调用 invalidate() 只把代数加一，
+旧代数下的键自然失效。配置了共享目录时代数保存在内存映射文件中，所有进程立即可见
+"""
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，代数自增退化为进程内加锁
+    fcntl = None
+
+_MISSING = object()
+
+
+class LRUCache:
+    """带过期时间的进程内 LRU 缓存"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return _MISSING
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileBackend:
+    """共享文件缓存：每个键一个文件，内容为 pickle 后的 (过期时间戳, 键, 值)，写入用临时文件+原子替换
+    文件的修改时间设为过期时间，清理时只需 stat，不必读取内容；每写入 sweep_every 次清理一次目录：
+    删除已过期的文件（包括旧代数的键），仍超过 max_entries 个时再删除最早过期的文件"""
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.sweep_every = max(1, max_entries // 20)
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.cache')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, stored_key, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+        if expires < time.time() or stored_key != key:
+            return _MISSING
+        return value
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires, key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.utime(tmp_path, (expires, expires))
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        with self._lock:
+            self._writes += 1
+            due = self._writes >= self.sweep_every
+            if due:
+                self._writes = 0
+        if due:
+            self.sweep()
+
+    def sweep(self):
+        """删除过期的缓存文件，并把文件数限制在 max_entries 以内，返回删除的文件数"""
+        now = time.time()
+        removed = 0
+        alive = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.cache'):
+                continue
+            try:
+                expires = entry.stat().st_mtime
+                if expires < now:
+                    os.unlink(entry.path)
+                    removed += 1
+                else:
+                    alive.append((expires, entry.path))
+            except OSError:
+                pass
+        if len(alive) > self.max_entries:
+            alive.sort()
+            for _, path in alive[:len(alive) - self.max_entries]:
+                try:
+                    os.unlink(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class GenerationTable:
+    """命名空间代数表；给定文件路径时使用内存映射，多进程共享"""
+
+    SLOTS = 64
+    _FORMAT = '<Q'
+
+    def __init__(self, path=None, slots=None):
+        self.slots = slots or self.SLOTS
+        self._lock = threading.Lock()
+        self._local = {}
+        self._file = None
+        self._mmap = None
+        if path:
+            size = self.slots * 8
+            self._file = open(path, 'a+b')
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+
+    def _slot(self, namespace):
+        # 槽位冲突只会导致多失效一次，不影响正确性
+        return (zlib.crc32(namespace.encode('utf-8')) % self.slots) * 8
+
+    def get(self, namespace):
+        if self._mmap is None:
+            return self._local.get(namespace, 0)
+        return struct.unpack_from(self._FORMAT, self._mmap, self._slot(namespace))[0]
+
+    def bump(self, namespace):
+        """代数加一，返回新的代数"""
+        with self._lock:
+            if self._mmap is None:
+                value = self._local[namespace] = self._local.get(namespace, 0) + 1
+                return value
+            offset = self._slot(namespace)
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                value = struct.unpack_from(self._FORMAT, self._mmap, offset)[0] + 1
+                struct.pack_into(self._FORMAT, self._mmap, offset, value)
+                return value
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+
+class Cache:
+    """两级缓存扩展，按命名空间统计命中率"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.local = LRUCache()
+        self.shared = None
+        self.generations = GenerationTable()
+        self._lock = threading.Lock()
+        self._stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.local = LRUCache(app.config['CACHE_MAX_ENTRIES'])
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'file':
+            directory = app.config['CACHE_DIR']
+            self.shared = FileBackend(directory, app.config['CACHE_FILE_MAX_ENTRIES'])
+            self.generations = GenerationTable(os.path.join(directory, 'generations.bin'))
+        elif backend != 'local':
+            raise ValueError(f'未知的缓存后端: {backend}')
+        app.extensions['cache'] = self
+
+    def _count(self, namespace, field):
+        with self._lock:
+            counters = self._stats.setdefault(
+                namespace, {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+            )
+            counters[field] += 1
+
+    def get_or_set(self, namespace, key, factory, ttl):
+        """读取缓存，未命中时调用 factory() 计算并写入两级缓存"""
+        full_key = (namespace, self.generations.get(namespace), key)
+
+        value = self.local.get(full_key)
+        if value is not _MISSING:
+            self._count(namespace, 'local_hits')
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(full_key)
+            if value is not _MISSING:
+                self._count(namespace, 'shared_hits')
+                self.local.set(full_key, value, ttl)
+                return value
+
+        self._count(namespace, 'misses')
+        value = factory()
+        self.local.set(full_key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(full_key, value, ttl)
+        return value
+
+    def invalidate(self, *namespaces):
+        """使命名空间下的所有键失效（共享目录中旧代数的文件到期后由 FileBackend.sweep() 删除）"""
+        for namespace in namespaces:
+            self.generations.bump(namespace)
+            self._count(namespace, 'invalidations')
+
+    def stats(self):
+        with self._lock:
+            result = {namespace: dict(counters) for namespace, counters in self._stats.items()}
+        for counters in result.values():
+            lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+            counters['hit_rate'] = round(1 - counters['misses'] / lookups, 4) if lookups else None
+        return {
+            'backend': 'file' if self.shared is not None else 'local',
+            'local_entries': len(self.local),
+            'namespaces': result,
+        }
+
+
+cache = Cache()
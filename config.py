@@ -13,11 +13,144 @@ class Config:
         'sqlite:///' + os.path.join(basedir, 'instance', 'campus_trade.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # SQLite 连接参数（每个新连接执行的 PRAGMA），默认不做修改
+    SQLITE_PRAGMAS = {}
+    # GET 请求中的查询是否走只读连接池（需配置 'readonly' 绑定）
+    SQLALCHEMY_READONLY_GETS = False
+
     # 分页配置
     ITEMS_PER_PAGE = 12
+    PAGINATION_COUNT_TTL = 60          # 列表总数缓存时间（秒），0 表示不显示总数
+
+    # 搜索建议配置
+    SUGGEST_LIMIT = 10                 # 单次查询最多返回的建议数
+    SUGGEST_REFRESH_INTERVAL = 300     # 内存索引全量刷新周期（秒）
+
+    # 浏览量写回配置
+    VIEW_COUNT_FLUSH_INTERVAL = float(os.environ.get('VIEW_COUNT_FLUSH_INTERVAL', 5))   # 写回周期（秒）
+    VIEW_COUNT_FLUSH_THRESHOLD = 1000  # 累计浏览次数达到该值时提前写回
+
+    # 审计日志配置
+    AUDIT_SYNC = False                 # True 时同步写入（测试用）
+    AUDIT_QUEUE_SIZE = 10000           # 队列容量，满时丢弃并计数
+    AUDIT_BATCH_SIZE = 200             # 后台线程单次批量写入条数
+
+    # 缓存配置（分类列表、首页商品列表片段）
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')   # local：仅进程内；file：进程内+共享文件目录
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(basedir, 'instance', 'cache')
+    CACHE_MAX_ENTRIES = 1024           # 进程内缓存最多条目数（LRU淘汰）
+    CACHE_FILE_MAX_ENTRIES = 10000     # 共享目录中最多缓存文件数；写入时定期删除过期文件，仍超出时删除最早过期的
+    CACHE_CATEGORY_TTL = 600           # 分类列表缓存时间（秒）
+    CACHE_GRID_TTL = 30                # 商品列表片段缓存时间（秒），浏览量等展示数据最多延迟这么久
+    FACET_CACHE_TTL = 300              # 带价格区间/校区条件的分面计数缓存时间（秒）；无这些条件时读汇总表，总是准确
+
+    # 热门商品配置
+    HOT_HALF_LIFE_HOURS = 72           # 热度半衰期（小时）
+    HOT_WEIGHTS = {'view': 0.3, 'favorite': 0.7, 'listing': 1.0}   # 浏览、收藏、发布的热度权重
+    HOT_TRENDING_LIMIT = 8             # 首页热门商品数量
+    HOT_CACHE_TTL = 30                 # 热门列表缓存时间（秒）
+
+    # 订单配置
+    # 待处理订单超时自动取消并释放商品，0 表示不取消（默认：线下交易的订单一直保留到卖家处理）
+    ORDER_PENDING_TIMEOUT_MINUTES = int(os.environ.get('ORDER_PENDING_TIMEOUT_MINUTES', 0))
+    ORDER_SWEEP_INTERVAL = 60          # 超时订单清理周期（秒）
+    ORDER_BUSY_RETRIES = 5             # 数据库忙时下单事务的最多尝试次数
+    ORDER_BUSY_BACKOFF = 0.05          # 重试退避基数（秒），每次翻倍
+    IDEMPOTENCY_KEY_TTL_HOURS = 24     # 表单幂等键保留时间（小时）
+    PAYMENT_SETTLE_BATCH = 500         # 每批结算给卖家的已完成订单数，随订单清理线程定期执行
+
+    # 私信配置
+    MESSAGE_MAX_LENGTH = 1000          # 单条私信最大长度
+    MESSAGE_PAGE_SIZE = 50             # 收件箱显示的会话数、会话内显示的最近消息数
+    MESSAGE_UNREAD_TTL = 300           # 未读数缓存时间（秒），信箱代数变化时立即失效
+    MESSAGE_WAKE_INTERVAL = 1.0        # 等待中的连接检查信箱代数的间隔（秒），只读内存不查数据库
+    MESSAGE_LONGPOLL_TIMEOUT = 25      # 长轮询最长等待时间（秒）
+    MESSAGE_STREAM_TIMEOUT = 300       # 单个SSE连接的最长时间（秒），到期后浏览器自动重连
+    MESSAGE_PUSH = os.environ.get('MESSAGE_PUSH', 'poll')   # 浏览器获取未读数的方式：poll（长轮询）/ stream（SSE，只适合 ASGI 模式）
+    MESSAGE_MAX_WAITERS = 0            # 每个进程同时等待的长轮询/SSE连接上限，0 表示每进程线程数的一半；超出时立即返回
+    MESSAGE_POLL_RETRY = 10            # 等待名额已满时浏览器隔多少秒再请求
+    MESSAGE_HEARTBEAT = 15             # SSE心跳间隔（秒），防止代理断开空闲连接
+    MESSAGE_MAILBOX_SLOTS = 4096       # 多进程共享信箱代数的槽位数
+
+    # 性能剖析与监控配置
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))   # 统计SQL的请求比例，0 表示关闭（无额外开销）
+    PROFILE_SLOW_QUERY_MS = float(os.environ.get('PROFILE_SLOW_QUERY_MS', 100))   # 抽样请求中超过该耗时的语句记录慢查询日志
+    PROFILE_EXPLAIN = True             # 慢查询日志附带 EXPLAIN QUERY PLAN（仅 SQLite）
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')   # /metrics 的访问令牌，未配置时只允许本机访问
+    METRICS_ALLOW_LOOPBACK = True      # 未配置令牌时是否允许本机（且未经反向代理转发的）请求访问
+
+    # 密码哈希配置
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')   # werkzeug 格式，修改后旧哈希在登录时自动升级
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))   # 计算哈希的子进程数，0 表示在请求线程中计算
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))   # 排队与计算中的哈希上限，超出时返回429
+    PASSWORD_HASH_TIMEOUT = 10         # 等待哈希结果的最长时间（秒），超时同样返回429
+
+    # 登录用户身份缓存配置
+    IDENTITY_CACHE_TTL = 60            # 用户快照缓存时间（秒），资料、余额、禁用状态变化时按版本号立即失效
+    IDENTITY_CACHE_SIZE = 4096         # 每个进程最多缓存的用户快照数（LRU淘汰）
+    IDENTITY_VERSION_SLOTS = 4096      # 多进程共享用户版本号的槽位数
+
+    # 生产环境服务配置（python serve.py）
+    SERVE_BIND = os.environ.get('SERVE_BIND', '0.0.0.0:5001')   # 监听地址
+    SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', os.cpu_count() or 1))   # worker 进程数，默认每个CPU核心一个
+    SERVE_THREADS = int(os.environ.get('SERVE_THREADS', 8))   # 每个进程处理请求的线程数
+    SERVE_GRACEFUL_TIMEOUT = int(os.environ.get('SERVE_GRACEFUL_TIMEOUT', 30))   # 退出时等待处理中请求的最长时间（秒）
 
     # 上传文件配置
     UPLOAD_FOLDER = os.path.join(basedir, 'static', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))   # 生成缩略图的线程数
+    IMAGE_VARIANT_FORMAT = 'webp'      # 缩略图格式：webp / jpeg（Pillow 不支持 WebP 时自动使用 jpeg）
+
+
+def _sqlite_path(uri):
+    """从 sqlite:///路径 形式的URI中取出文件路径，非SQLite文件数据库返回None"""
+    prefix = 'sqlite:///'
+    if not uri.startswith(prefix) or ':memory:' in uri or '?' in uri:
+        return None
+    return uri[len(prefix):]
+
+
+class ProductionConfig(Config):
+    """生产环境配置：SQLite WAL 模式、连接池，以及供 GET 请求使用的只读连接池"""
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',         # 读写互不阻塞
+        'synchronous': 'NORMAL',       # WAL 下只在检查点时 fsync
+        'busy_timeout': 5000,          # 遇到锁时最多等待5秒，而不是立即报 database is locked
+        'cache_size': -64000,          # 每个连接64MB页缓存
+        'mmap_size': 268435456,        # 256MB 内存映射读取
+        'temp_store': 'MEMORY',
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': 10,
+        'pool_timeout': 10,
+        'pool_pre_ping': True,
+    }
+    # 多 worker 部署时共享渲染结果与失效代数
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'file')
+    # 生产环境默认抽样 5% 的请求
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.05))
+    # 反向代理后所有请求都来自本机，/metrics 与 /api/cache/stats 必须配置 METRICS_TOKEN，未配置时拒绝访问
+    METRICS_ALLOW_LOOPBACK = False
+
+    _database_path = _sqlite_path(Config.SQLALCHEMY_DATABASE_URI)
+    if _database_path:
+        SQLALCHEMY_BINDS = {
+            'readonly': {
+                'url': f'sqlite:///file:{_database_path}?mode=ro&uri=true',
+                'pool_size': int(os.environ.get('DB_READONLY_POOL_SIZE', 10)),
+                'max_overflow': 20,
+                'pool_timeout': 10,
+                'pool_pre_ping': True,
+            },
+        }
+        SQLALCHEMY_READONLY_GETS = True
+
 
+config = {
+    'development': Config,
+    'production': ProductionConfig,
+    'default': Config,
+}
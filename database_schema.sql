@@ -14,17 +14,30 @@ CREATE TABLE IF NOT EXISTS users (
     campus VARCHAR(50),                               -- 所在校区
     dormitory VARCHAR(50),                            -- 宿舍地址
     avatar VARCHAR(200) DEFAULT 'default.jpg',        -- 头像路径
-    balance REAL DEFAULT 0.0,                         -- 账户余额
+    balance_cents INTEGER NOT NULL DEFAULT 0,         -- 账户余额（分）
     credit_score INTEGER DEFAULT 100,                 -- 信用分 (0-150)
     is_active BOOLEAN DEFAULT 1,                      -- 账户是否激活
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,    -- 注册时间
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP     -- 更新时间
 );
 
--- 用户表索引
-CREATE INDEX idx_users_student_id ON users(student_id);
-CREATE INDEX idx_users_username ON users(username);
-CREATE INDEX idx_users_email ON users(email);
+-- 用户表：student_id、username 的 UNIQUE 约束自带唯一索引，不再单独建索引
+-- 首页按校区筛选：校区列表与某校区的卖家ID
+CREATE INDEX idx_users_campus ON users(campus);
+
+-- ==================== 用户统计表 ====================
+-- 个人中心计数的冗余汇总，由应用在业务事务内增量维护，python init_db.py --reconcile-stats 对账
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,                      -- 用户ID
+    product_count INTEGER NOT NULL DEFAULT 0,         -- 在架商品数
+    sold_count INTEGER NOT NULL DEFAULT 0,            -- 已售出商品数
+    buy_count INTEGER NOT NULL DEFAULT 0,             -- 购买订单数
+    sell_count INTEGER NOT NULL DEFAULT 0,            -- 销售订单数
+    favorite_count INTEGER NOT NULL DEFAULT 0,        -- 收藏商品数
+    unread_message_count INTEGER NOT NULL DEFAULT 0,  -- 未读私信数
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
 
 -- ==================== 商品分类表 ====================
 CREATE TABLE IF NOT EXISTS categories (
@@ -49,8 +62,10 @@ CREATE TABLE IF NOT EXISTS products (
     status VARCHAR(20) DEFAULT 'available',           -- 状态: available/sold/reserved
     view_count INTEGER DEFAULT 0,                     -- 浏览次数
     favorite_count INTEGER DEFAULT 0,                 -- 收藏次数
+    hot_score REAL DEFAULT 0,                         -- 热度分（前向时间衰减，增量累加）
     trade_location VARCHAR(100),                      -- 交易地点
-    images TEXT,                                      -- 图片路径，多个用逗号分隔
+    images TEXT,                                      -- 图片路径，多个用逗号分隔（兼容旧版本保留）
+    cover_image VARCHAR(100),                         -- 封面图片文件名（第一张图片）
     is_deleted BOOLEAN DEFAULT 0,                     -- 是否删除
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,    -- 发布时间
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,    -- 更新时间
@@ -59,13 +74,47 @@ CREATE TABLE IF NOT EXISTS products (
     FOREIGN KEY (seller_id) REFERENCES users(id)
 );
 
--- 商品表索引
-CREATE INDEX idx_products_seller_id ON products(seller_id);
-CREATE INDEX idx_products_category_id ON products(category_id);
-CREATE INDEX idx_products_status ON products(status);
-CREATE INDEX idx_products_created_at ON products(created_at DESC);
-CREATE INDEX idx_products_price ON products(price);
-CREATE INDEX idx_products_status_created ON products(status, created_at DESC);
+-- 商品表索引（与 models.py 中声明的索引一致）
+-- 首页与热门榜只读在售商品：部分索引只包含 is_deleted = 0 AND status = 'available' 的行
+CREATE INDEX idx_products_listed ON products(created_at, id) WHERE is_deleted = 0 AND status = 'available';
+CREATE INDEX idx_products_listed_category ON products(category_id, created_at, id) WHERE is_deleted = 0 AND status = 'available';
+CREATE INDEX idx_products_listed_hot ON products(hot_score) WHERE is_deleted = 0 AND status = 'available';
+CREATE INDEX idx_products_listed_category_hot ON products(category_id, hot_score) WHERE is_deleted = 0 AND status = 'available';
+-- 首页按价格排序与价格区间过滤
+CREATE INDEX idx_products_listed_price ON products(price, id) WHERE is_deleted = 0 AND status = 'available';
+CREATE INDEX idx_products_listed_category_price ON products(category_id, price, id) WHERE is_deleted = 0 AND status = 'available';
+-- 带价格区间、校区条件的分面计数：覆盖索引，GROUP BY 不回表
+CREATE INDEX idx_products_listed_facets ON products(category_id, condition, price, seller_id) WHERE is_deleted = 0 AND status = 'available';
+-- 我的发布：按卖家、是否删除过滤并按发布时间排序
+CREATE INDEX idx_products_seller ON products(seller_id, is_deleted, created_at, id);
+
+-- ==================== 分面计数表 ====================
+-- 在售商品按 (分类, 新旧程度) 的数量，由下方 products 上的触发器增量维护，
+-- python init_db.py --rebuild-facets 重新统计
+CREATE TABLE IF NOT EXISTS product_facet_counts (
+    category_id INTEGER NOT NULL,                     -- 分类ID
+    condition VARCHAR(20) NOT NULL DEFAULT '',        -- 新旧程度，未填写时为空串
+    listed_count INTEGER NOT NULL DEFAULT 0,          -- 在售商品数
+    PRIMARY KEY (category_id, condition),
+    FOREIGN KEY (category_id) REFERENCES categories(id)
+);
+
+-- ==================== 商品图片表 ====================
+-- 每张图片一行，position=0 为封面；变体文件名由图片处理流程生成
+CREATE TABLE IF NOT EXISTS product_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,                      -- 商品ID
+    position INTEGER NOT NULL DEFAULT 0,              -- 排列顺序
+    filename VARCHAR(100) NOT NULL,                   -- 原图文件名
+    width INTEGER,                                    -- 宽度（像素）
+    height INTEGER,                                   -- 高度（像素）
+    byte_size INTEGER,                                -- 原图字节数
+    thumb_key VARCHAR(100),                           -- 缩略图文件名
+    medium_key VARCHAR(100),                          -- 中图文件名
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(id),
+    UNIQUE(product_id, position)                      -- 同时作为按商品查询图片的索引
+);
 
 -- ==================== 订单表 ====================
 CREATE TABLE IF NOT EXISTS orders (
@@ -84,17 +133,20 @@ CREATE TABLE IF NOT EXISTS orders (
     paid_at DATETIME,                                 -- 支付时间
     completed_at DATETIME,                            -- 完成时间
     cancelled_at DATETIME,                            -- 取消时间
+    settled_at DATETIME,                              -- 货款结算给卖家的时间
     FOREIGN KEY (product_id) REFERENCES products(id),
     FOREIGN KEY (buyer_id) REFERENCES users(id),
     FOREIGN KEY (seller_id) REFERENCES users(id)
 );
 
--- 订单表索引
-CREATE INDEX idx_orders_order_no ON orders(order_no);
-CREATE INDEX idx_orders_buyer_id ON orders(buyer_id);
-CREATE INDEX idx_orders_seller_id ON orders(seller_id);
-CREATE INDEX idx_orders_status ON orders(status);
-CREATE INDEX idx_orders_created_at ON orders(created_at DESC);
+-- 订单表索引（order_no 的 UNIQUE 约束自带唯一索引）
+-- 我买到的 / 我卖出的：按用户过滤并按下单时间排序
+CREATE INDEX idx_orders_buyer ON orders(buyer_id, created_at, id);
+CREATE INDEX idx_orders_seller ON orders(seller_id, created_at, id);
+-- 超时未支付订单清理
+CREATE INDEX idx_orders_status_created ON orders(status, created_at);
+-- 货款结算：部分索引只包含已完成未结算的订单
+CREATE INDEX idx_orders_unsettled ON orders(id) WHERE status = 'completed' AND settled_at IS NULL;
 
 -- ==================== 评价表 ====================
 CREATE TABLE IF NOT EXISTS reviews (
@@ -112,9 +164,8 @@ CREATE TABLE IF NOT EXISTS reviews (
 );
 
 -- 评价表索引
-CREATE INDEX idx_reviews_reviewer_id ON reviews(reviewer_id);
-CREATE INDEX idx_reviews_reviewee_id ON reviews(reviewee_id);
-CREATE INDEX idx_reviews_created_at ON reviews(created_at DESC);
+CREATE INDEX idx_reviews_reviewer ON reviews(reviewer_id);
+CREATE INDEX idx_reviews_reviewee ON reviews(reviewee_id);
 
 -- ==================== 收藏表 ====================
 CREATE TABLE IF NOT EXISTS favorites (
@@ -127,28 +178,85 @@ CREATE TABLE IF NOT EXISTS favorites (
     UNIQUE(user_id, product_id)                       -- 联合唯一约束
 );
 
--- 收藏表索引
-CREATE INDEX idx_favorites_user_id ON favorites(user_id);
-CREATE INDEX idx_favorites_product_id ON favorites(product_id);
+-- 收藏表索引：我的收藏按用户过滤并按收藏时间排序
+CREATE INDEX idx_favorites_user ON favorites(user_id, created_at, id);
+CREATE INDEX idx_favorites_product ON favorites(product_id);
 
 -- ==================== 消息表 ====================
+-- 会话：两个用户围绕同一商品（或不关联商品）的私信，收件箱按最后消息时间读取
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    thread_key VARCHAR(50) UNIQUE NOT NULL,           -- 较小用户ID-较大用户ID-商品ID
+    user_low_id INTEGER NOT NULL,                     -- ID较小的用户
+    user_high_id INTEGER NOT NULL,                    -- ID较大的用户
+    product_id INTEGER,                               -- 关联商品ID
+    last_message_id INTEGER,                          -- 最后一条消息ID
+    last_message_at DATETIME DEFAULT CURRENT_TIMESTAMP,  -- 最后一条消息时间
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_low_id) REFERENCES users(id),
+    FOREIGN KEY (user_high_id) REFERENCES users(id),
+    FOREIGN KEY (product_id) REFERENCES products(id)
+);
+
+CREATE INDEX idx_conversations_low ON conversations(user_low_id, last_message_at);
+CREATE INDEX idx_conversations_high ON conversations(user_high_id, last_message_at);
+
 CREATE TABLE IF NOT EXISTS messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER,                          -- 会话ID
     sender_id INTEGER NOT NULL,                       -- 发送者ID
     receiver_id INTEGER NOT NULL,                     -- 接收者ID
     product_id INTEGER,                               -- 关联商品ID
     content TEXT NOT NULL,                            -- 消息内容
     is_read BOOLEAN DEFAULT 0,                        -- 是否已读
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id),
     FOREIGN KEY (sender_id) REFERENCES users(id),
     FOREIGN KEY (receiver_id) REFERENCES users(id),
     FOREIGN KEY (product_id) REFERENCES products(id)
 );
 
 -- 消息表索引
-CREATE INDEX idx_messages_sender_id ON messages(sender_id);
-CREATE INDEX idx_messages_receiver_id ON messages(receiver_id);
-CREATE INDEX idx_messages_created_at ON messages(created_at DESC);
+CREATE INDEX idx_messages_sender ON messages(sender_id);
+-- 未读数与收件箱：按接收者、是否已读、时间的复合索引（同时覆盖按接收者查询）
+CREATE INDEX idx_messages_receiver_unread ON messages(receiver_id, is_read, created_at);
+CREATE INDEX idx_messages_conversation ON messages(conversation_id, id);
+
+-- ==================== 幂等键表 ====================
+-- 表单提交携带的唯一标识，重复提交（双击、刷新重发）只处理一次
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(64) PRIMARY KEY,                      -- 客户端提交的唯一标识
+    user_id INTEGER,                                  -- 提交用户ID
+    action VARCHAR(50) NOT NULL,                      -- 操作类型
+    order_id INTEGER,                                 -- 关联订单ID
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_idempotency_keys_created ON idempotency_keys(created_at);
+
+-- ==================== 资金流水表 ====================
+-- 只追加不修改，每条记录变动后的余额快照；金额单位为分，支出为负
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,                         -- 用户ID
+    order_id INTEGER,                                 -- 关联订单ID
+    entry_type VARCHAR(20) NOT NULL,                  -- deposit/payment/refund/settlement
+    amount_cents INTEGER NOT NULL,                    -- 变动金额（分）
+    balance_after_cents INTEGER NOT NULL,             -- 变动后余额（分）
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (order_id) REFERENCES orders(id)
+);
+
+CREATE INDEX idx_ledger_user ON ledger_entries(user_id, id);
+CREATE INDEX idx_ledger_order ON ledger_entries(order_id);
+
+-- ==================== 排行状态表 ====================
+-- 只有一行（id=1）：热度分的衰减起点，距起点过久时整体平移（见 ranking.py）
+CREATE TABLE IF NOT EXISTS ranking_state (
+    id INTEGER PRIMARY KEY,
+    hot_epoch DATETIME NOT NULL                       -- 热度分的衰减起点
+);
 
 -- ==================== 系统日志表 ====================
 CREATE TABLE IF NOT EXISTS system_logs (
@@ -159,18 +267,23 @@ CREATE TABLE IF NOT EXISTS system_logs (
     record_id INTEGER,                                -- 记录ID
     description TEXT,                                 -- 操作描述
     ip_address VARCHAR(50),                           -- IP地址
+    user_agent VARCHAR(200),                          -- 客户端User-Agent
+    latency_ms INTEGER,                               -- 请求耗时（毫秒）
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
--- 系统日志表索引
-CREATE INDEX idx_system_logs_user_id ON system_logs(user_id);
-CREATE INDEX idx_system_logs_action ON system_logs(action);
-CREATE INDEX idx_system_logs_created_at ON system_logs(created_at DESC);
+-- 系统日志表索引：按时间清理过期日志
+CREATE INDEX idx_system_logs_created ON system_logs(created_at);
+
+-- ==================== 全文索引 ====================
+-- 商品标题/描述的FTS5索引，rowid 对应 products.id
+-- 中文需按二元组切分后写入，由应用层 search.py 维护（python init_db.py --rebuild-search 可重建）
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(title, description, tokenize = 'unicode61');
 
 -- ==================== 视图定义 ====================
 
--- 视图1: 热门商品视图
+-- 视图1: 热门商品视图（按物化的热度分排序，可走 idx_products_listed_hot）
 CREATE VIEW IF NOT EXISTS v_hot_products AS
 SELECT
     p.*,
@@ -181,26 +294,22 @@ FROM products p
 LEFT JOIN categories c ON p.category_id = c.id
 LEFT JOIN users u ON p.seller_id = u.id
 WHERE p.is_deleted = 0 AND p.status = 'available'
-ORDER BY (p.view_count * 0.3 + p.favorite_count * 0.7) DESC;
+ORDER BY p.hot_score DESC;
 
--- 视图2: 用户统计视图
+-- 视图2: 用户统计视图（计数来自 user_stats 汇总表）
 CREATE VIEW IF NOT EXISTS v_user_stats AS
 SELECT
     u.id,
     u.username,
     u.real_name,
     u.credit_score,
-    COUNT(DISTINCT p.id) as product_count,
-    COUNT(DISTINCT CASE WHEN p.status = 'sold' THEN p.id END) as sold_count,
-    COUNT(DISTINCT o1.id) as buy_count,
-    COUNT(DISTINCT o2.id) as sell_count,
-    AVG(CASE WHEN r.reviewee_id = u.id THEN r.rating END) as avg_rating
+    COALESCE(s.product_count, 0) as product_count,
+    COALESCE(s.sold_count, 0) as sold_count,
+    COALESCE(s.buy_count, 0) as buy_count,
+    COALESCE(s.sell_count, 0) as sell_count,
+    (SELECT AVG(r.rating) FROM reviews r WHERE r.reviewee_id = u.id) as avg_rating
 FROM users u
-LEFT JOIN products p ON u.id = p.seller_id AND p.is_deleted = 0
-LEFT JOIN orders o1 ON u.id = o1.buyer_id
-LEFT JOIN orders o2 ON u.id = o2.seller_id
-LEFT JOIN reviews r ON u.id = r.reviewee_id
-GROUP BY u.id;
+LEFT JOIN user_stats s ON s.user_id = u.id;
 
 -- 视图3: 订单详情视图
 CREATE VIEW IF NOT EXISTS v_order_details AS
@@ -219,48 +328,68 @@ LEFT JOIN users seller ON o.seller_id = seller.id;
 
 -- ==================== 触发器定义 ====================
 
--- 触发器1: 订单完成后更新用户信用分
-CREATE TRIGGER IF NOT EXISTS update_credit_score_on_order_complete
-AFTER UPDATE ON orders
-WHEN NEW.status = 'completed' AND OLD.status != 'completed'
+-- 订单完成后的信用分、取消后恢复商品状态、售出时间等副作用由订单状态机（order_state.py）
+-- 在同一事务内完成，不再使用触发器
+
+-- 插入评价后更新被评价人信用分
+CREATE TRIGGER IF NOT EXISTS update_credit_on_review
+AFTER INSERT ON reviews
 BEGIN
-    -- 卖家信用分+5 (最高150分)
-    UPDATE users SET credit_score = credit_score + 5
-    WHERE id = NEW.seller_id AND credit_score < 150;
+    -- 根据评分调整信用分: 5星+4, 4星+2, 3星0, 2星-2, 1星-4
+    -- 信用分范围: 0-150
+    UPDATE users
+    SET credit_score = credit_score + (NEW.rating - 3) * 2
+    WHERE id = NEW.reviewee_id
+    AND credit_score + (NEW.rating - 3) * 2 BETWEEN 0 AND 150;
+END;
 
-    -- 买家信用分+2 (最高150分)
-    UPDATE users SET credit_score = credit_score + 2
-    WHERE id = NEW.buyer_id AND credit_score < 150;
+-- 首页分面计数：商品进入在售状态时计数加一，离开时减一
+CREATE TRIGGER IF NOT EXISTS product_facets_insert
+AFTER INSERT ON products
+WHEN NEW.is_deleted = 0 AND NEW.status = 'available'
+BEGIN
+    INSERT INTO product_facet_counts (category_id, condition, listed_count)
+    VALUES (NEW.category_id, COALESCE(NEW.condition, ''), 1)
+    ON CONFLICT (category_id, condition) DO UPDATE SET listed_count = listed_count + 1;
 END;
 
--- 触发器2: 订单取消后恢复商品状态
-CREATE TRIGGER IF NOT EXISTS restore_product_on_cancel
-AFTER UPDATE ON orders
-WHEN NEW.status = 'cancelled' AND OLD.status != 'cancelled'
+CREATE TRIGGER IF NOT EXISTS product_facets_delete
+AFTER DELETE ON products
+WHEN OLD.is_deleted = 0 AND OLD.status = 'available'
 BEGIN
-    UPDATE products SET status = 'available'
-    WHERE id = NEW.product_id;
+    UPDATE product_facet_counts SET listed_count = listed_count - 1
+    WHERE category_id = OLD.category_id AND condition = COALESCE(OLD.condition, '');
 END;
 
--- 触发器3: 商品售出后更新售出时间
-CREATE TRIGGER IF NOT EXISTS update_sold_time
-AFTER UPDATE ON products
-WHEN NEW.status = 'sold' AND OLD.status != 'sold'
+-- 更新时 OLD、NEW 两个触发器各自判断，分类或新旧程度变化时同时更新两行
+CREATE TRIGGER IF NOT EXISTS product_facets_update_old
+AFTER UPDATE OF is_deleted, status, category_id, condition ON products
+WHEN OLD.is_deleted = 0 AND OLD.status = 'available'
 BEGIN
-    UPDATE products SET sold_at = datetime('now')
-    WHERE id = NEW.id;
+    UPDATE product_facet_counts SET listed_count = listed_count - 1
+    WHERE category_id = OLD.category_id AND condition = COALESCE(OLD.condition, '');
 END;
 
--- 触发器4: 插入评价后更新被评价人信用分
-CREATE TRIGGER IF NOT EXISTS update_credit_on_review
-AFTER INSERT ON reviews
+CREATE TRIGGER IF NOT EXISTS product_facets_update_new
+AFTER UPDATE OF is_deleted, status, category_id, condition ON products
+WHEN NEW.is_deleted = 0 AND NEW.status = 'available'
 BEGIN
-    -- 根据评分调整信用分: 5星+4, 4星+2, 3星0, 2星-2, 1星-4
-    -- 信用分范围: 0-150
-    UPDATE users
-    SET credit_score = credit_score + (NEW.rating - 3) * 2
-    WHERE id = NEW.reviewee_id
-    AND credit_score + (NEW.rating - 3) * 2 BETWEEN 0 AND 150;
+    INSERT INTO product_facet_counts (category_id, condition, listed_count)
+    VALUES (NEW.category_id, COALESCE(NEW.condition, ''), 1)
+    ON CONFLICT (category_id, condition) DO UPDATE SET listed_count = listed_count + 1;
+END;
+
+-- 资金流水只追加：禁止修改和删除
+CREATE TRIGGER IF NOT EXISTS ledger_entries_no_update
+BEFORE UPDATE ON ledger_entries
+BEGIN
+    SELECT RAISE(ABORT, 'ledger_entries is append-only');
+END;
+
+CREATE TRIGGER IF NOT EXISTS ledger_entries_no_delete
+BEFORE DELETE ON ledger_entries
+BEGIN
+    SELECT RAISE(ABORT, 'ledger_entries is append-only');
 END;
 
 -- ==================== 初始数据 ====================
@@ -0,0 +1,82 @@
+"""
+数据库连接配置
+- SQLite PRAGMA：通过连接事件在每个新连接上设置 WAL、synchronous、busy_timeout 等参数
+- 只读连接池：配置了 'readonly' 绑定时，GET/HEAD 请求中的 SELECT 走只读连接，
+  写操作（flush、INSERT/UPDATE/DELETE、原始SQL）仍然走主连接；
+  会话中有未 flush 的修改或已在主连接上开始事务（同一请求中写过数据，例如查看会话时标记已读）后，
+  之后的查询也走主连接，才能读到本事务尚未提交的修改
+"""
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+READONLY_BIND = 'readonly'
+# session.info 中的标记：当前事务已在主连接上开始
+_PRIMARY_IN_TRANSACTION = 'primary_in_transaction'
+
+# 只读连接上无法修改日志模式，且不需要写相关的参数
+_WRITE_ONLY_PRAGMAS = {'journal_mode', 'synchronous', 'wal_autocheckpoint'}
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """在引擎的每个新连接上执行给定的 PRAGMA"""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    event.listen(engine, 'connect', set_pragmas)
+
+
+def init_db_profile(app, db):
+    """为应用的所有SQLite引擎注册 PRAGMA 连接钩子"""
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if not pragmas:
+        return
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            if engine.dialect.name != 'sqlite':
+                continue
+            if bind_key == READONLY_BIND:
+                bind_pragmas = {k: v for k, v in pragmas.items() if k not in _WRITE_ONLY_PRAGMAS}
+                bind_pragmas['query_only'] = 1
+            else:
+                bind_pragmas = pragmas
+            apply_sqlite_pragmas(engine, bind_pragmas)
+
+
+def _readonly_request():
+    return (has_request_context()
+            and request.method in ('GET', 'HEAD')
+            and current_app.config.get('SQLALCHEMY_READONLY_GETS', False))
+
+
+class RoutingSession(Session):
+    """按请求方法选择连接池：GET 请求中的查询使用只读绑定，本事务写过数据后改用主连接"""
+
+    def _has_writes(self):
+        return bool(self.info.get(_PRIMARY_IN_TRANSACTION) or self.new or self.deleted or self.dirty)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing
+                and isinstance(clause, Select)
+                and _readonly_request()
+                and not self._has_writes()):
+            engine = self._db.engines.get(READONLY_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_begin')
+def _track_primary(session, transaction, connection):
+    """记录当前事务是否已使用主连接（只读绑定以外的连接）"""
+    if connection.engine is not session._db.engines.get(READONLY_BIND):
+        session.info[_PRIMARY_IN_TRANSACTION] = True
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _reset_primary(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PRIMARY_IN_TRANSACTION, None)
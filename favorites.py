@@ -0,0 +1,95 @@
+"""
+商品收藏
+- 收藏/取消收藏是幂等的"设为某状态"操作：INSERT ... ON CONFLICT DO NOTHING 与 DELETE 的实际影响行数
+  决定计数是否变化，双击或多个标签页同时点击不会撞上唯一约束，也不会重复加减计数；
+  不支持 ON CONFLICT 的数据库先查询再插入，并发插入撞上唯一约束时按已收藏处理
+- 商品收藏数、用户收藏数与热度分在同一事务内以 SQL 增量（x = x + n）更新，不读取再写回ORM对象
+- favorite_states() 一次查询返回一页商品的收藏状态，列表页不必每张卡片查询一次
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Product, Favorite
+import ranking
+import user_stats
+
+# 批量查询收藏状态时一次最多接受的商品数
+MAX_STATE_IDS = 100
+
+# 支持 INSERT ... ON CONFLICT DO NOTHING 的方言
+_UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _add_favorite(user_id, product_id):
+    """插入收藏记录，已存在时不做任何事，返回是否插入"""
+    insert = _UPSERT_INSERTS.get(db.engine.dialect.name)
+    if insert is not None:
+        stmt = (insert(Favorite).values(user_id=user_id, product_id=product_id)
+                .on_conflict_do_nothing(index_elements=['user_id', 'product_id']))
+        return db.session.execute(stmt).rowcount == 1
+    if is_favorited(user_id, product_id):
+        return False
+    try:
+        with db.session.begin_nested():
+            db.session.add(Favorite(user_id=user_id, product_id=product_id))
+    except IntegrityError:
+        # 另一个请求先插入了同一条收藏
+        return False
+    return True
+
+
+def set_favorite(user_id, product_id, favorited):
+    """把收藏状态设为 favorited 并提交，返回 (状态是否发生变化, 商品当前收藏数)"""
+    # 取消收藏时按收藏当时的时刻扣除热度，只扣掉这次收藏加上的分值
+    favorited_at = None
+    if favorited:
+        changed = _add_favorite(user_id, product_id)
+    else:
+        delete = db.delete(Favorite).where(Favorite.user_id == user_id, Favorite.product_id == product_id)
+        if db.engine.dialect.delete_returning:
+            row = db.session.execute(delete.returning(Favorite.created_at)).first()
+            changed = row is not None
+            favorited_at = row and row.created_at
+        else:
+            favorited_at = db.session.execute(
+                db.select(Favorite.created_at).where(Favorite.user_id == user_id, Favorite.product_id == product_id)
+            ).scalar()
+            changed = db.session.execute(delete).rowcount == 1
+
+    count = None
+    if changed:
+        delta = 1 if favorited else -1
+        # 用 CASE 钳制到 0：双参数标量 MAX() 只有 SQLite 支持
+        new_count = db.func.coalesce(Product.favorite_count, 0) + delta
+        update = (db.update(Product).where(Product.id == product_id)
+                  .values(favorite_count=db.case((new_count < 0, 0), else_=new_count))
+                  .execution_options(synchronize_session=False))
+        if db.engine.dialect.update_returning:
+            count = db.session.execute(update.returning(Product.favorite_count)).scalar_one()
+        else:
+            db.session.execute(update)
+        user_stats.bump(user_id, favorite_count=delta)
+        ranking.bump(product_id, favorites=delta, when=favorited_at)
+    if count is None:
+        count = db.session.execute(
+            db.select(Product.favorite_count).where(Product.id == product_id)
+        ).scalar_one()
+    db.session.commit()
+    return changed, count or 0
+
+
+def is_favorited(user_id, product_id):
+    return db.session.execute(
+        db.select(Favorite.id).where(Favorite.user_id == user_id, Favorite.product_id == product_id)
+    ).first() is not None
+
+
+def favorite_states(user_id, product_ids):
+    """product_ids 中已被 user_id 收藏的商品ID集合（走联合唯一索引，一次查询）"""
+    product_ids = list(dict.fromkeys(product_ids))[:MAX_STATE_IDS]
+    if not product_ids:
+        return set()
+    return set(db.session.execute(
+        db.select(Favorite.product_id)
+        .where(Favorite.user_id == user_id, Favorite.product_id.in_(product_ids))
+    ).scalars())
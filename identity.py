@@ -0,0 +1,129 @@
+"""
+登录用户身份缓存
+- Flask-Login 在每个已登录的请求（包括收藏、未读数等 AJAX 请求）中调用 load_user()。
+  这里返回 UserSnapshot：只含 id、用户名、余额、是否激活几个字段，用 __slots__ 存储，
+  放在进程内 LRU 中 IDENTITY_CACHE_TTL 秒，命中时不访问数据库，也不读取 password_hash 等字段
+- 每个用户有一个版本号（cache.GenerationTable；文件缓存后端下为多进程共享的内存映射文件）。
+  在事务中修改用户（ORM 修改 User、payments 调整余额）会记下用户ID，提交后版本号加一，缓存的快照随之失效；
+  回滚时丢弃记录。读取时先取版本号再查询，查询期间版本号变化的快照下次请求会重新读取
+- 账户被禁用（is_active 为假）时 load_user() 返回 None，已登录的会话在版本号变化后立即失效
+- 需要完整 User 对象的路由调用 load_current_user()，按主键加载，同一请求内由会话的标识映射复用
+"""
+import os
+import threading
+
+from flask_login import current_user
+from sqlalchemy import event
+
+from models import db, User
+from cache import LRUCache, GenerationTable
+
+
+class UserSnapshot:
+    """缓存中的登录用户，满足 Flask-Login 的用户接口；创建后不再修改，可在线程间共享"""
+    __slots__ = ('id', 'username', 'balance_cents', 'is_active')
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username, balance_cents, is_active):
+        self.id = id
+        self.username = username
+        self.balance_cents = balance_cents
+        self.is_active = is_active
+
+    def get_id(self):
+        return str(self.id)
+
+    @property
+    def balance(self):
+        """账户余额（元），仅用于展示"""
+        return (self.balance_cents or 0) / 100
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.username}>'
+
+
+class IdentityCache:
+    """按用户ID缓存 UserSnapshot，按用户版本号失效"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.snapshots = LRUCache()
+        self.versions = GenerationTable()
+        self.ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.snapshots = LRUCache(app.config['IDENTITY_CACHE_SIZE'])
+        self.ttl = app.config['IDENTITY_CACHE_TTL']
+        if app.config['CACHE_BACKEND'] == 'file':
+            directory = app.config['CACHE_DIR']
+            os.makedirs(directory, exist_ok=True)
+            self.versions = GenerationTable(os.path.join(directory, 'identity.bin'),
+                                            slots=app.config['IDENTITY_VERSION_SLOTS'])
+        app.extensions['identity_cache'] = self
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def load(self, user_id):
+        """返回用户快照；用户不存在或已被禁用时返回 None"""
+        version = self.versions.get(f'user:{user_id}')
+        cached = self.snapshots.get(user_id)
+        if isinstance(cached, tuple) and cached[0] == version:
+            self._count('hits')
+            return cached[1]
+        self._count('misses')
+        row = db.session.execute(
+            db.select(User.id, User.username, User.balance_cents, User.is_active).where(User.id == user_id)
+        ).first()
+        snapshot = UserSnapshot(*row) if row is not None else None
+        self.snapshots.set(user_id, (version, snapshot), self.ttl)
+        if snapshot is None or not snapshot.is_active:
+            return None
+        return snapshot
+
+    def changed(self, *user_ids):
+        """在当前事务中标记用户已修改，提交后使其快照失效"""
+        db.session().info.setdefault('identity_changed', set()).update(user_ids)
+
+    def bump(self, *user_ids):
+        """立即使用户快照失效（不在事务中修改用户时使用）"""
+        for user_id in user_ids:
+            self.versions.bump(f'user:{user_id}')
+
+    def _after_flush(self, session, flush_context):
+        changed = [obj.id for obj in session.dirty | session.deleted
+                   if isinstance(obj, User) and obj.id is not None
+                   and (obj in session.deleted or session.is_modified(obj))]
+        if changed:
+            session.info.setdefault('identity_changed', set()).update(changed)
+
+    def _after_commit(self, session):
+        self.bump(*session.info.pop('identity_changed', ()))
+
+    def _after_rollback(self, session):
+        session.info.pop('identity_changed', None)
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.snapshots)}
+
+
+def load_current_user():
+    """当前登录用户的完整 User 对象（个人中心等需要其他字段的页面使用）"""
+    if isinstance(current_user._get_current_object(), User):
+        return current_user._get_current_object()
+    return db.session.get(User, current_user.id)
+
+
+identity_cache = IdentityCache()
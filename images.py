@@ -0,0 +1,368 @@
+"""
+商品图片处理
+- 上传时按内容 SHA-256 命名（相同图片只保存一份），并按文件头识别真实格式
+- 原图写入前去除 EXIF/XMP 等元数据段（含拍摄位置），只保留 EXIF 方向标记（浏览器据此旋转显示），纯字节处理，不依赖 Pillow
+- 缩略图（列表卡片）与中图（详情页）由线程池在请求之外生成，输出 WebP（不支持时为 JPEG）
+- 模板通过 image_url() / cover_image_url() 选择尺寸，变体尚未生成或未安装 Pillow 时回退到原图
+- 每张图片的尺寸、大小与变体文件名记录在 product_images 表，封面文件名缓存在 products.cover_image
+"""
+import atexit
+import hashlib
+import io
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import url_for
+
+from models import db, Product, ProductImage
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # 未安装 Pillow 时只保存原图
+    Image = None
+
+# EXIF 方向值为 5~8 时图片需要旋转90度，显示宽高互换
+_EXIF_ORIENTATION = 0x0112
+_ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+# 变体名称 -> 最长边像素
+VARIANT_SIZES = {
+    'thumb': 400,     # 列表卡片显示200px，按2倍屏生成
+    'medium': 1200,   # 详情页
+}
+
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def sniff_format(data):
+    """根据文件头判断图片格式，无法识别时返回None"""
+    for signature, ext in _SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    return None
+
+
+def _exif_orientation(tiff):
+    """从 TIFF 格式的 EXIF 数据中读取 IFD0 的方向值，没有或无法解析时返回 None"""
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        offset = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+        for n in range(count):
+            entry = offset + 2 + n * 12
+            tag, kind = struct.unpack(order + 'HH', tiff[entry:entry + 4])
+            if tag == _EXIF_ORIENTATION and kind == 3:
+                value = struct.unpack(order + 'H', tiff[entry + 8:entry + 10])[0]
+                return value if 1 <= value <= 8 else None
+    except (KeyError, struct.error):
+        pass
+    return None
+
+
+def _orientation_tiff(orientation):
+    """只含方向标记的 TIFF 格式 EXIF 数据"""
+    return (b'MM\x00*' + struct.pack('>I', 8) + struct.pack('>H', 1)
+            + struct.pack('>HHIHH', _EXIF_ORIENTATION, 3, 1, orientation, 0) + struct.pack('>I', 0))
+
+
+def _strip_jpeg_metadata(data):
+    """去掉 JPEG 中的 APP1（EXIF/XMP）、APP13（IPTC）段与注释段；EXIF 中的方向值不为 1 时换成只含方向的 APP1 段"""
+    out = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            break
+        marker = data[pos + 1]
+        if marker == 0xFF:  # 段之间允许的填充字节
+            pos += 1
+            continue
+        if marker == 0xDA:  # 扫描数据开始，其后不再有元数据段
+            break
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        end = pos + 2 + length
+        if marker not in (0xE1, 0xED, 0xFE):
+            out.append(data[pos:end])
+        elif marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            orientation = _exif_orientation(data[pos + 10:end])
+            if orientation not in (None, 1):
+                payload = b'Exif\x00\x00' + _orientation_tiff(orientation)
+                out.append(b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload)
+        pos = end
+    out.append(data[pos:])
+    return b''.join(out)
+
+
+def _strip_png_metadata(data):
+    """去掉 PNG 中的 eXIf 与文本块；eXIf 中的方向值不为 1 时换成只含方向的 eXIf 块"""
+    out = [data[:8]]
+    pos = 8
+    while pos + 8 <= len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if chunk_type not in (b'eXIf', b'tEXt', b'zTXt', b'iTXt'):
+            out.append(data[pos:end])
+        elif chunk_type == b'eXIf':
+            orientation = _exif_orientation(data[pos + 8:end - 4])
+            if orientation not in (None, 1):
+                payload = b'eXIf' + _orientation_tiff(orientation)
+                out.append(struct.pack('>I', len(payload) - 4) + payload + struct.pack('>I', zlib.crc32(payload)))
+        pos = end
+    out.append(data[pos:])
+    return b''.join(out)
+
+
+def strip_metadata(data, ext):
+    if ext == 'jpg':
+        return _strip_jpeg_metadata(data)
+    if ext == 'png':
+        return _strip_png_metadata(data)
+    return data
+
+
+def image_size(source):
+    """读取图片显示尺寸（只解析文件头），未安装 Pillow、无法识别或像素数超过 Pillow 的解压炸弹上限时返回 (None, None)"""
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+            width, height = image.size
+            if image.getexif().get(_EXIF_ORIENTATION) in _ROTATED_ORIENTATIONS:
+                width, height = height, width
+            return width, height
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None, None
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def variant_name(filename, variant, fmt):
+    stem = filename.rsplit('.', 1)[0]
+    return f"{stem}_{variant}.{'webp' if fmt == 'webp' else 'jpg'}"
+
+
+def build_variants(folder, filename, fmt, data=None):
+    """生成缩略图和中图（在线程池中执行），已存在的变体跳过
+    data 为上传的原始字节，省略时读取落盘的原图（去掉了其他元数据，保留方向标记）
+    """
+    targets = {variant: os.path.join(folder, variant_name(filename, variant, fmt))
+               for variant in VARIANT_SIZES}
+    targets = {variant: path for variant, path in targets.items() if not os.path.exists(path)}
+    if not targets:
+        return []
+
+    source_file = io.BytesIO(data) if data is not None else os.path.join(folder, filename)
+    with Image.open(source_file) as source:
+        # 按 EXIF 方向旋转后再缩放，输出文件不带任何元数据
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if fmt != 'webp' and image.mode == 'RGBA':
+            image = image.convert('RGB')
+
+        created = []
+        for variant, path in targets.items():
+            resized = image.copy()
+            resized.thumbnail((VARIANT_SIZES[variant],) * 2, Image.Resampling.LANCZOS)
+            tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+            if fmt == 'webp':
+                resized.save(tmp_path, 'WEBP', quality=80, method=4)
+            else:
+                resized.save(tmp_path, 'JPEG', quality=82, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+            created.append(path)
+    return created
+
+
+class ImagePipeline:
+    """图片上传与变体生成"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._ready = set()
+        self._in_flight = set()
+        self.app = None
+        self.format = 'webp'
+        self.workers = 2
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['IMAGE_WORKERS']
+        self.format = app.config['IMAGE_VARIANT_FORMAT']
+        if self.format == 'webp' and Image is not None and not features.check('webp'):
+            self.format = 'jpeg'
+        app.extensions['images'] = self
+        app.add_template_global(self.image_url)
+        app.add_template_global(self.cover_image_url)
+        atexit.register(self.shutdown)
+
+    @property
+    def folder(self):
+        return self.app.config['UPLOAD_FOLDER']
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    # ==================== 上传 ====================
+
+    def describe(self, filename, data=None):
+        """生成 product_images 行所需的字段；data 为原始字节，省略时读取已保存的文件"""
+        path = os.path.join(self.folder, filename)
+        if data is not None:
+            width, height = image_size(data)
+            byte_size = len(data)
+        elif os.path.exists(path):
+            width, height = image_size(path)
+            byte_size = os.path.getsize(path)
+        else:
+            width = height = byte_size = None
+        keys = {f'{variant}_key': variant_name(filename, variant, self.format) if self.enabled else None
+                for variant in VARIANT_SIZES}
+        return dict(filename=filename, width=width, height=height, byte_size=byte_size, **keys)
+
+    def save_upload(self, file_storage):
+        """保存上传的图片，返回图片信息（见 describe()）；不是可识别的图片、文件头损坏或尺寸过大时返回None"""
+        data = file_storage.read()
+        ext = sniff_format(data)
+        if ext is None:
+            return None
+        if self.enabled and image_size(data) == (None, None):
+            return None
+
+        digest = hashlib.sha256(data).hexdigest()
+        filename = f'{digest}.{ext}'
+        path = os.path.join(self.folder, filename)
+        # 内容寻址：相同图片重复上传时直接复用已有文件
+        if not os.path.exists(path):
+            os.makedirs(self.folder, exist_ok=True)
+            _write_atomic(path, strip_metadata(data, ext))
+        self.schedule_variants(filename, data)
+        return self.describe(filename, data)
+
+    def schedule_variants(self, filename, data=None):
+        """把变体生成提交到线程池，返回 Future；未安装 Pillow 或同一图片已在处理中时返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if filename in self._in_flight:
+                return None
+            self._in_flight.add(filename)
+        future = self._get_executor().submit(build_variants, self.folder, filename, self.format, data)
+        future.add_done_callback(lambda f: self._finished(f, filename))
+        return future
+
+    def _finished(self, future, filename):
+        with self._lock:
+            self._in_flight.discard(filename)
+        if future.exception() is not None:
+            self.app.logger.error('图片变体生成失败：%s', filename, exc_info=future.exception())
+
+    def _get_executor(self):
+        # 按进程创建：预派生的 worker 进程不能复用父进程的线程池
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='image-variants')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def shutdown(self, wait=True):
+        """等待已提交的变体生成完成（进程退出或测试时调用）"""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+            self._executor_pid = None
+
+    # ==================== 模板辅助 ====================
+
+    def _variant_ready(self, name):
+        if name in self._ready:
+            return True
+        if os.path.exists(os.path.join(self.folder, name)):
+            # 变体生成后不会再删除，记住结果避免重复 stat
+            self._ready.add(name)
+            return True
+        return False
+
+    def image_url(self, image, variant='thumb'):
+        """图片地址：image 为文件名或 ProductImage；优先使用指定尺寸的变体，
+        variant='original' 或变体不存在时返回原图"""
+        if not image:
+            return None
+        if isinstance(image, ProductImage):
+            filename = image.filename
+            candidate = getattr(image, f'{variant}_key', None)
+        else:
+            filename = image
+            candidate = variant_name(filename, variant, self.format) if variant in VARIANT_SIZES else None
+        name = candidate if candidate and self._variant_ready(candidate) else filename
+        return url_for('static', filename='uploads/' + name)
+
+    def cover_image_url(self, product, variant='thumb'):
+        """商品封面地址（读取 cover_image 列，不解析图片字段），没有图片时返回None"""
+        cover = product.cover_image
+        if cover is None and product.images:
+            # 尚未迁移的旧数据
+            cover = product.get_images_list()[0]
+        return self.image_url(cover, variant)
+
+    def rebuild_variants(self):
+        """为上传目录中已有的原图补生成变体（同步执行），返回新生成的文件数"""
+        if not self.enabled or not os.path.isdir(self.folder):
+            return 0
+        suffixes = tuple(f'_{variant}.' for variant in VARIANT_SIZES)
+        created = 0
+        for entry in os.scandir(self.folder):
+            name = entry.name
+            if name.endswith('.tmp') or any(s in name for s in suffixes):
+                continue
+            if name.rsplit('.', 1)[-1].lower() not in ('jpg', 'jpeg', 'png', 'gif'):
+                continue
+            try:
+                created += len(build_variants(self.folder, name, self.format))
+            except (OSError, ValueError, Image.DecompressionBombError):
+                self.app.logger.exception('无法处理图片：%s', name)
+        return created
+
+    def backfill_product_images(self, batch_size=500):
+        """把旧的逗号分隔图片字段回填到 product_images 表并设置封面，返回处理的商品数"""
+        migrated = 0
+        last_id = 0
+        while True:
+            products = (Product.query
+                        .filter(Product.id > last_id, Product.images.isnot(None), Product.images != '')
+                        .filter(~Product.image_records.any())
+                        .order_by(Product.id).limit(batch_size).all())
+            if not products:
+                break
+            for product in products:
+                filenames = [name for name in product.get_images_list() if name]
+                product.image_records = [ProductImage(position=position, **self.describe(name))
+                                         for position, name in enumerate(filenames)]
+                product.cover_image = filenames[0] if filenames else None
+            db.session.commit()
+            migrated += len(products)
+            last_id = products[-1].id
+        return migrated
+
+
+image_pipeline = ImagePipeline()
@@ -2,14 +2,24 @@
 数据库初始化脚本
 创建数据库表、索引、触发器、视图等
 """
+import sys
 from app import app, db
-from models import User, Product, Category
+from models import (User, Product, ProductFacetCount, Category, ProductImage, IdempotencyKey, LedgerEntry,
+                    Conversation, Message, RankingState)
+from search import drop_search_index, rebuild_search_index
+from user_stats import reconcile_user_stats, bump as bump_user_stats
+from images import image_pipeline
+from ranking import rebuild_hot_scores
+from payments import deposit, reconcile_ledger
+from messaging import backfill_conversations
+from browse import rebuild_facet_counts
 
 
 def init_database():
     """初始化数据库"""
     with app.app_context():
         # 删除所有表
+        drop_search_index()
         db.drop_all()
         print("已删除所有表")
 
@@ -26,26 +36,44 @@ def init_database():
         # 插入初始数据
         insert_initial_data()
 
-        print("数据库初始化完成！")
+        # 创建全文索引
+        create_search_index()
 
+        # 核对初始数据的用户计数（插入时已增量更新，应无偏差）
+        reconcile_stats()
 
-def create_indexes():
-    """创建额外的索引（提高查询性能）"""
-    with app.app_context():
-        # 执行原始SQL创建索引
-        db.session.execute(db.text("""
-            CREATE INDEX IF NOT EXISTS idx_products_price ON products(price);
-        """))
+        # 计算热度分
+        rebuild_hot_ranking()
 
-        db.session.execute(db.text("""
-            CREATE INDEX IF NOT EXISTS idx_products_status_created ON products(status, created_at DESC);
-        """))
+        # 统计分面计数（之后由发布、预订、释放商品的写路径增量维护）
+        rebuild_facets()
 
-        db.session.execute(db.text("""
-            CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
-        """))
+        print("数据库初始化完成！")
 
-        db.session.commit()
+
+def create_indexes():
+    """按模型中声明的索引同步数据库：创建缺少的索引，删除模型中已不再声明的普通索引
+    索引只在 models.py 的 __table_args__ 中声明；旧版本留下的唯一索引承担唯一约束，保留不删"""
+    with app.app_context():
+        inspector = db.inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+        dropped = []
+        with db.engine.begin() as connection:
+            for table in db.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+                declared = {index.name for index in table.indexes}
+                for index in inspector.get_indexes(table.name):
+                    if index['name'] not in declared and not index['unique']:
+                        connection.execute(db.text(f'DROP INDEX IF EXISTS {index["name"]}'))
+                        dropped.append(index['name'])
+            # 让查询规划器采集新索引的统计信息（PRAGMA 仅 SQLite 支持）
+            if db.engine.dialect.name == 'sqlite':
+                connection.execute(db.text('PRAGMA optimize'))
+        if dropped:
+            print(f"已删除被取代的索引: {', '.join(dropped)}")
         print("索引创建成功")
 
 
@@ -64,10 +92,10 @@ def create_views():
             LEFT JOIN categories c ON p.category_id = c.id
             LEFT JOIN users u ON p.seller_id = u.id
             WHERE p.is_deleted = 0 AND p.status = 'available'
-            ORDER BY (p.view_count * 0.3 + p.favorite_count * 0.7) DESC;
+            ORDER BY p.hot_score DESC;
         """))
 
-        # 创建用户统计视图
+        # 创建用户统计视图（计数读取 user_stats 汇总表，评分按被评价人索引单独聚合）
         db.session.execute(db.text("""
             CREATE VIEW IF NOT EXISTS v_user_stats AS
             SELECT 
@@ -75,17 +103,13 @@ def create_views():
                 u.username,
                 u.real_name,
                 u.credit_score,
-                COUNT(DISTINCT p.id) as product_count,
-                COUNT(DISTINCT CASE WHEN p.status = 'sold' THEN p.id END) as sold_count,
-                COUNT(DISTINCT o1.id) as buy_count,
-                COUNT(DISTINCT o2.id) as sell_count,
-                AVG(CASE WHEN r.reviewee_id = u.id THEN r.rating END) as avg_rating
+                COALESCE(s.product_count, 0) as product_count,
+                COALESCE(s.sold_count, 0) as sold_count,
+                COALESCE(s.buy_count, 0) as buy_count,
+                COALESCE(s.sell_count, 0) as sell_count,
+                (SELECT AVG(r.rating) FROM reviews r WHERE r.reviewee_id = u.id) as avg_rating
             FROM users u
-            LEFT JOIN products p ON u.id = p.seller_id AND p.is_deleted = 0
-            LEFT JOIN orders o1 ON u.id = o1.buyer_id
-            LEFT JOIN orders o2 ON u.id = o2.seller_id
-            LEFT JOIN reviews r ON u.id = r.reviewee_id
-            GROUP BY u.id;
+            LEFT JOIN user_stats s ON s.user_id = u.id;
         """))
 
         # 创建订单详情视图
@@ -168,10 +192,12 @@ def insert_initial_data():
             password = user_data.pop('password')
             user = User(**user_data)
             user.set_password(password)
-            user.balance = 1000.0  # 初始余额
             db.session.add(user)
 
         db.session.commit()
+        for user in User.query.all():
+            deposit(user.id, 100000, commit=False)  # 初始余额 1000 元，记入资金流水
+        db.session.commit()
         print(f"已创建 {len(test_users)} 个测试用户")
 
         # 创建测试商品
@@ -231,51 +257,121 @@ def insert_initial_data():
         for product_data in test_products:
             product = Product(**product_data)
             db.session.add(product)
+            # 与发布商品的写路径一样在同一事务内更新卖家的商品数
+            bump_user_stats(product_data['seller_id'], product_count=1)
 
         db.session.commit()
         print(f"已创建 {len(test_products)} 个测试商品")
 
 
-def create_triggers():
-    """创建触发器（SQLite支持的触发器）"""
+def create_search_index():
+    """创建（或重建）商品全文索引并回填已有商品"""
     with app.app_context():
-        # 触发器1: 订单完成后更新用户信用分
-        db.session.execute(db.text("""
-            CREATE TRIGGER IF NOT EXISTS update_credit_score_on_order_complete
-            AFTER UPDATE ON orders
-            WHEN NEW.status = 'completed' AND OLD.status != 'completed'
-            BEGIN
-                UPDATE users SET credit_score = credit_score + 5 
-                WHERE id = NEW.seller_id AND credit_score < 150;
-                
-                UPDATE users SET credit_score = credit_score + 2 
-                WHERE id = NEW.buyer_id AND credit_score < 150;
-            END;
-        """))
+        count = rebuild_search_index()
+        if db.engine.dialect.name == 'sqlite':
+            print(f"全文索引创建成功，已索引 {count} 个商品")
+        else:
+            print("当前数据库不支持FTS5，搜索将使用LIKE查询")
 
-        # 触发器2: 订单取消后恢复商品状态
-        db.session.execute(db.text("""
-            CREATE TRIGGER IF NOT EXISTS restore_product_on_cancel
-            AFTER UPDATE ON orders
-            WHEN NEW.status = 'cancelled' AND OLD.status != 'cancelled'
-            BEGIN
-                UPDATE products SET status = 'available' 
-                WHERE id = NEW.product_id;
-            END;
-        """))
 
-        # 触发器3: 商品售出后更新售出时间
-        db.session.execute(db.text("""
-            CREATE TRIGGER IF NOT EXISTS update_sold_time
-            AFTER UPDATE ON products
-            WHEN NEW.status = 'sold' AND OLD.status != 'sold'
-            BEGIN
-                UPDATE products SET sold_at = datetime('now') 
-                WHERE id = NEW.id;
-            END;
-        """))
+def reconcile_stats():
+    """从原始表重算用户统计计数，输出并修复偏差"""
+    with app.app_context():
+        drift = reconcile_user_stats(fix=True)
+        for user_id, field, stored, actual in drift:
+            print(f"  用户 {user_id} 的 {field}: 记录值 {stored}，实际值 {actual}")
+        print(f"用户统计对账完成，修复 {len(drift)} 处偏差")
+        return drift
+
 
-        # 触发器4: 插入评价后更新被评价人信用分
+def rebuild_hot_ranking():
+    """重算所有商品的热度分；旧数据库先补 hot_score 列、ranking_state 表并按新定义重建热门商品视图"""
+    with app.app_context():
+        RankingState.__table__.create(db.engine, checkfirst=True)
+        columns = {column['name'] for column in db.inspect(db.engine).get_columns('products')}
+        if 'hot_score' not in columns:
+            db.session.execute(db.text('ALTER TABLE products ADD COLUMN hot_score FLOAT DEFAULT 0'))
+            db.session.execute(db.text('DROP VIEW IF EXISTS v_hot_products'))
+            db.session.commit()
+            print("已添加 products.hot_score 列")
+            create_indexes()
+            create_views()
+        count = rebuild_hot_scores()
+        print(f"热度分计算完成，共 {count} 个商品")
+        return count
+
+
+def build_thumbnails():
+    """为上传目录中已有的图片补生成缩略图和中图"""
+    if not image_pipeline.enabled:
+        print("未安装 Pillow，跳过缩略图生成")
+        return 0
+    created = image_pipeline.rebuild_variants()
+    print(f"缩略图生成完成，新生成 {created} 个文件")
+    return created
+
+
+def migrate_product_images():
+    """迁移：创建 product_images 表与 products.cover_image 列，并从旧的图片字段回填"""
+    with app.app_context():
+        ProductImage.__table__.create(db.engine, checkfirst=True)
+        columns = {column['name'] for column in db.inspect(db.engine).get_columns('products')}
+        if 'cover_image' not in columns:
+            db.session.execute(db.text('ALTER TABLE products ADD COLUMN cover_image VARCHAR(100)'))
+            db.session.commit()
+            print("已添加 products.cover_image 列")
+        build_thumbnails()
+        count = image_pipeline.backfill_product_images()
+        print(f"商品图片回填完成，处理 {count} 个商品")
+        return count
+
+
+# 订单相关的副作用（信用分、商品状态、售出时间）已移到订单状态机 order_state.py，
+# 旧数据库中的这些触发器必须删除，否则会与状态机重复执行
+LEGACY_ORDER_TRIGGERS = (
+    'update_credit_score_on_order_complete',
+    'restore_product_on_cancel',
+    'update_sold_time',
+)
+
+
+def drop_order_triggers():
+    """删除旧的订单触发器"""
+    with app.app_context():
+        for name in LEGACY_ORDER_TRIGGERS:
+            db.session.execute(db.text(f'DROP TRIGGER IF EXISTS {name}'))
+        db.session.commit()
+
+
+def migrate_orders():
+    """迁移：创建幂等键表并删除旧的订单触发器"""
+    with app.app_context():
+        IdempotencyKey.__table__.create(db.engine, checkfirst=True)
+    drop_order_triggers()
+    print("订单状态机迁移完成")
+
+
+def rebuild_facets():
+    """重新统计首页分面计数汇总表"""
+    with app.app_context():
+        total = rebuild_facet_counts()
+        db.session.commit()
+        print(f"分面计数统计完成，共 {total} 个在售商品")
+
+
+def migrate_facets():
+    """迁移：创建分面计数表、首页筛选与排序索引，并统计现有商品"""
+    with app.app_context():
+        ProductFacetCount.__table__.create(db.engine, checkfirst=True)
+    create_indexes()
+    rebuild_facets()
+
+
+def create_triggers():
+    """创建触发器（SQLite支持的触发器）"""
+    drop_order_triggers()
+    with app.app_context():
+        # 插入评价后更新被评价人信用分
         db.session.execute(db.text("""
             CREATE TRIGGER IF NOT EXISTS update_credit_on_review
             AFTER INSERT ON reviews
@@ -287,11 +383,145 @@ def create_triggers():
             END;
         """))
 
+        # 资金流水只追加：禁止修改和删除
+        for event in ('UPDATE', 'DELETE'):
+            db.session.execute(db.text(f"""
+                CREATE TRIGGER IF NOT EXISTS ledger_entries_no_{event.lower()}
+                BEFORE {event} ON ledger_entries
+                BEGIN
+                    SELECT RAISE(ABORT, 'ledger_entries is append-only');
+                END;
+            """))
+
         db.session.commit()
         print("触发器创建成功")
 
 
+def migrate_payments():
+    """迁移：余额改为整数分并为已有余额补一条期初流水，创建资金流水表与结算字段"""
+    with app.app_context():
+        LedgerEntry.__table__.create(db.engine, checkfirst=True)
+        user_columns = {column['name'] for column in db.inspect(db.engine).get_columns('users')}
+        if 'balance_cents' not in user_columns:
+            db.session.execute(db.text(
+                'ALTER TABLE users ADD COLUMN balance_cents INTEGER NOT NULL DEFAULT 0'))
+            if 'balance' in user_columns:
+                db.session.execute(db.text(
+                    'UPDATE users SET balance_cents = CAST(ROUND(COALESCE(balance, 0) * 100) AS INTEGER)'))
+            db.session.execute(db.text("""
+                INSERT INTO ledger_entries (user_id, entry_type, amount_cents, balance_after_cents, created_at)
+                SELECT id, 'deposit', balance_cents, balance_cents, CURRENT_TIMESTAMP
+                FROM users WHERE balance_cents != 0
+            """))
+            print("已添加 users.balance_cents 列并写入期初流水")
+        order_columns = {column['name'] for column in db.inspect(db.engine).get_columns('orders')}
+        if 'settled_at' not in order_columns:
+            db.session.execute(db.text('ALTER TABLE orders ADD COLUMN settled_at DATETIME'))
+            print("已添加 orders.settled_at 列")
+        db.session.commit()
+        drift = reconcile_ledger()
+    create_indexes()
+    create_triggers()
+    print(f"支付迁移完成，{len(drift)} 个用户的余额与流水不一致")
+    return drift
+
+
+def migrate_audit():
+    """迁移：为 system_logs 添加审计流水线写入的 user_agent、latency_ms 列"""
+    with app.app_context():
+        columns = {column['name'] for column in db.inspect(db.engine).get_columns('system_logs')}
+        if 'user_agent' not in columns:
+            db.session.execute(db.text('ALTER TABLE system_logs ADD COLUMN user_agent VARCHAR(200)'))
+            print("已添加 system_logs.user_agent 列")
+        if 'latency_ms' not in columns:
+            db.session.execute(db.text('ALTER TABLE system_logs ADD COLUMN latency_ms INTEGER'))
+            print("已添加 system_logs.latency_ms 列")
+        db.session.commit()
+    print("审计日志迁移完成")
+
+
+def migrate_messages():
+    """迁移：创建会话表与私信复合索引，回填历史消息的会话并重算未读数"""
+    with app.app_context():
+        Conversation.__table__.create(db.engine, checkfirst=True)
+        inspector = db.inspect(db.engine)
+        if 'conversation_id' not in {column['name'] for column in inspector.get_columns('messages')}:
+            db.session.execute(db.text('ALTER TABLE messages ADD COLUMN conversation_id INTEGER REFERENCES conversations(id)'))
+            print("已添加 messages.conversation_id 列")
+        if 'unread_message_count' not in {column['name'] for column in inspector.get_columns('user_stats')}:
+            db.session.execute(db.text(
+                'ALTER TABLE user_stats ADD COLUMN unread_message_count INTEGER NOT NULL DEFAULT 0'))
+            print("已添加 user_stats.unread_message_count 列")
+        db.session.commit()
+        for index in Message.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        count = backfill_conversations()
+        print(f"私信会话回填完成，处理 {count} 条消息")
+    reconcile_stats()
+    return count
+
+
 if __name__ == '__main__':
+    # python init_db.py --rebuild-search  仅重建全文索引，不清空数据
+    if '--rebuild-search' in sys.argv:
+        create_search_index()
+        sys.exit(0)
+
+    # python init_db.py --reconcile-stats  重算用户统计计数并报告偏差
+    if '--reconcile-stats' in sys.argv:
+        reconcile_stats()
+        sys.exit(0)
+
+    # python init_db.py --migrate-orders  创建幂等键表并删除旧的订单触发器
+    if '--migrate-orders' in sys.argv:
+        migrate_orders()
+        sys.exit(0)
+
+    # python init_db.py --migrate-payments  余额改为整数分并创建资金流水表
+    if '--migrate-payments' in sys.argv:
+        migrate_payments()
+        sys.exit(0)
+
+    # python init_db.py --migrate-audit  为系统日志表添加 User-Agent 与请求耗时列
+    if '--migrate-audit' in sys.argv:
+        migrate_audit()
+        sys.exit(0)
+
+    # python init_db.py --migrate-messages  创建私信会话表与未读索引并回填
+    if '--migrate-messages' in sys.argv:
+        migrate_messages()
+        sys.exit(0)
+
+    # python init_db.py --migrate-facets  创建首页分面计数表与筛选排序索引并统计现有商品
+    if '--migrate-facets' in sys.argv:
+        migrate_facets()
+        sys.exit(0)
+
+    # python init_db.py --rebuild-facets  重新统计首页分面计数
+    if '--rebuild-facets' in sys.argv:
+        rebuild_facets()
+        sys.exit(0)
+
+    # python init_db.py --sync-indexes  按 models.py 中声明的索引创建新索引、删除被取代的旧索引
+    if '--sync-indexes' in sys.argv:
+        create_indexes()
+        sys.exit(0)
+
+    # python init_db.py --rebuild-hot  重算热度分（修改权重或半衰期后执行）
+    if '--rebuild-hot' in sys.argv:
+        rebuild_hot_ranking()
+        sys.exit(0)
+
+    # python init_db.py --build-thumbnails  为已有图片补生成缩略图
+    if '--build-thumbnails' in sys.argv:
+        build_thumbnails()
+        sys.exit(0)
+
+    # python init_db.py --migrate-images  从旧的逗号分隔字段迁移到 product_images 表
+    if '--migrate-images' in sys.argv:
+        migrate_product_images()
+        sys.exit(0)
+
     init_database()
     create_triggers()
     print("\n数据库初始化完成！")
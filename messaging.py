@@ -0,0 +1,215 @@
+"""
+站内私信
+- 会话按 (较小用户ID, 较大用户ID, 商品ID) 唯一，收件箱直接按 conversations.last_message_at 读取，
+  不需要在 messages 表上分组查找每个会话的最后一条消息
+- 未读数：user_stats.unread_message_count 在发送、标记已读的同一事务内增量维护；
+  读取时以"信箱代数"为键放入缓存，代数不变就不访问数据库
+- 推送：每个用户有一个信箱代数（cache.GenerationTable；文件缓存后端下为多进程共享的内存映射文件），
+  发送消息或标记已读并提交后代数加一，同时唤醒本进程内等待的连接。
+  SSE / 长轮询连接等待期间不占用数据库连接，只在代数变化时读取一次未读数；
+  每隔 MESSAGE_WAKE_INTERVAL 秒检查一次内存中的代数，以发现其他进程写入的消息。
+  线程模式（WSGI）下每个等待的连接占一个线程：浏览器默认使用长轮询，每个进程同时等待的连接数不超过
+  MESSAGE_MAX_WAITERS（默认每进程线程数的一半），其余请求立即返回；SSE 只在 MESSAGE_PUSH 为 stream 时提供
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from models import db, Conversation, Message, UserStats
+from cache import cache, GenerationTable
+import user_stats
+
+
+class MessageHub:
+    """按用户的信箱代数与等待队列"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.versions = GenerationTable()
+        self._condition = threading.Condition()
+        self._waiters = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if app.config['CACHE_BACKEND'] == 'file':
+            directory = app.config['CACHE_DIR']
+            os.makedirs(directory, exist_ok=True)
+            self.versions = GenerationTable(os.path.join(directory, 'mailbox.bin'),
+                                            slots=app.config['MESSAGE_MAILBOX_SLOTS'])
+        app.extensions['message_hub'] = self
+
+    def version(self, user_id):
+        return self.versions.get(f'user:{user_id}')
+
+    def notify(self, *user_ids):
+        """提交后调用：信箱代数加一并唤醒等待的连接"""
+        for user_id in user_ids:
+            self.versions.bump(f'user:{user_id}')
+        with self._condition:
+            self._condition.notify_all()
+
+    def enter(self):
+        """占用一个等待名额，名额已满时返回 False；成功时调用方在连接结束后调用 leave()"""
+        limit = self.app.config['MESSAGE_MAX_WAITERS'] or max(1, self.app.config['SERVE_THREADS'] // 2)
+        with self._condition:
+            if self._waiters >= limit:
+                return False
+            self._waiters += 1
+            return True
+
+    def leave(self):
+        with self._condition:
+            self._waiters -= 1
+
+    def wait(self, user_id, since, timeout):
+        """等待 user_id 的信箱代数与 since 不同，返回当前代数（超时时可能仍等于 since）
+        检查与进入等待之间错过的唤醒最多延迟一个检查间隔"""
+        if not math.isfinite(timeout):
+            raise ValueError(f'timeout 必须是有限数值: {timeout}')
+        deadline = time.monotonic() + timeout
+        interval = self.app.config['MESSAGE_WAKE_INTERVAL']
+        while True:
+            current = self.version(user_id)
+            remaining = deadline - time.monotonic()
+            if current != since or remaining <= 0:
+                return current
+            with self._condition:
+                self._condition.wait(min(interval, remaining))
+
+
+hub = MessageHub()
+
+
+def unread_count(user_id):
+    """未读私信数，以信箱代数为缓存键，代数变化后自然失效"""
+    def load():
+        count = db.session.execute(
+            db.select(UserStats.unread_message_count).where(UserStats.user_id == user_id)
+        ).scalar()
+        return count or 0
+    return cache.get_or_set('unread', (user_id, hub.version(user_id)), load,
+                            current_app.config['MESSAGE_UNREAD_TTL'])
+
+
+def get_or_create_conversation(user_a, user_b, product_id=None):
+    """在当前事务中取得两人关于 product_id 的会话，不存在时创建
+    应在事务中的其他写操作之前调用：并发创建同一会话时这里会回滚当前事务"""
+    key = Conversation.make_key(user_a, user_b, product_id)
+    conversation = Conversation.query.filter_by(thread_key=key).first()
+    if conversation is not None:
+        return conversation
+    low, high = sorted((user_a, user_b))
+    conversation = Conversation(thread_key=key, user_low_id=low, user_high_id=high, product_id=product_id)
+    db.session.add(conversation)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # 另一个请求先创建了同一会话
+        db.session.rollback()
+        conversation = Conversation.query.filter_by(thread_key=key).one()
+    return conversation
+
+
+def send_message(sender_id, receiver_id, content, product_id=None):
+    """写入消息、更新会话与接收者未读数并提交，然后唤醒接收者的连接，返回消息"""
+    conversation = get_or_create_conversation(sender_id, receiver_id, product_id)
+    now = datetime.now()
+    message = Message(conversation_id=conversation.id, sender_id=sender_id, receiver_id=receiver_id,
+                      product_id=product_id, content=content, created_at=now)
+    db.session.add(message)
+    db.session.flush()
+    db.session.execute(
+        db.update(Conversation).where(Conversation.id == conversation.id)
+        .values(last_message_id=message.id, last_message_at=now)
+    )
+    user_stats.bump(receiver_id, unread_message_count=1)
+    db.session.commit()
+    hub.notify(receiver_id)
+    return message
+
+
+def mark_read(conversation_id, user_id):
+    """把会话中发给 user_id 的未读消息标记为已读并提交，返回标记的条数"""
+    result = db.session.execute(
+        db.update(Message)
+        .where(Message.conversation_id == conversation_id, Message.receiver_id == user_id,
+               Message.is_read == False)
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        # 以实际更新的行数递减，并发的两次标记不会重复扣减
+        user_stats.bump(user_id, unread_message_count=-result.rowcount)
+    db.session.commit()
+    if result.rowcount:
+        # 同一用户的其他页面也要刷新未读数
+        hub.notify(user_id)
+    return result.rowcount
+
+
+def inbox(user_id, limit=50):
+    """收件箱：按最后消息时间倒序的会话列表，每项含对方用户、最后一条消息与未读数"""
+    conversations = (
+        Conversation.query
+        .options(joinedload(Conversation.user_low), joinedload(Conversation.user_high),
+                 joinedload(Conversation.product))
+        .filter(db.or_(Conversation.user_low_id == user_id, Conversation.user_high_id == user_id))
+        .order_by(Conversation.last_message_at.desc())
+        .limit(limit).all()
+    )
+    if not conversations:
+        return []
+
+    last_ids = [c.last_message_id for c in conversations if c.last_message_id]
+    last_messages = {m.id: m for m in Message.query.filter(Message.id.in_(last_ids))}
+    # 走 (receiver_id, is_read, created_at) 索引，只读取未读的行
+    unread = dict(db.session.execute(
+        db.select(Message.conversation_id, db.func.count())
+        .where(Message.receiver_id == user_id, Message.is_read == False)
+        .group_by(Message.conversation_id)
+    ).all())
+
+    return [{'conversation': c,
+             'other': c.other_user(user_id),
+             'last_message': last_messages.get(c.last_message_id),
+             'unread': unread.get(c.id, 0)}
+            for c in conversations]
+
+
+def conversation_messages(conversation_id, limit=50):
+    """会话中最近 limit 条消息，按时间正序"""
+    messages = (Message.query.filter_by(conversation_id=conversation_id)
+                .order_by(Message.id.desc()).limit(limit).all())
+    messages.reverse()
+    return messages
+
+
+def backfill_conversations(batch_size=1000):
+    """为没有会话ID的历史消息按 (用户对, 商品) 创建会话并回填，返回回填的消息数"""
+    filled = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Message.id, Message.sender_id, Message.receiver_id, Message.product_id,
+                      Message.created_at)
+            .where(Message.conversation_id.is_(None)).order_by(Message.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return filled
+        for row in rows:
+            conversation = get_or_create_conversation(row.sender_id, row.receiver_id, row.product_id)
+            db.session.execute(
+                db.update(Message).where(Message.id == row.id).values(conversation_id=conversation.id)
+            )
+            if conversation.last_message_id is None or conversation.last_message_id < row.id:
+                conversation.last_message_id = row.id
+                conversation.last_message_at = row.created_at
+        db.session.commit()
+        filled += len(rows)
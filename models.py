@@ -7,17 +7,25 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from db_profile import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# 在售商品的部分索引条件；查询中的对应条件须以常量出现（见 Product.listed()），SQLite 才会使用这些索引
+LISTED_WHERE = db.text("is_deleted = 0 AND status = 'available'")
 
 
 class User(UserMixin, db.Model):
     """用户表 - 存储用户基本信息"""
     __tablename__ = 'users'
+    __table_args__ = (
+        # 首页按校区筛选：校区列表与某校区的卖家ID都只读索引
+        db.Index('idx_users_campus', 'campus'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.String(20), unique=True, nullable=False, index=True, comment='学号')
-    username = db.Column(db.String(50), unique=True, nullable=False, index=True, comment='用户名')
+    student_id = db.Column(db.String(20), unique=True, nullable=False, comment='学号')
+    username = db.Column(db.String(50), unique=True, nullable=False, comment='用户名')
     password_hash = db.Column(db.String(200), nullable=False, comment='密码哈希')
     real_name = db.Column(db.String(50), nullable=False, comment='真实姓名')
     email = db.Column(db.String(100), unique=True, nullable=False, comment='邮箱')
@@ -25,7 +33,7 @@ class User(UserMixin, db.Model):
     campus = db.Column(db.String(50), comment='所在校区')
     dormitory = db.Column(db.String(50), comment='宿舍地址')
     avatar = db.Column(db.String(200), default='default.jpg', comment='头像路径')
-    balance = db.Column(db.Float, default=0.0, comment='账户余额')
+    balance_cents = db.Column(db.Integer, nullable=False, default=0, comment='账户余额（分）')
     credit_score = db.Column(db.Integer, default=100, comment='信用分')
     is_active = db.Column(db.Boolean, default=True, comment='账户是否激活')
     created_at = db.Column(db.DateTime, default=datetime.now, comment='注册时间')
@@ -45,6 +53,12 @@ class User(UserMixin, db.Model):
                                    foreign_keys='Message.sender_id')
     messages_received = db.relationship('Message', backref='receiver', lazy='dynamic',
                                        foreign_keys='Message.receiver_id')
+    stats = db.relationship('UserStats', backref='user', uselist=False, cascade='all, delete-orphan')
+
+    @property
+    def balance(self):
+        """账户余额（元），仅用于展示；金额计算一律使用 balance_cents"""
+        return (self.balance_cents or 0) / 100
 
     def set_password(self, password):
         """设置密码"""
@@ -58,6 +72,23 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
 
+class UserStats(db.Model):
+    """用户统计表 - 个人中心计数的冗余汇总，由业务写路径在同一事务内增量维护"""
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, comment='用户ID')
+    product_count = db.Column(db.Integer, default=0, nullable=False, comment='在架商品数（未删除）')
+    sold_count = db.Column(db.Integer, default=0, nullable=False, comment='已售出商品数')
+    buy_count = db.Column(db.Integer, default=0, nullable=False, comment='购买订单数')
+    sell_count = db.Column(db.Integer, default=0, nullable=False, comment='销售订单数')
+    favorite_count = db.Column(db.Integer, default=0, nullable=False, comment='收藏商品数')
+    unread_message_count = db.Column(db.Integer, default=0, nullable=False, comment='未读私信数')
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f'<UserStats user:{self.user_id}>'
+
+
 class Category(db.Model):
     """商品分类表"""
     __tablename__ = 'categories'
@@ -79,31 +110,57 @@ class Category(db.Model):
 class Product(db.Model):
     """商品表 - 存储商品信息"""
     __tablename__ = 'products'
+    __table_args__ = (
+        # 首页列表：在售商品按 (created_at, id) 倒序游标分页，可选按分类过滤
+        db.Index('idx_products_listed', 'created_at', 'id', sqlite_where=LISTED_WHERE),
+        db.Index('idx_products_listed_category', 'category_id', 'created_at', 'id', sqlite_where=LISTED_WHERE),
+        # 热门商品与首页"最热"排序：在售商品按热度分倒序
+        db.Index('idx_products_listed_hot', 'hot_score', sqlite_where=LISTED_WHERE),
+        db.Index('idx_products_listed_category_hot', 'category_id', 'hot_score', sqlite_where=LISTED_WHERE),
+        # 首页按价格排序与价格区间过滤
+        db.Index('idx_products_listed_price', 'price', 'id', sqlite_where=LISTED_WHERE),
+        db.Index('idx_products_listed_category_price', 'category_id', 'price', 'id', sqlite_where=LISTED_WHERE),
+        # 分面计数（按分类、新旧程度 GROUP BY）的覆盖索引，价格区间与校区（卖家）条件都不需要回表
+        db.Index('idx_products_listed_facets', 'category_id', 'condition', 'price', 'seller_id',
+                 sqlite_where=LISTED_WHERE),
+        # 我的商品、个人中心、详情页的卖家其他商品
+        db.Index('idx_products_seller', 'seller_id', 'is_deleted', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False, index=True, comment='商品标题')
+    title = db.Column(db.String(200), nullable=False, comment='商品标题')
     description = db.Column(db.Text, nullable=False, comment='商品描述')
     price = db.Column(db.Float, nullable=False, comment='价格')
     original_price = db.Column(db.Float, comment='原价')
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False, comment='分类ID')
-    seller_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='卖家ID')
+    seller_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='卖家ID')
     condition = db.Column(db.String(20), comment='新旧程度')  # 全新/几乎全新/轻微使用痕迹/明显使用痕迹
     status = db.Column(db.String(20), default='available', comment='状态')  # available/sold/reserved
     view_count = db.Column(db.Integer, default=0, comment='浏览次数')
     favorite_count = db.Column(db.Integer, default=0, comment='收藏次数')
+    hot_score = db.Column(db.Float, default=0, comment='热度分（前向时间衰减，见 ranking.py）')
     trade_location = db.Column(db.String(100), comment='交易地点')
-    images = db.Column(db.Text, comment='图片路径，多个用逗号分隔')
+    images = db.Column(db.Text, comment='图片路径，多个用逗号分隔（兼容旧版本保留，图片明细见 product_images）')
+    cover_image = db.Column(db.String(100), comment='封面图片文件名（第一张图片），列表页直接使用')
     is_deleted = db.Column(db.Boolean, default=False, comment='是否删除')
-    created_at = db.Column(db.DateTime, default=datetime.now, index=True, comment='发布时间')
+    created_at = db.Column(db.DateTime, default=datetime.now, comment='发布时间')
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     sold_at = db.Column(db.DateTime, comment='售出时间')
 
     # 关系
     favorites = db.relationship('Favorite', backref='product', lazy='dynamic', cascade='all, delete-orphan')
     orders = db.relationship('Order', backref='product', lazy='dynamic')
+    image_records = db.relationship('ProductImage', backref='product', order_by='ProductImage.position',
+                                    cascade='all, delete-orphan')
+
+    @staticmethod
+    def listed():
+        """在售条件：状态以常量内联到SQL中（literal_execute），与部分索引的 WHERE 条件匹配"""
+        return db.and_(Product.is_deleted == False,
+                       Product.status == db.literal('available', literal_execute=True))
 
     def get_images_list(self):
-        """获取图片列表"""
+        """获取图片文件名列表（解析旧的逗号分隔字段，新代码请使用 image_records）"""
         if self.images:
             return self.images.split(',')
         return []
@@ -112,26 +169,71 @@ class Product(db.Model):
         return f'<Product {self.title}>'
 
 
+class ProductFacetCount(db.Model):
+    """分面计数表 - 在售商品按 (分类, 新旧程度) 的数量，由商品写路径增量维护（见 browse.bump_facet）"""
+    __tablename__ = 'product_facet_counts'
+
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), primary_key=True, autoincrement=False,
+                            comment='分类ID')
+    condition = db.Column(db.String(20), primary_key=True, default='', comment='新旧程度，未填写时为空串')
+    listed_count = db.Column(db.Integer, nullable=False, default=0, comment='在售商品数')
+
+    def __repr__(self):
+        return f'<ProductFacetCount {self.category_id}/{self.condition}: {self.listed_count}>'
+
+
+class ProductImage(db.Model):
+    """商品图片表 - 每张图片一行，按 position 排序，position=0 为封面"""
+    __tablename__ = 'product_images'
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'position', name='uq_product_image_position'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, comment='商品ID')
+    position = db.Column(db.Integer, nullable=False, default=0, comment='排列顺序')
+    filename = db.Column(db.String(100), nullable=False, comment='原图文件名')
+    width = db.Column(db.Integer, comment='宽度（像素）')
+    height = db.Column(db.Integer, comment='高度（像素）')
+    byte_size = db.Column(db.Integer, comment='原图字节数')
+    thumb_key = db.Column(db.String(100), comment='缩略图文件名')
+    medium_key = db.Column(db.String(100), comment='中图文件名')
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<ProductImage {self.product_id}#{self.position}>'
+
+
 class Order(db.Model):
     """订单表 - 存储交易订单信息"""
     __tablename__ = 'orders'
+    __table_args__ = (
+        # 我的订单（买入 / 卖出）按 (created_at, id) 倒序游标分页
+        db.Index('idx_orders_buyer', 'buyer_id', 'created_at', 'id'),
+        db.Index('idx_orders_seller', 'seller_id', 'created_at', 'id'),
+        # 超时订单清理：status = 'pending' AND created_at < ?
+        db.Index('idx_orders_status_created', 'status', 'created_at'),
+        # 货款结算：只包含已完成未结算的订单
+        db.Index('idx_orders_unsettled', 'id', sqlite_where=db.text("status = 'completed' AND settled_at IS NULL")),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    order_no = db.Column(db.String(50), unique=True, nullable=False, index=True, comment='订单号')
+    order_no = db.Column(db.String(50), unique=True, nullable=False, comment='订单号')
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, comment='商品ID')
-    buyer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='买家ID')
-    seller_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='卖家ID')
+    buyer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='买家ID')
+    seller_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='卖家ID')
     price = db.Column(db.Float, nullable=False, comment='成交价格')
     status = db.Column(db.String(20), default='pending', comment='订单状态')
-    # pending/paid/delivering/completed/cancelled/refunding/refunded
+    # pending/paid/delivering/completed/cancelled/refunding/disputed/refunded
     payment_method = db.Column(db.String(20), comment='支付方式')  # balance/alipay/wechat
     trade_location = db.Column(db.String(100), comment='交易地点')
     buyer_note = db.Column(db.Text, comment='买家备注')
     seller_note = db.Column(db.Text, comment='卖家备注')
-    created_at = db.Column(db.DateTime, default=datetime.now, index=True, comment='创建时间')
+    created_at = db.Column(db.DateTime, default=datetime.now, comment='创建时间')
     paid_at = db.Column(db.DateTime, comment='支付时间')
     completed_at = db.Column(db.DateTime, comment='完成时间')
     cancelled_at = db.Column(db.DateTime, comment='取消时间')
+    settled_at = db.Column(db.DateTime, comment='货款结算给卖家的时间')
 
     # 关系
     review = db.relationship('Review', backref='order', uselist=False, cascade='all, delete-orphan')
@@ -143,15 +245,20 @@ class Order(db.Model):
 class Review(db.Model):
     """评价表 - 存储交易评价"""
     __tablename__ = 'reviews'
+    __table_args__ = (
+        db.Index('idx_reviews_reviewer', 'reviewer_id'),
+        # 信用分触发器与评分统计按被评价人聚合
+        db.Index('idx_reviews_reviewee', 'reviewee_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), unique=True, nullable=False, comment='订单ID')
-    reviewer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='评价人ID')
-    reviewee_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='被评价人ID')
+    reviewer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='评价人ID')
+    reviewee_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='被评价人ID')
     rating = db.Column(db.Integer, nullable=False, comment='评分 1-5')
     content = db.Column(db.Text, comment='评价内容')
     is_anonymous = db.Column(db.Boolean, default=False, comment='是否匿名')
-    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
 
     reviewee = db.relationship('User', foreign_keys=[reviewee_id], backref='reviews_received')
 
@@ -164,30 +271,73 @@ class Favorite(db.Model):
     __tablename__ = 'favorites'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='用户ID')
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True, comment='商品ID')
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='用户ID')
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, comment='商品ID')
     created_at = db.Column(db.DateTime, default=datetime.now)
 
-    # 联合唯一索引
     __table_args__ = (
+        # 联合唯一索引
         db.UniqueConstraint('user_id', 'product_id', name='unique_user_product'),
+        # 我的收藏按 (created_at, id) 倒序游标分页
+        db.Index('idx_favorites_user', 'user_id', 'created_at', 'id'),
+        db.Index('idx_favorites_product', 'product_id'),
     )
 
     def __repr__(self):
         return f'<Favorite user:{self.user_id} product:{self.product_id}>'
 
 
+class Conversation(db.Model):
+    """会话表 - 两个用户围绕同一商品（或不关联商品）的私信会话，收件箱直接按最后消息时间读取"""
+    __tablename__ = 'conversations'
+    __table_args__ = (
+        db.Index('idx_conversations_low', 'user_low_id', 'last_message_at'),
+        db.Index('idx_conversations_high', 'user_high_id', 'last_message_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    thread_key = db.Column(db.String(50), unique=True, nullable=False, comment='较小用户ID-较大用户ID-商品ID')
+    user_low_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='ID较小的用户')
+    user_high_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='ID较大的用户')
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), comment='关联商品ID')
+    last_message_id = db.Column(db.Integer, comment='最后一条消息ID')
+    last_message_at = db.Column(db.DateTime, default=datetime.now, comment='最后一条消息时间')
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    user_low = db.relationship('User', foreign_keys=[user_low_id])
+    user_high = db.relationship('User', foreign_keys=[user_high_id])
+    product = db.relationship('Product')
+
+    @staticmethod
+    def make_key(user_a, user_b, product_id=None):
+        low, high = sorted((user_a, user_b))
+        return f'{low}-{high}-{product_id or 0}'
+
+    def other_user(self, user_id):
+        return self.user_high if user_id == self.user_low_id else self.user_low
+
+    def __repr__(self):
+        return f'<Conversation {self.thread_key}>'
+
+
 class Message(db.Model):
     """消息表 - 存储用户间的私信"""
     __tablename__ = 'messages'
+    __table_args__ = (
+        # 未读数与收件箱：按接收者、是否已读、时间的复合索引
+        db.Index('idx_messages_receiver_unread', 'receiver_id', 'is_read', 'created_at'),
+        db.Index('idx_messages_conversation', 'conversation_id', 'id'),
+        db.Index('idx_messages_sender', 'sender_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='发送者ID')
-    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True, comment='接收者ID')
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), comment='会话ID')
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='发送者ID')
+    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='接收者ID')
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), comment='关联商品ID')
     content = db.Column(db.Text, nullable=False, comment='消息内容')
     is_read = db.Column(db.Boolean, default=False, comment='是否已读')
-    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
 
     related_product = db.relationship('Product', backref='messages')
 
@@ -195,9 +345,62 @@ class Message(db.Model):
         return f'<Message {self.id}>'
 
 
+class IdempotencyKey(db.Model):
+    """幂等键表 - 记录已处理的表单提交，重复提交时直接返回之前的结果"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        # 过期幂等键清理
+        db.Index('idx_idempotency_keys_created', 'created_at'),
+    )
+
+    key = db.Column(db.String(64), primary_key=True, comment='客户端提交的唯一标识')
+    user_id = db.Column(db.Integer, comment='提交用户ID')
+    action = db.Column(db.String(50), nullable=False, comment='操作类型')
+    order_id = db.Column(db.Integer, comment='关联订单ID')
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
+
+
+class LedgerEntry(db.Model):
+    """资金流水表 - 只追加不修改，每条记录变动后的余额快照"""
+    __tablename__ = 'ledger_entries'
+    __table_args__ = (
+        db.Index('idx_ledger_user', 'user_id', 'id'),
+        db.Index('idx_ledger_order', 'order_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='用户ID')
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), comment='关联订单ID')
+    entry_type = db.Column(db.String(20), nullable=False, comment='流水类型')
+    # deposit/payment/refund/settlement
+    amount_cents = db.Column(db.Integer, nullable=False, comment='变动金额（分），支出为负')
+    balance_after_cents = db.Column(db.Integer, nullable=False, comment='变动后余额（分）')
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<LedgerEntry {self.entry_type} {self.amount_cents}>'
+
+
+class RankingState(db.Model):
+    """排行状态表 - 只有一行（id=1），保存热度分的衰减起点（见 ranking.py）"""
+    __tablename__ = 'ranking_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hot_epoch = db.Column(db.DateTime, nullable=False, comment='热度分的衰减起点')
+
+    def __repr__(self):
+        return f'<RankingState {self.hot_epoch}>'
+
+
 class SystemLog(db.Model):
     """系统日志表 - 记录重要操作"""
     __tablename__ = 'system_logs'
+    __table_args__ = (
+        db.Index('idx_system_logs_created', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), comment='用户ID')
@@ -206,7 +409,9 @@ class SystemLog(db.Model):
     record_id = db.Column(db.Integer, comment='记录ID')
     description = db.Column(db.Text, comment='操作描述')
     ip_address = db.Column(db.String(50), comment='IP地址')
-    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    user_agent = db.Column(db.String(200), comment='客户端User-Agent')
+    latency_ms = db.Column(db.Integer, comment='请求耗时（毫秒）')
+    created_at = db.Column(db.DateTime, default=datetime.now)
 
     user = db.relationship('User', backref='logs')
 
@@ -0,0 +1,209 @@
+"""
+订单状态机
+pending(待支付) → paid(已支付) → delivering(交付中) → completed(已完成)
+任意未完成阶段可取消或退款：pending → cancelled，paid/delivering → refunding → refunded
+卖家拒绝退款时订单进入 disputed(争议中)：卖家不能再操作，由买家撤回（确认完成）或平台仲裁（system）退款/完成
+每次转换在同一事务内完成：条件更新订单状态、商品状态、信用分、用户统计与系统日志，
+不再依赖 init_db.py 中创建的触发器；携带幂等键的重复提交只执行一次
+"""
+import uuid
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Order, Product, User, IdempotencyKey
+from audit import audit
+import user_stats
+from browse import bump_facet
+
+# 当前状态 -> {目标状态: 允许执行的角色}；system 表示后台任务（超时取消、支付回调）
+# 已付款的订单货款由平台托管，完成后结算给卖家，因此只能由买家（或系统）确认完成
+TRANSITIONS = {
+    'pending': {'paid': ('system',), 'completed': ('seller',), 'cancelled': ('buyer', 'system')},
+    'paid': {'delivering': ('seller',), 'completed': ('buyer', 'system'), 'refunding': ('buyer',)},
+    'delivering': {'completed': ('buyer', 'system'), 'refunding': ('buyer',)},
+    'refunding': {'refunded': ('seller', 'system'), 'disputed': ('seller',)},
+    'disputed': {'completed': ('buyer', 'system'), 'refunded': ('system',)},
+    'completed': {},
+    'cancelled': {},
+    'refunded': {},
+}
+
+# 未经平台支付的订单（线下当面付款）的支付方式
+OFFLINE_PAYMENT_METHODS = (None, 'cash', 'offline')
+
+# 角色之外的附加条件：(当前状态, 目标状态) -> (条件 func(order), 不满足时的提示)
+GUARDS = {
+    # 卖家直接确认完成只适用于线下付款的订单
+    ('pending', 'completed'): (lambda order: order.payment_method in OFFLINE_PAYMENT_METHODS,
+                               '只有线下付款的订单可以由卖家直接确认完成'),
+}
+
+STATUS_LABELS = {
+    'pending': '待支付',
+    'paid': '已支付',
+    'delivering': '交付中',
+    'completed': '已完成',
+    'cancelled': '已取消',
+    'refunding': '退款中',
+    'disputed': '争议中',
+    'refunded': '已退款',
+}
+
+# 目标状态 -> (日志操作类型, 按钮/日志文字)
+ACTIONS = {
+    'paid': ('pay_order', '支付订单'),
+    'delivering': ('deliver_order', '开始交付'),
+    'completed': ('complete_order', '确认订单完成'),
+    'cancelled': ('cancel_order', '取消订单'),
+    'refunding': ('request_refund', '申请退款'),
+    'refunded': ('refund_order', '同意退款'),
+    'disputed': ('reject_refund', '拒绝退款'),
+}
+
+# 进入这些状态时写入的时间字段
+TIMESTAMPS = {'paid': 'paid_at', 'completed': 'completed_at', 'cancelled': 'cancelled_at'}
+
+CREDIT_REWARD = {'seller': 5, 'buyer': 2}
+CREDIT_MAX = 150
+
+# 目标状态 -> 在转换事务内执行的附加回调 func(order, now)，例如退款时退回货款
+_hooks = {}
+
+
+class OrderStateError(Exception):
+    """非法的订单状态转换，message 可直接展示给用户"""
+
+
+def on_transition(target):
+    """注册进入 target 状态时在同一事务内执行的回调，回调抛出异常会使整个转换回滚"""
+    def decorator(func):
+        _hooks.setdefault(target, []).append(func)
+        return func
+    return decorator
+
+
+def role_of(order, user_id):
+    if user_id is None:
+        return 'system'
+    if user_id == order.buyer_id:
+        return 'buyer'
+    if user_id == order.seller_id:
+        return 'seller'
+    return None
+
+
+def _guard_failure(order, source, target):
+    """附加条件不满足时返回提示，否则返回None"""
+    guard = GUARDS.get((source, target))
+    if guard is not None and not guard[0](order):
+        return guard[1]
+    return None
+
+
+def available_transitions(order, user_id):
+    """当前用户可以执行的目标状态（用于页面按钮）"""
+    role = role_of(order, user_id)
+    return [target for target, roles in TRANSITIONS.get(order.status, {}).items()
+            if role in roles and _guard_failure(order, order.status, target) is None]
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def claim_idempotency_key(key, user_id, action, order_id=None):
+    """在当前事务中登记幂等键；该键已处理过时返回之前的记录，否则返回None
+    应在事务中的其他写操作之前调用：并发重复提交时这里会回滚当前事务"""
+    existing = db.session.get(IdempotencyKey, key)
+    if existing is not None:
+        return existing
+    db.session.add(IdempotencyKey(key=key, user_id=user_id, action=action, order_id=order_id))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # 另一个携带相同键的请求先提交了
+        db.session.rollback()
+        return db.session.get(IdempotencyKey, key)
+    return None
+
+
+def _credit(user_id, amount):
+    score = User.credit_score + amount
+    db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(credit_score=db.case((score > CREDIT_MAX, CREDIT_MAX), else_=score))
+    )
+
+
+def _release_product(product_id):
+    result = db.session.execute(
+        db.update(Product).where(Product.id == product_id, Product.status == 'reserved')
+        .values(status='available')
+    )
+    if result.rowcount == 1:
+        bump_facet(product_id, 1)
+
+
+def _apply_side_effects(order, target, now):
+    if target in ('cancelled', 'refunded'):
+        _release_product(order.product_id)
+    elif target == 'completed':
+        db.session.execute(
+            db.update(Product).where(Product.id == order.product_id)
+            .values(status='sold', sold_at=now)
+        )
+        _credit(order.seller_id, CREDIT_REWARD['seller'])
+        _credit(order.buyer_id, CREDIT_REWARD['buyer'])
+        user_stats.bump(order.seller_id, sold_count=1)
+    for hook in _hooks.get(target, ()):
+        hook(order, now)
+
+
+def _log(order, target, user_id, now):
+    action, label = ACTIONS[target]
+    if user_id is None and target == 'cancelled':
+        action, label = 'expire_order', '订单超时自动取消'
+    # 与状态转换在同一事务中提交：转换回滚时不会留下日志
+    audit.log_in_transaction(action, user_id=user_id if user_id is not None else order.buyer_id,
+                             table_name='orders', record_id=order.id,
+                             description=f'{label}：{order.order_no}', created_at=now)
+
+
+def transition(order, target, user_id=None, idempotency_key=None, commit=True):
+    """把订单转换到 target 状态并提交，user_id 为 None 表示系统操作
+    返回 True 表示已执行；携带的幂等键已处理过时返回 False；非法转换抛出 OrderStateError"""
+    if idempotency_key:
+        claimed = claim_idempotency_key(idempotency_key, user_id, ACTIONS[target][0], order.id)
+        if claimed is not None:
+            if claimed.order_id != order.id or claimed.action != ACTIONS[target][0]:
+                raise OrderStateError('重复的请求标识，请刷新页面后重试')
+            return False
+
+    source = order.status
+    role = role_of(order, user_id)
+    if role not in TRANSITIONS.get(source, {}).get(target, ()):
+        db.session.rollback()
+        raise OrderStateError(f'订单当前为“{STATUS_LABELS.get(source, source)}”，无法{ACTIONS[target][1]}')
+    failure = _guard_failure(order, source, target)
+    if failure is not None:
+        db.session.rollback()
+        raise OrderStateError(failure)
+
+    now = datetime.now()
+    values = {'status': target}
+    if target in TIMESTAMPS:
+        values[TIMESTAMPS[target]] = now
+    # 条件更新：并发的两次转换只有一次能匹配到原状态
+    result = db.session.execute(
+        db.update(Order).where(Order.id == order.id, Order.status == source).values(**values)
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        raise OrderStateError('订单状态已变化，请刷新页面后重试')
+
+    _apply_side_effects(order, target, now)
+    _log(order, target, user_id, now)
+    if commit:
+        db.session.commit()
+    return True
@@ -0,0 +1,127 @@
+"""
+游标（keyset）分页
+按 (排序列, id) 翻页（默认 created_at 倒序，首页也可按价格、热度排序），用 WHERE 条件代替 OFFSET，
+深翻页不再线性变慢，也不需要每次请求都执行 COUNT(*)；总数可选地从短期缓存中读取
+"""
+import base64
+import json
+from datetime import datetime
+
+from models import db
+from cache import cache
+
+
+def encode_cursor(direction, value, item_id):
+    """生成不透明的翻页令牌；排序值为时间时保存为 ISO 字符串，数值原样保存"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([direction, value, item_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析翻页令牌，无效时返回 (None, None, None)，即回到第一页"""
+    if not cursor:
+        return None, None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, value, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError(value)
+        return direction, value, int(item_id)
+    except (ValueError, TypeError):
+        return None, None, None
+
+
+class KeysetPagination:
+    """游标分页结果，接口与 Flask-SQLAlchemy 的 Pagination 保持相近"""
+
+    is_keyset = True
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, sort_col, id_col, cursor=None, per_page=12, total=None, descending=True):
+    """按 (sort_col, id_col) 对查询做游标分页，descending 为 False 时按升序"""
+    direction, value, item_id = decode_cursor(cursor)
+    # 向前翻页时逆着排序方向读取，取出后再倒过来
+    read_desc = (direction != 'prev') == descending
+
+    if direction is not None:
+        # sort_col <= v 作为范围条件可以直接走 (…, sort_col) 索引
+        if read_desc:
+            query = query.filter(sort_col <= value, db.or_(sort_col < value, id_col < item_id))
+        else:
+            query = query.filter(sort_col >= value, db.or_(sort_col > value, id_col > item_id))
+
+    if read_desc:
+        query = query.order_by(sort_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(sort_col.asc(), id_col.asc())
+
+    items = query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'prev':
+        items.reverse()
+
+    has_next = more if direction != 'prev' else True
+    has_prev = more if direction == 'prev' else direction == 'next'
+
+    sort_key, id_key = sort_col.key, id_col.key
+    next_cursor = prev_cursor = None
+    if items and has_next:
+        last = items[-1]
+        next_cursor = encode_cursor('next', getattr(last, sort_key), getattr(last, id_key))
+    if items and has_prev:
+        first = items[0]
+        prev_cursor = encode_cursor('prev', getattr(first, sort_key), getattr(first, id_key))
+
+    return KeysetPagination(items, per_page, next_cursor, prev_cursor, total)
+
+
+# ==================== 总数缓存 ====================
+# 存放在两级缓存（cache.py）中：进程内 LRU 有条目上限，过期条目会被淘汰；key 的第一个元素为列表名，作为命名空间
+
+def cached_count(key, query, ttl):
+    """返回查询的总数，ttl 秒内复用上一次结果；ttl 为 0 时不统计"""
+    if not ttl:
+        return None
+    # 直接 SELECT count(*)，不包一层子查询，部分索引可以作为覆盖索引计数
+    return cache.get_or_set(f'count:{key[0]}', key[1:],
+                            lambda: query.order_by(None).with_entities(db.func.count()).scalar(), ttl)
+
+
+def invalidate_counts(name):
+    """清除某一列表的所有总数缓存"""
+    cache.invalidate(f'count:{name}')
+
+
+def paginate_listing(query, sort_col, id_col, page=None, cursor=None, per_page=12,
+                     count_key=None, count_ttl=0, total=None, descending=True):
+    """列表页分页：显式给出页码时沿用页码分页，否则使用游标分页
+    总数可以由调用方直接给出（total），或按 count_key 从短期缓存读取"""
+    if page:
+        order = (sort_col.desc(), id_col.desc()) if descending else (sort_col.asc(), id_col.asc())
+        return query.order_by(*order).paginate(page=page, per_page=per_page, error_out=False)
+    if count_key:
+        total = cached_count(count_key, query, count_ttl)
+    return keyset_paginate(query, sort_col, id_col, cursor=cursor,
+                           per_page=per_page, total=total, descending=descending)
@@ -0,0 +1,177 @@
+"""
+密码哈希服务
+- scrypt/pbkdf2 每次计算都是几十到上百毫秒的纯CPU运算，注册与登录时交给进程池执行，
+  请求线程只等待结果、不持有 GIL，登录高峰（如选课季）时其他路由照常响应
+- 同时进行（排队 + 计算中）的哈希不超过 PASSWORD_HASH_MAX_PENDING 个，满时立即抛出 PasswordHasherBusy（429），
+  不让请求堆积在队列里直到超时
+- PASSWORD_HASH_METHOD 为 werkzeug 格式的哈希方法与参数；存储的哈希参数与之不同（旧数据或调整过参数）时，
+  登录成功后用刚验证过的明文按当前参数重新计算（见 needs_rehash()）
+- 进程池使用 spawn 方式按进程创建，不从已启动后台线程的 Web 进程 fork；PASSWORD_HASH_WORKERS 为 0 时在请求线程中计算
+- spawn 的子进程启动时会重新导入主模块（__main__）：python app.py 启动时每个子进程都会导入整个应用，
+  没有 if __name__ == '__main__': 保护的脚本则会在子进程中再执行一遍并使进程池损坏（BrokenProcessPool）；
+  进程池损坏后本进程改在请求线程中计算并记录警告，注册与登录不会因此失败
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(TooManyRequests):
+    """哈希计算已满或等待超时"""
+    description = '登录人数较多，请稍后重试'
+
+    def __init__(self):
+        super().__init__(retry_after=1)
+
+
+def normalize_method(method):
+    """补全 werkzeug 哈希方法的默认参数，与存储的哈希中 $ 之前的部分格式相同"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = args or (2 ** 15, 8, 1)
+        return f'scrypt:{int(n)}:{int(r)}:{int(p)}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{int(iterations)}'
+    raise ValueError(f'未知的密码哈希方法: {method}')
+
+
+# 在进程池子进程中执行
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """进程池中的密码哈希计算与并发上限"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._broken_pid = None
+        self._slots = threading.BoundedSemaphore(8)
+        self.app = None
+        self.method = 'scrypt:32768:8:1'
+        self.workers = 2
+        self.timeout = 10
+        self.hashed = 0
+        self.verified = 0
+        self.rejected = 0
+        self.rehashed = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.method = normalize_method(app.config['PASSWORD_HASH_METHOD'])
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+        app.extensions['password_hasher'] = self
+        atexit.register(self.shutdown)
+
+    def hash(self, password):
+        """按配置的参数计算密码哈希"""
+        result = self._run(_hash, password, self.method)
+        self.hashed += 1
+        return result
+
+    def verify(self, password_hash, password):
+        """验证密码；password_hash 为空（未设置密码）时返回 False，不占用进程池"""
+        if not password_hash or password is None:
+            return False
+        result = self._run(_verify, password_hash, password)
+        self.verified += 1
+        return result
+
+    def rehash(self, password):
+        """登录成功后按当前参数重新计算哈希；繁忙时返回 None，下次登录再升级"""
+        try:
+            result = self.hash(password)
+        except PasswordHasherBusy:
+            return None
+        self.rehashed += 1
+        return result
+
+    def needs_rehash(self, password_hash):
+        """存储的哈希方法或参数与当前配置不同"""
+        method = (password_hash or '').split('$', 1)[0]
+        try:
+            return normalize_method(method) != self.method
+        except ValueError:
+            return True
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        if self.workers <= 0 or self._broken_pid == os.getpid():
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            return self._fallback(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # 名额在计算真正结束时归还：等待超时的请求已经返回，但它的计算仍占着子进程
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.rejected += 1
+            raise PasswordHasherBusy() from None
+        except BrokenProcessPool:
+            return self._fallback(func, *args)
+
+    def _fallback(self, func, *args):
+        """进程池损坏（多为子进程导入 __main__ 失败）后，本进程改在请求线程中计算"""
+        with self._lock:
+            if self._broken_pid != os.getpid():
+                self._broken_pid = os.getpid()
+                if self.app is not None:
+                    self.app.logger.warning('密码哈希进程池不可用，改在请求线程中计算；'
+                                            '入口脚本需要 if __name__ == \'__main__\': 保护', exc_info=True)
+        self.shutdown(wait=False)
+        return self._run(func, *args)
+
+    def _get_executor(self):
+        # 按进程创建：预派生的 worker 进程不能复用父进程的进程池
+        # spawn 子进程会重新导入 __main__，导入失败时进程池损坏，由 _fallback() 改在请求线程中计算
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def shutdown(self, wait=True):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+            self._executor_pid = None
+
+    def stats(self):
+        return {'workers': self.workers, 'in_thread': self._broken_pid == os.getpid(),
+                'hashed': self.hashed, 'verified': self.verified,
+                'rejected': self.rejected, 'rehashed': self.rehashed}
+
+
+password_hasher = PasswordHasher()
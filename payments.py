@@ -0,0 +1,177 @@
+"""
+余额支付与资金流水
+- 金额一律以整数"分"计算：users.balance_cents 为余额，订单价格（元）在支付时用 Decimal 换算成分
+- ledger_entries 只追加不修改：每次余额变动写一条流水并记录变动后的余额快照，
+  每个用户的流水金额之和应等于当前余额（reconcile_ledger() 对账）
+- pay()：订单 pending → paid、扣减买家余额、写流水在同一事务内完成；扣款是条件 UPDATE
+      UPDATE users SET balance_cents = balance_cents - :amount WHERE id = ? AND balance_cents >= :amount
+  余额不足或订单状态已变化时整个事务回滚，不会出现扣了款但订单未支付或重复扣款
+- 货款在交易完成前由平台托管：settle_completed_orders() 把已完成订单的货款按卖家汇总后批量入账，
+  由超时订单清理线程定期执行；退款 (refunded) 时在订单状态机的事务内把货款退回买家
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from flask import current_app
+
+from models import db, User, Order, LedgerEntry
+from identity import identity_cache
+import order_state
+from reservations import order_sweeper, with_busy_retry
+
+
+class PaymentError(Exception):
+    """支付失败（余额不足等），message 可直接展示给用户"""
+
+
+def to_cents(amount):
+    """元 -> 分，按四舍五入取整；浮点价格先转成字符串避免二进制误差"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def _adjust_balance(user_id, delta, require_funds=False):
+    """在当前事务中调整余额，返回变动后的余额；require_funds 且余额不足时返回 None"""
+    identity_cache.changed(user_id)
+    stmt = db.update(User).where(User.id == user_id)
+    if require_funds:
+        stmt = stmt.where(User.balance_cents >= -delta)
+    stmt = stmt.values(balance_cents=User.balance_cents + delta)
+    if db.engine.dialect.update_returning:
+        return db.session.execute(stmt.returning(User.balance_cents)).scalar_one_or_none()
+    if db.session.execute(stmt).rowcount != 1:
+        return None
+    return db.session.execute(db.select(User.balance_cents).where(User.id == user_id)).scalar_one()
+
+
+def _record(user_id, entry_type, amount, balance, order_id=None):
+    db.session.add(LedgerEntry(user_id=user_id, order_id=order_id, entry_type=entry_type,
+                               amount_cents=amount, balance_after_cents=balance))
+
+
+def deposit(user_id, amount, commit=True):
+    """给用户充值 amount 分，返回充值后的余额"""
+    if amount <= 0:
+        raise PaymentError('充值金额必须大于0')
+    balance = _adjust_balance(user_id, amount)
+    _record(user_id, 'deposit', amount, balance)
+    if commit:
+        db.session.commit()
+    return balance
+
+
+def pay(order, user_id, idempotency_key=None):
+    """买家用余额支付待支付订单并提交
+    返回 True 表示已支付；携带的幂等键已处理过时返回 False；
+    余额不足抛出 PaymentError，订单状态不允许支付时抛出 OrderStateError"""
+    if user_id != order.buyer_id:
+        raise PaymentError('只有买家可以支付该订单')
+
+    if idempotency_key:
+        claimed = order_state.claim_idempotency_key(idempotency_key, user_id, 'pay_order', order.id)
+        if claimed is not None:
+            if claimed.order_id != order.id or claimed.action != 'pay_order':
+                raise order_state.OrderStateError('重复的请求标识，请刷新页面后重试')
+            return False
+
+    amount = to_cents(order.price)
+    # 先做订单的条件状态转换：同一订单的并发支付只有一个能继续往下扣款
+    order_state.transition(order, 'paid', commit=False)
+    balance = _adjust_balance(order.buyer_id, -amount, require_funds=True)
+    if balance is None:
+        db.session.rollback()
+        raise PaymentError(f'账户余额不足，需支付 ¥{amount / 100:.2f}')
+    db.session.execute(
+        db.update(Order).where(Order.id == order.id).values(payment_method='balance')
+    )
+    _record(order.buyer_id, 'payment', -amount, balance, order.id)
+    db.session.commit()
+    return True
+
+
+@order_state.on_transition('refunded')
+def _refund(order, now):
+    """退款完成时在状态机事务内把托管的货款退回买家"""
+    if order.payment_method != 'balance' or order.settled_at is not None:
+        return
+    amount = to_cents(order.price)
+    balance = _adjust_balance(order.buyer_id, amount)
+    _record(order.buyer_id, 'refund', amount, balance, order.id)
+
+
+def settle_completed_orders(limit=500, now=None):
+    """把已完成且尚未结算的余额支付订单批量结算给卖家并提交，返回结算的订单数"""
+    now = now or datetime.now()
+    rows = db.session.execute(
+        db.select(Order.id, Order.seller_id, Order.price)
+        # 状态以常量内联，才能匹配部分索引 idx_orders_unsettled
+        .where(Order.status == db.literal('completed', literal_execute=True), Order.settled_at.is_(None),
+               Order.payment_method == 'balance')
+        .order_by(Order.id).limit(limit)
+    ).all()
+    if not rows:
+        return 0
+
+    order_ids = [row.id for row in rows]
+    # 先标记已结算：与另一个进程的结算并发时只有一方能标记全部订单，另一方回滚
+    result = db.session.execute(
+        db.update(Order).where(Order.id.in_(order_ids), Order.settled_at.is_(None))
+        .values(settled_at=now).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(order_ids):
+        db.session.rollback()
+        return 0
+
+    by_seller = defaultdict(list)
+    for row in rows:
+        by_seller[row.seller_id].append((row.id, to_cents(row.price)))
+
+    entries = []
+    for seller_id, items in by_seller.items():
+        total = sum(amount for _, amount in items)
+        # 每个卖家一次余额更新，流水仍按订单逐条记录，快照从入账前余额依次累加
+        running = _adjust_balance(seller_id, total) - total
+        for order_id, amount in items:
+            running += amount
+            entries.append({'user_id': seller_id, 'order_id': order_id, 'entry_type': 'settlement',
+                            'amount_cents': amount, 'balance_after_cents': running, 'created_at': now})
+    db.session.execute(db.insert(LedgerEntry), entries)
+    db.session.commit()
+    return len(rows)
+
+
+def settle_all(batch_size=500, attempts=5, backoff=0.05):
+    """分批结算直到没有待结算订单，返回结算的订单总数"""
+    settled = 0
+    while True:
+        count = with_busy_retry(lambda: settle_completed_orders(batch_size), attempts, backoff)
+        if not count:
+            return settled
+        settled += count
+
+
+@order_sweeper.on_sweep
+def _settle_periodically():
+    config = current_app.config
+    settle_all(config['PAYMENT_SETTLE_BATCH'], config['ORDER_BUSY_RETRIES'], config['ORDER_BUSY_BACKOFF'])
+
+
+def reconcile_ledger():
+    """核对流水与余额，返回 [(user_id, 余额, 流水合计, 最后一条快照)] 中不一致的用户"""
+    totals = dict(db.session.execute(
+        db.select(LedgerEntry.user_id, db.func.sum(LedgerEntry.amount_cents))
+        .group_by(LedgerEntry.user_id)
+    ).all())
+    last_ids = db.select(db.func.max(LedgerEntry.id)).group_by(LedgerEntry.user_id)
+    snapshots = dict(db.session.execute(
+        db.select(LedgerEntry.user_id, LedgerEntry.balance_after_cents)
+        .where(LedgerEntry.id.in_(last_ids))
+    ).all())
+
+    drift = []
+    for user_id, balance in db.session.execute(db.select(User.id, User.balance_cents)):
+        total = totals.get(user_id, 0)
+        snapshot = snapshots.get(user_id, 0)
+        if balance != total or balance != snapshot:
+            drift.append((user_id, balance, total, snapshot))
+    return drift
@@ -0,0 +1,276 @@
+"""
+请求级SQL性能剖析与监控指标
+- 按 PROFILE_SAMPLE_RATE 抽样请求：被抽中的请求通过 SQLAlchemy 游标事件统计SQL语句数、数据库总耗时与最慢语句，
+  请求结束时按端点（endpoint）汇总到直方图
+- 抽样请求中超过 PROFILE_SLOW_QUERY_MS 的语句记录警告日志，SQLite 下附带 EXPLAIN QUERY PLAN 输出
+- /metrics 以 Prometheus 文本格式输出上述直方图，以及缓存命中、审计日志队列、密码哈希、用户快照、数据库忙重试等计数
+- 抽样率为 0 时不注册任何请求钩子和游标事件，没有额外开销；每个进程只统计自己处理的请求
+"""
+import hmac
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from flask import request
+from sqlalchemy import event
+
+from models import db
+from cache import cache
+from audit import audit
+from passwords import password_hasher
+from identity import identity_cache
+import reservations
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+PLAN_CACHE_SIZE = 256
+
+
+class Histogram:
+    """Prometheus 风格的累积直方图（调用方负责加锁）"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {self.sum:g}')
+        lines.append(f'{name}_count{_labels(labels)} {self.count}')
+        return lines
+
+
+class EndpointStats:
+    def __init__(self):
+        self.duration = Histogram(REQUEST_BUCKETS)
+        self.db_time = Histogram(DB_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+
+class RequestProfile:
+    __slots__ = ('started', 'queries', 'db_time', 'slowest', 'slowest_statement')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _labels(labels, **extra):
+    items = {**labels, **extra}
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items.items()) + '}'
+
+
+class SQLProfiler:
+    """抽样请求的SQL统计、慢查询日志与 /metrics 指标"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.sample_rate = 0.0
+        self.slow_seconds = 0.1
+        self.explain = True
+        self.slow_queries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._plans = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        self.slow_seconds = app.config['PROFILE_SLOW_QUERY_MS'] / 1000
+        self.explain = app.config['PROFILE_EXPLAIN']
+        app.extensions['sql_profiler'] = self
+        if self.sample_rate <= 0:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._discard_request)
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # ==================== 采集 ====================
+
+    def _start_request(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            self._local.profile = RequestProfile()
+
+    def _finish_request(self, response):
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return response
+        self._local.profile = None
+        elapsed = time.perf_counter() - profile.started
+        endpoint = request.endpoint or 'not_found'
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.duration.observe(elapsed)
+            stats.db_time.observe(profile.db_time)
+            stats.queries.observe(profile.queries)
+            if profile.slowest > stats.slowest:
+                stats.slowest = profile.slowest
+                stats.slowest_statement = profile.slowest_statement
+        return response
+
+    def _discard_request(self, exc=None):
+        # 未处理的异常不会经过 after_request，这里清掉本线程的状态
+        self._local.profile = None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'profile', None) is not None:
+            context._profile_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = getattr(self._local, 'profile', None)
+        started = getattr(context, '_profile_started', None)
+        if profile is None or started is None:
+            return
+        elapsed = time.perf_counter() - started
+        profile.queries += 1
+        profile.db_time += elapsed
+        if elapsed > profile.slowest:
+            profile.slowest = elapsed
+            profile.slowest_statement = statement
+        if elapsed >= self.slow_seconds:
+            self._log_slow_query(conn, statement, parameters, executemany, elapsed)
+
+    def _log_slow_query(self, conn, statement, parameters, executemany, elapsed):
+        with self._lock:
+            self.slow_queries += 1
+        plan = ''
+        if self.explain and not executemany and conn.dialect.name == 'sqlite':
+            plan = self._query_plan(conn, statement, parameters)
+        self.app.logger.warning('慢查询 %.1fms [%s] %s%s', elapsed * 1000, request.endpoint,
+                                ' '.join(statement.split()), plan)
+
+    def _query_plan(self, conn, statement, parameters):
+        """同一连接上执行 EXPLAIN QUERY PLAN，按语句缓存；直接使用 DBAPI 游标，不会再次触发事件"""
+        plan = self._plans.get(statement)
+        if plan is not None:
+            return plan
+        try:
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                rows = cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters or ()).fetchall()
+            finally:
+                cursor.close()
+        except Exception as exc:
+            return f'\n  (无法获取查询计划: {exc})'
+        depth = {0: 0}
+        lines = []
+        for node_id, parent, _, detail in rows:
+            depth[node_id] = depth.get(parent, 0) + 1
+            lines.append('  ' * depth[node_id] + detail)
+        plan = '\n' + '\n'.join(lines)
+        with self._lock:
+            if len(self._plans) >= PLAN_CACHE_SIZE:
+                self._plans.clear()
+            self._plans[statement] = plan
+        return plan
+
+    # ==================== 输出 ====================
+
+    def render_metrics(self):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            family('campus_request_duration_seconds', 'histogram', '抽样请求的处理时间')
+            for endpoint, stats in endpoints:
+                lines += stats.duration.render('campus_request_duration_seconds', {'endpoint': endpoint})
+            family('campus_request_db_seconds', 'histogram', '抽样请求中SQL语句的总耗时')
+            for endpoint, stats in endpoints:
+                lines += stats.db_time.render('campus_request_db_seconds', {'endpoint': endpoint})
+            family('campus_request_queries', 'histogram', '抽样请求执行的SQL语句数')
+            for endpoint, stats in endpoints:
+                lines += stats.queries.render('campus_request_queries', {'endpoint': endpoint})
+            family('campus_request_slowest_query_seconds', 'gauge', '端点最慢的一条SQL语句耗时')
+            for endpoint, stats in endpoints:
+                labels = {'endpoint': endpoint, 'statement': ' '.join((stats.slowest_statement or '').split())[:200]}
+                lines.append(f'campus_request_slowest_query_seconds{_labels(labels)} {stats.slowest:g}')
+            family('campus_slow_queries_total', 'counter', '超过慢查询阈值的语句数')
+            lines.append(f'campus_slow_queries_total {self.slow_queries}')
+        family('campus_profile_sample_rate', 'gauge', '请求抽样率')
+        lines.append(f'campus_profile_sample_rate {self.sample_rate:g}')
+
+        cache_stats = cache.stats()
+        family('campus_cache_lookups_total', 'counter', '缓存查询次数')
+        for namespace, counters in sorted(cache_stats['namespaces'].items()):
+            for result in ('local_hits', 'shared_hits', 'misses'):
+                labels = {'namespace': namespace, 'result': result}
+                lines.append(f'campus_cache_lookups_total{_labels(labels)} {counters[result]}')
+        family('campus_cache_invalidations_total', 'counter', '缓存命名空间失效次数')
+        for namespace, counters in sorted(cache_stats['namespaces'].items()):
+            lines.append(f'campus_cache_invalidations_total{_labels({"namespace": namespace})} '
+                         f'{counters["invalidations"]}')
+        family('campus_cache_local_entries', 'gauge', '进程内缓存条目数')
+        lines.append(f'campus_cache_local_entries {cache_stats["local_entries"]}')
+
+        audit_stats = audit.stats()
+        family('campus_audit_entries_total', 'counter', '审计日志条数')
+        for state in ('enqueued', 'written', 'dropped', 'failed', 'in_transaction'):
+            lines.append(f'campus_audit_entries_total{_labels({"state": state})} {audit_stats[state]}')
+        family('campus_audit_queue_size', 'gauge', '等待写入的审计日志条数')
+        lines.append(f'campus_audit_queue_size {audit_stats["queued"]}')
+
+        hasher_stats = password_hasher.stats()
+        family('campus_password_hashes_total', 'counter', '密码哈希计算次数')
+        for kind in ('hashed', 'verified', 'rehashed', 'rejected'):
+            lines.append(f'campus_password_hashes_total{_labels({"result": kind})} {hasher_stats[kind]}')
+
+        identity_stats = identity_cache.stats()
+        family('campus_identity_lookups_total', 'counter', '登录用户快照查询次数')
+        for result in ('hits', 'misses'):
+            lines.append(f'campus_identity_lookups_total{_labels({"result": result})} {identity_stats[result]}')
+
+        family('campus_db_busy_retries_total', 'counter', '数据库忙（database is locked）重试次数')
+        lines.append(f'campus_db_busy_retries_total {reservations.busy_retries}')
+        return '\n'.join(lines) + '\n'
+
+    def authorized(self):
+        """配置了 METRICS_TOKEN 时要求 Authorization: Bearer <token>；
+        未配置时生产环境拒绝访问，开发环境只允许未经反向代理转发（没有 X-Forwarded-For）的本机请求"""
+        token = self.app.config['METRICS_TOKEN']
+        if not token:
+            if not self.app.config['METRICS_ALLOW_LOOPBACK'] or 'X-Forwarded-For' in request.headers:
+                return False
+            return request.remote_addr in ('127.0.0.1', '::1')
+        supplied = request.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())
+
+
+profiler = SQLProfiler()
@@ -0,0 +1,51 @@
+"""
+页面查询构造器
+每个页面用到的关联对象在这里通过 joinedload 一次性加载，
+避免模板逐条访问 order.product / favorite.product 等关系时产生 N+1 查询
+"""
+from sqlalchemy.orm import joinedload
+
+from models import Product, Order, Favorite
+
+
+def product_detail_query():
+    """商品详情：分类、卖家"""
+    return Product.query.options(
+        joinedload(Product.category),
+        joinedload(Product.seller),
+    )
+
+
+def order_list_query():
+    """订单列表：商品、买家、卖家"""
+    return Order.query.options(
+        joinedload(Order.product),
+        joinedload(Order.buyer),
+        joinedload(Order.seller),
+    )
+
+
+def order_detail_query():
+    """订单详情：与订单列表相同的关联"""
+    return order_list_query()
+
+
+def favorite_list_query(user_id):
+    """收藏列表：收藏对应的商品"""
+    return Favorite.query.filter_by(user_id=user_id).options(
+        joinedload(Favorite.product),
+    )
+
+
+def recent_products(seller_id, limit=5):
+    """个人中心：最近发布的商品"""
+    return Product.query.filter_by(seller_id=seller_id, is_deleted=False).order_by(
+        Product.created_at.desc()
+    ).limit(limit).all()
+
+
+def recent_orders(buyer_id, limit=5):
+    """个人中心：最近的购买订单（含商品）"""
+    return Order.query.filter_by(buyer_id=buyer_id).options(
+        joinedload(Order.product),
+    ).order_by(Order.created_at.desc()).limit(limit).all()
@@ -0,0 +1,57 @@
+"""
+SQL语句计数工具
+用于测试与排查N+1查询：统计一段代码（通常是一次请求）执行的SQL语句数，
+超过预算时抛出 AssertionError 并列出所有语句
+"""
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryCounter:
+    """在 with 块内记录引擎执行的所有SQL语句
+    current_thread=True 时只记录进入 with 块的线程执行的语句（排除浏览量写回、审计等后台线程）"""
+
+    def __init__(self, engine=None, current_thread=False):
+        self.engine = engine
+        self.statements = []
+        self.thread_id = threading.get_ident() if current_thread else None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.thread_id is None or self.thread_id == threading.get_ident():
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self.engine = self.engine or db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return False
+
+
+@contextmanager
+def assert_max_queries(budget, engine=None, label=''):
+    """with 块内执行的SQL语句数不得超过 budget"""
+    with QueryCounter(engine) as counter:
+        yield counter
+    if counter.count > budget:
+        detail = '\n'.join(f'  {i + 1}. {s.strip()}' for i, s in enumerate(counter.statements))
+        raise AssertionError(f'{label or "请求"} 执行了 {counter.count} 条SQL，预算为 {budget}：\n{detail}')
+
+
+def check_request_budget(client, url, budget, method='get', **kwargs):
+    """用测试客户端请求 url，并检查SQL语句数不超过预算，返回响应"""
+    with client.application.app_context():
+        engine = db.engine
+    with assert_max_queries(budget, engine=engine, label=f'{method.upper()} {url}'):
+        response = getattr(client, method)(url, **kwargs)
+    return response
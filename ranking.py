@@ -0,0 +1,169 @@
+"""
+商品热度排行
+products.hot_score 为物化的热度分，采用"前向衰减"：发生在时刻 t 的一次行为贡献
+    权重 × 2^((t - 衰减起点) / 半衰期)
+由于所有商品在同一时刻读取时共享同一个衰减因子，按存储值排序就等价于按衰减后的热度排序，
+因此浏览、收藏发生时只需在原值上做一次加法，不需要定时全表重算；长时间没有新行为的商品会被新行为逐渐超过
+热门列表通过 (status, hot_score) 索引只读取前 N 行，并放入两级缓存
+
+衰减起点保存在 ranking_state 表中。距起点超过 REBASE_HALF_LIVES 个半衰期时，浏览量写回线程把起点平移到当前时刻，
+所有热度分同乘 2^(-平移量/半衰期)，排序不变，放大倍数始终远小于浮点上限。各进程缓存起点，
+累加热度的 SQL 只在数据库中的起点与计算时使用的起点一致时生效：平移后用旧起点算出的增量按 0 计入，不会放大
+"""
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+
+from models import db, Product, RankingState
+from cache import cache
+
+# ranking_state 中还没有记录时的衰减起点（早期版本固定使用这一时刻，已有的热度分按它计算）
+LEGACY_EPOCH = datetime(2025, 1, 1)
+# 距起点超过这么多个半衰期时平移起点（放大倍数 2^128 ≈ 3.4e38，离浮点上限 2^1024 很远）
+REBASE_HALF_LIVES = 128
+# 起点长时间没有平移（例如没有浏览、写回线程未运行）时的指数上限，宁可热度失真也不抛出 OverflowError
+MAX_EXPONENT = 1000
+
+# 数据库中的起点与 :epoch 一致时为 1，否则为 0
+EPOCH_GUARD = ('(CASE WHEN COALESCE((SELECT hot_epoch FROM ranking_state WHERE id = 1), :legacy_epoch) = :epoch '
+               'THEN 1 ELSE 0 END)')
+
+# 用 CASE 钳制到 0，不用只有 SQLite 支持的双参数标量 MAX()
+_BUMPED_SCORE = f'(COALESCE(hot_score, 0) + :score * {EPOCH_GUARD})'
+
+BUMP_SQL = db.text(
+    f'UPDATE products SET hot_score = CASE WHEN {_BUMPED_SCORE} < 0 THEN 0 ELSE {_BUMPED_SCORE} END WHERE id = :id'
+).bindparams(db.bindparam('epoch', type_=db.DateTime), db.bindparam('legacy_epoch', type_=db.DateTime))
+
+
+def _load_epoch(connection):
+    epoch = connection.execute(
+        db.select(RankingState.hot_epoch).where(RankingState.id == 1)
+    ).scalar()
+    return epoch or LEGACY_EPOCH
+
+
+def hot_epoch():
+    """当前的衰减起点（进程内缓存，平移后按命名空间代数失效）"""
+    return cache.get_or_set('hot_epoch', 'current', lambda: _load_epoch(db.session),
+                            current_app.config['HOT_CACHE_TTL'])
+
+
+def epoch_params(epoch):
+    """EPOCH_GUARD 所需的参数"""
+    return {'epoch': epoch, 'legacy_epoch': LEGACY_EPOCH}
+
+
+def decay_factor(when=None, epoch=None):
+    """时刻 when 的一次行为相对衰减起点的放大倍数"""
+    half_life = current_app.config['HOT_HALF_LIFE_HOURS'] * 3600
+    seconds = ((when or datetime.now()) - (epoch or hot_epoch())).total_seconds()
+    return 2.0 ** min(seconds / half_life, MAX_EXPONENT)
+
+
+def score_delta(views=0, favorites=0, listings=0, when=None, epoch=None):
+    """一组行为对热度分的贡献"""
+    weights = current_app.config['HOT_WEIGHTS']
+    raw = (views * weights['view'] + favorites * weights['favorite']
+           + listings * weights['listing'])
+    return raw * decay_factor(when, epoch)
+
+
+@event.listens_for(Product, 'before_insert')
+def _initial_score(mapper, connection, target):
+    """新商品以发布时间获得基础热度，没有任何浏览时也能按新旧排序（起点在本事务中读取，不使用缓存）"""
+    if not target.hot_score:
+        target.hot_score = score_delta(listings=1, when=target.created_at, epoch=_load_epoch(connection))
+
+
+def bump(product_id, views=0, favorites=0, when=None):
+    """在当前会话事务中累加热度（行为发生在 when，默认当前时刻）；取消收藏时传入负数与收藏时刻，
+    扣除的正好是收藏时加上的分值；由调用方提交"""
+    epoch = hot_epoch()
+    score = score_delta(views=views, favorites=favorites, when=when, epoch=epoch)
+    if score:
+        db.session.execute(BUMP_SQL, {'id': product_id, 'score': score, **epoch_params(epoch)})
+
+
+def trending(category_id=None, limit=8):
+    """热门商品（普通字典列表），按热度分走索引读取前 limit 行并缓存"""
+    def load():
+        query = (db.select(Product.id, Product.title, Product.price, Product.cover_image,
+                           Product.view_count, Product.favorite_count)
+                 .where(Product.listed())
+                 .order_by(Product.hot_score.desc())
+                 .limit(limit))
+        if category_id:
+            query = query.where(Product.category_id == category_id)
+        return [dict(row._mapping) for row in db.session.execute(query)]
+    return cache.get_or_set('trending', (category_id, limit), load,
+                            current_app.config['HOT_CACHE_TTL'])
+
+
+def invalidate_trending():
+    cache.invalidate('trending')
+
+
+def _set_epoch(connection, epoch, expected=None):
+    """把起点改为 epoch；给出 expected 时只在当前起点等于它时修改，返回是否修改"""
+    if connection.execute(db.select(RankingState.id).where(RankingState.id == 1)).first() is None:
+        if expected not in (None, LEGACY_EPOCH):
+            return False
+        connection.execute(db.insert(RankingState).values(id=1, hot_epoch=epoch))
+        return True
+    update = db.update(RankingState).where(RankingState.id == 1).values(hot_epoch=epoch)
+    if expected is not None:
+        update = update.where(RankingState.hot_epoch == expected)
+    return connection.execute(update).rowcount == 1
+
+
+def maybe_rebase(now=None):
+    """距起点超过 REBASE_HALF_LIVES 个半衰期时把起点平移到 now，所有热度分按比例缩小；返回是否平移
+    在独立事务中执行（浏览量写回线程调用），多个进程同时发现时只有一个能修改成功"""
+    now = (now or datetime.now()).replace(microsecond=0)
+    half_life = current_app.config['HOT_HALF_LIFE_HOURS'] * 3600
+    epoch = hot_epoch()
+    shift = (now - epoch).total_seconds() / half_life
+    if shift < REBASE_HALF_LIVES:
+        return False
+    with db.engine.begin() as connection:
+        if not _set_epoch(connection, now, expected=epoch):
+            rebased = False
+        else:
+            connection.execute(db.update(Product).values(hot_score=Product.hot_score * 2.0 ** -shift))
+            rebased = True
+    cache.invalidate('hot_epoch')
+    if rebased:
+        invalidate_trending()
+        current_app.logger.info('热度分衰减起点平移到 %s（%.0f 个半衰期）', now, shift)
+    return rebased
+
+
+def rebuild_hot_scores(batch_size=1000):
+    """把衰减起点设为当前时刻，按现有计数重算所有商品的热度分（迁移或修改权重、半衰期后使用）
+    历史浏览与收藏的发生时间无从得知，按发布时间计入"""
+    epoch = datetime.now().replace(microsecond=0)
+    _set_epoch(db.session.connection(), epoch)
+    db.session.commit()
+    cache.invalidate('hot_epoch')
+
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Product.id, Product.created_at, Product.view_count, Product.favorite_count)
+            .where(Product.id > last_id).order_by(Product.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        params = [{'id': row.id,
+                   'score': score_delta(views=row.view_count or 0, favorites=row.favorite_count or 0,
+                                        listings=1, when=row.created_at, epoch=epoch)}
+                  for row in rows]
+        db.session.execute(db.text('UPDATE products SET hot_score = :score WHERE id = :id'), params)
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+    invalidate_trending()
+    return updated
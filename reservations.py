@@ -0,0 +1,155 @@
+"""
+商品预订与超时订单清理
+- reserve()：检查与修改在同一条条件 UPDATE 中完成
+      UPDATE products SET status='reserved' WHERE id=? AND status='available'
+  多个买家同时下单时只有一个能更新成功，不会出现同一商品的两个订单
+- with_busy_retry()：SQLite 返回 database is locked 时回滚并按指数退避重试整个事务
+- OrderSweeper：后台线程定期通过订单状态机取消超过支付时限的待处理订单（同时释放商品），并清理过期的幂等键；
+  其他模块可用 on_sweep 挂载需要定期执行的任务（如货款结算）
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, Order, IdempotencyKey
+from browse import bump_facet
+from order_state import transition, OrderStateError
+
+RESERVE_SQL = ("UPDATE products SET status = 'reserved' "
+               "WHERE id = :id AND status = 'available' AND is_deleted = 0")
+
+_stats_lock = threading.Lock()
+busy_retries = 0
+
+
+def is_busy_error(exc):
+    message = str(getattr(exc, 'orig', exc)).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def with_busy_retry(func, attempts=5, backoff=0.05):
+    """执行 func()（应包含提交），遇到 SQLite 忙错误时回滚后退避重试"""
+    global busy_retries
+    for attempt in range(attempts):
+        try:
+            return func()
+        except OperationalError as exc:
+            db.session.rollback()
+            if not is_busy_error(exc) or attempt == attempts - 1:
+                raise
+            with _stats_lock:
+                busy_retries += 1
+            # 指数退避加随机抖动，避免重试的请求再次同时撞上
+            time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+
+
+def reserve(product_id):
+    """在当前事务中把商品从 available 改为 reserved，返回是否抢到"""
+    result = db.session.execute(db.text(RESERVE_SQL), {'id': product_id})
+    if result.rowcount != 1:
+        return False
+    bump_facet(product_id, -1)
+    return True
+
+
+def expire_pending_orders(timeout, now=None, limit=200):
+    """取消创建时间早于 now - timeout 的待处理订单，返回被取消的订单列表"""
+    now = now or datetime.now()
+    order_ids = db.session.execute(
+        db.select(Order.id)
+        .where(Order.status == 'pending', Order.created_at < now - timeout)
+        .order_by(Order.created_at).limit(limit)
+    ).scalars().all()
+
+    expired = []
+    for order_id in order_ids:
+        order = db.session.get(Order, order_id)
+        try:
+            # 每个订单单独提交；与买家取消、卖家确认并发时只有一方生效
+            transition(order, 'cancelled')
+        except OrderStateError:
+            continue
+        expired.append(order)
+    return expired
+
+
+def purge_idempotency_keys(max_age):
+    """删除早于 max_age 的幂等键，返回删除的行数"""
+    result = db.session.execute(
+        db.delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.now() - max_age)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+class OrderSweeper:
+    """按进程运行的超时订单清理线程，在第一次请求时启动"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        self.app = None
+        self.listeners = []
+        self.jobs = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['order_sweeper'] = self
+        app.before_request(self._ensure_worker)
+
+    def on_expired(self, func):
+        """注册订单超时取消后的回调 func(expired_orders)，用于刷新缓存、记录日志等"""
+        self.listeners.append(func)
+        return func
+
+    def on_sweep(self, func):
+        """注册每次清理时（在应用上下文中）执行的定期任务 func()"""
+        self.jobs.append(func)
+        return func
+
+    def sweep(self):
+        """执行一次清理与定期任务，返回取消的订单数"""
+        minutes = self.app.config['ORDER_PENDING_TIMEOUT_MINUTES']
+        with self.app.app_context():
+            expired = []
+            if minutes > 0:
+                expired = with_busy_retry(lambda: expire_pending_orders(timedelta(minutes=minutes)),
+                                          self.app.config['ORDER_BUSY_RETRIES'],
+                                          self.app.config['ORDER_BUSY_BACKOFF'])
+            if expired:
+                for listener in self.listeners:
+                    listener(expired)
+            purge_idempotency_keys(timedelta(hours=self.app.config['IDEMPOTENCY_KEY_TTL_HOURS']))
+            for job in self.jobs:
+                try:
+                    job()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('定期任务 %s 执行失败', job.__name__)
+        return len(expired)
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='order-sweeper', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['ORDER_SWEEP_INTERVAL'])
+            try:
+                self.sweep()
+            except Exception:
+                self.app.logger.exception('超时订单清理失败')
+
+
+order_sweeper = OrderSweeper()
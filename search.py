@@ -0,0 +1,212 @@
+"""
+商品全文检索
+基于SQLite FTS5虚拟表，替代 LIKE '%关键词%' 的全表扫描
+中文按字切分为二元组（bigram）后写入索引，查询时按BM25排序
+非SQLite数据库或不支持FTS5时自动回退为LIKE查询
+"""
+import re
+import time
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import OperationalError
+from models import db, Product
+
+FTS_TABLE = 'products_fts'
+
+# BM25权重：标题命中比描述命中更重要
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# 中日韩统一表意文字及常用扩展区
+_CJK_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+# 每个数据库引擎的索引可用状态缓存 {engine.url: True | 上次确认索引不存在的时间}
+# 只长期缓存"可用"；索引可能由 init_db 或重建脚本在应用运行期间创建，"不可用"的结论查询时最多缓存
+# INDEX_RECHECK_INTERVAL 秒，写入商品时（已有连接，查 sqlite_master 的开销很小）每次重新检查
+_index_ready = {}
+INDEX_RECHECK_INTERVAL = 30
+
+
+def _cjk_tokens(run):
+    """将一段连续的中文切分为二元组，末字单独成词以支持单字前缀查询"""
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def segment(text):
+    """将文本转换为FTS索引使用的分词串"""
+    if not text:
+        return ''
+    tokens = []
+    pos = 0
+    for match in _CJK_RUN.finditer(text):
+        tokens.extend(_WORD.findall(text[pos:match.start()].lower()))
+        tokens.extend(_cjk_tokens(match.group()))
+        pos = match.end()
+    tokens.extend(_WORD.findall(text[pos:].lower()))
+    return ' '.join(tokens)
+
+
+def build_match_query(keyword):
+    """将用户输入的关键词转换为FTS5 MATCH表达式，无有效词时返回None"""
+    clauses = []
+    for term in keyword.split():
+        pos = 0
+        for match in _CJK_RUN.finditer(term):
+            clauses.extend(f'"{w}"*' for w in _WORD.findall(term[pos:match.start()].lower()))
+            run = match.group()
+            if len(run) == 1:
+                clauses.append(f'"{run}"*')
+            else:
+                # 相邻二元组组成短语，等价于原文中的连续子串
+                clauses.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+            pos = match.end()
+        clauses.extend(f'"{w}"*' for w in _WORD.findall(term[pos:].lower()))
+    return ' AND '.join(clauses) if clauses else None
+
+
+# ==================== 索引维护 ====================
+
+def _table_exists(connection):
+    return connection.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': FTS_TABLE}).first() is not None
+
+
+def search_index_ready(connection=None):
+    """当前数据库是否可以使用FTS索引"""
+    engine = connection.engine if connection is not None else db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    key = str(engine.url)
+    state = _index_ready.get(key)
+    if state is True:
+        return True
+    if connection is None and state is not None and time.monotonic() - state < INDEX_RECHECK_INTERVAL:
+        return False
+    if connection is not None:
+        ready = _table_exists(connection)
+    else:
+        with engine.connect() as conn:
+            ready = _table_exists(conn)
+    _index_ready[key] = True if ready else time.monotonic()
+    return ready
+
+
+def create_search_index():
+    """创建FTS5虚拟表，返回是否创建成功"""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        db.session.execute(db.text(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+            USING fts5(title, description, tokenize = 'unicode61')
+        """))
+        db.session.commit()
+    except OperationalError:
+        # SQLite未编译FTS5模块
+        db.session.rollback()
+        return False
+    _index_ready[str(db.engine.url)] = True
+    return True
+
+
+def drop_search_index():
+    """删除FTS5虚拟表"""
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+        db.session.commit()
+    _index_ready.pop(str(db.engine.url), None)
+
+
+def rebuild_search_index(batch_size=1000):
+    """重建全文索引并回填所有商品，返回写入的商品数"""
+    drop_search_index()
+    if not create_search_index():
+        return 0
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Product.id, Product.title, Product.description)
+            .where(Product.id > last_id)
+            .order_by(Product.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        db.session.execute(
+            db.text(f'INSERT INTO {FTS_TABLE} (rowid, title, description) '
+                    f'VALUES (:id, :title, :description)'),
+            [{'id': r.id, 'title': segment(r.title), 'description': segment(r.description)}
+             for r in rows]
+        )
+        total += len(rows)
+        last_id = rows[-1].id
+    db.session.commit()
+    return total
+
+
+def ensure_search_index():
+    """索引不存在时创建并回填"""
+    if db.engine.dialect.name == 'sqlite' and not search_index_ready():
+        return rebuild_search_index()
+    return 0
+
+
+# 商品写入时同步更新索引（与业务数据处于同一事务）
+
+def _index_product(connection, product):
+    connection.execute(db.text(
+        f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, title, description) '
+        f'VALUES (:id, :title, :description)'
+    ), {'id': product.id, 'title': segment(product.title),
+        'description': segment(product.description)})
+
+
+@event.listens_for(Product, 'after_insert')
+def _product_inserted(mapper, connection, target):
+    if search_index_ready(connection):
+        _index_product(connection, target)
+
+
+@event.listens_for(Product, 'after_update')
+def _product_updated(mapper, connection, target):
+    if not search_index_ready(connection):
+        return
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.description.history.has_changes():
+        _index_product(connection, target)
+
+
+@event.listens_for(Product, 'after_delete')
+def _product_deleted(mapper, connection, target):
+    if search_index_ready(connection):
+        connection.execute(db.text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :id'),
+                           {'id': target.id})
+
+
+# ==================== 查询 ====================
+
+def apply_keyword_filter(query, keyword):
+    """为商品查询附加关键词条件：有FTS索引时按BM25相关度排序，否则回退为LIKE"""
+    match = build_match_query(keyword)
+    if match and search_index_ready():
+        hits = db.select(
+            db.literal_column('rowid').label('product_id'),
+            db.literal_column(
+                f'bm25({FTS_TABLE}, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT})'
+            ).label('rank')
+        ).select_from(db.table(FTS_TABLE)).where(
+            db.text(f'{FTS_TABLE} MATCH :match').bindparams(match=match)
+        ).subquery()
+        return query.join(hits, Product.id == hits.c.product_id).order_by(
+            hits.c.rank, Product.created_at.desc()
+        )
+
+    return query.filter(Product.title.contains(keyword) |
+                        Product.description.contains(keyword)).order_by(
+        Product.created_at.desc()
+    )
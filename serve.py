@@ -0,0 +1,253 @@
+"""
+生产环境启动入口（python app.py 是带调试器的单线程开发服务器，只用于开发）
+- 预加载：在主进程中导入应用并编译全部模板，再 fork 出 worker，各进程共享这些内存页，第一个请求不必再编译模板
+- 多进程 + 多线程：SERVE_WORKERS 个 worker 进程共用一个监听套接字，每个进程用 SERVE_THREADS 个线程处理请求。
+  已安装 gunicorn 时交给 gunicorn（gthread worker，preload_app），否则使用这里内置的预派生 runner（werkzeug 的 WSGI 服务器，
+  不启用调试器，线程池大小固定）；不支持 fork 的平台（Windows）只启动一个进程
+- 优雅退出：收到 SIGTERM / SIGINT 后不再接受新连接，等待处理中的请求最多 SERVE_GRACEFUL_TIMEOUT 秒，
+  然后把浏览量缓冲与审计日志队列写回数据库、等待缩略图生成完成、关闭密码哈希进程池（见 shutdown_app()）
+- 私信推送与线程数：线程模式（gunicorn gthread、内置 runner）下每个等待中的连接占用一个线程，
+  因此总是使用长轮询（MESSAGE_PUSH 强制为 poll，/api/messages/stream 返回 204），且每个进程同时等待的长轮询
+  不超过 MESSAGE_MAX_WAITERS（默认 --threads 的一半），超出时立即返回、浏览器 MESSAGE_POLL_RETRY 秒后再请求，
+  其余线程始终留给普通请求；打开页面很多的部署应使用 --asgi
+- --asgi：通过 uvicorn 运行 asgi.py，私信推送的长连接在事件循环中等待，不再各占一个线程，默认使用 SSE 推送
+
+用法: python serve.py [--bind 0.0.0.0:5001] [--workers 4] [--threads 8] [--server auto|gunicorn|builtin] [--asgi]
+      APP_CONFIG=production python serve.py   # 使用 WAL、连接池与共享文件缓存（多 worker 部署时推荐）
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from app import app
+from models import db
+from view_counter import view_counter
+from audit import audit
+from images import image_pipeline
+from passwords import password_hasher
+
+
+def preload():
+    """在 fork 之前编译全部模板（Jinja 按模板名缓存编译结果）"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def after_fork():
+    """worker 进程启动后调用：不复用主进程连接池中的连接（后台线程、进程池都按进程在首次使用时创建）"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def shutdown_app():
+    """worker 退出前写回内存中的缓冲：浏览量、审计日志、缩略图任务、密码哈希进程池"""
+    view_counter.flush()
+    audit.flush()
+    image_pipeline.shutdown(wait=True)
+    password_hasher.shutdown()
+
+
+class RequestHandler(WSGIRequestHandler):
+    # 每个连接处理一个请求后关闭：线程数固定，空闲的 keep-alive 连接不能占着线程（前面通常有 Nginx 保持客户端连接）
+    protocol_version = 'HTTP/1.0'
+    access_log = False
+
+    def log_request(self, code='-', size='-'):
+        if self.access_log:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """固定大小线程池的 WSGI 服务器；记录处理中的请求数，退出时等待它们完成"""
+    multithread = True
+
+    def __init__(self, host, port, wsgi_app, threads, fd=None):
+        super().__init__(host, port, wsgi_app, handler=RequestHandler, fd=fd)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+        self._active = 0
+        self._idle = threading.Condition()
+
+    def get_request(self):
+        # 监听套接字为非阻塞（多个进程同时被唤醒时只有一个能 accept 到），接受的连接改回阻塞
+        request, client_address = super().get_request()
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self._active += 1
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._idle:
+                self._active -= 1
+                self._idle.notify_all()
+
+    def drain(self, timeout):
+        """等待处理中的请求完成，返回超时后仍未完成的请求数"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._active == 0, timeout)
+            return self._active
+
+
+def _serve(listener, host, threads, graceful_timeout):
+    """在当前进程中处理请求，直到收到 SIGTERM / SIGINT"""
+    server = PooledWSGIServer(host, listener.getsockname()[1], app, threads, fd=listener.fileno())
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        # shutdown() 会等待 serve_forever 退出，不能在信号处理函数所在的主线程中直接调用
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    unfinished = server.drain(graceful_timeout)
+    if unfinished:
+        app.logger.warning('进程 %d 退出时仍有 %d 个请求未完成（多为私信推送长连接）', os.getpid(), unfinished)
+    shutdown_app()
+
+
+def run_builtin(host, port, workers, threads, graceful_timeout):
+    """内置的预派生 runner：主进程只负责监听、派生与回收 worker，worker 异常退出时重新派生"""
+    listener = socket.create_server((host, port), backlog=2048)
+    listener.setblocking(False)
+    preload()
+    if not hasattr(os, 'fork') or workers <= 1:
+        print(f'在 http://{host}:{port} 上启动 1 个进程 × {threads} 个线程', flush=True)
+        _serve(listener, host, threads, graceful_timeout)
+        return
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            children.clear()
+            code = 0
+            try:
+                after_fork()
+                _serve(listener, host, threads, graceful_timeout)
+            except BaseException:
+                app.logger.exception('worker 进程 %d 异常退出', os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f'在 http://{host}:{port} 上启动 {workers} 个进程 × {threads} 个线程（主进程 {os.getpid()}）', flush=True)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            app.logger.error('worker 进程 %d 退出（状态 %d），重新派生', pid, status)
+            time.sleep(1)
+            spawn()
+    listener.close()
+
+
+def run_gunicorn(host, port, workers, threads, graceful_timeout):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{host}:{port}',
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread',
+                'preload_app': True,
+                'graceful_timeout': graceful_timeout,
+                'post_fork': lambda server, worker: after_fork(),
+                'worker_exit': lambda server, worker: shutdown_app(),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    preload()
+    Application().run()
+
+
+def run_asgi(host, port, workers, graceful_timeout):
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('ASGI 模式需要安装 uvicorn：pip install uvicorn')
+    uvicorn.run('asgi:application', host=host, port=port, workers=workers,
+                timeout_graceful_shutdown=graceful_timeout, lifespan='on')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bind', default=app.config['SERVE_BIND'], help='监听地址 host:port')
+    parser.add_argument('--workers', type=int, default=app.config['SERVE_WORKERS'])
+    parser.add_argument('--threads', type=int, default=app.config['SERVE_THREADS'])
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'builtin'), default='auto')
+    parser.add_argument('--asgi', action='store_true', help='通过 uvicorn 运行 asgi.py')
+    parser.add_argument('--access-log', action='store_true', help='内置 runner 输出访问日志')
+    args = parser.parse_args()
+
+    host, _, port = args.bind.rpartition(':')
+    host, port = host or '0.0.0.0', int(port)
+    graceful_timeout = app.config['SERVE_GRACEFUL_TIMEOUT']
+    RequestHandler.access_log = args.access_log
+    # 长轮询等待名额按实际线程数计算（fork 出的 worker 继承这里的配置）
+    app.config['SERVE_THREADS'] = args.threads
+
+    if args.asgi:
+        run_asgi(host, port, args.workers, graceful_timeout)
+        return
+    if app.config['MESSAGE_PUSH'] == 'stream':
+        app.logger.warning('线程模式下 SSE 连接会长期占用线程，私信推送改用长轮询；需要 SSE 时使用 --asgi')
+        app.config['MESSAGE_PUSH'] = 'poll'
+    server = args.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn' if hasattr(os, 'fork') else 'builtin'
+        except ImportError:
+            server = 'builtin'
+    if server == 'gunicorn':
+        run_gunicorn(host, port, args.workers, args.threads, graceful_timeout)
+    else:
+        run_builtin(host, port, args.workers, args.threads, graceful_timeout)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
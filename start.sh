@@ -19,9 +19,13 @@ else
     echo "✓ 数据库已存在"
 fi
 
+# 启动方式：dev（默认，开发服务器）、prod（python serve.py，多进程多线程）、asgi（python serve.py --asgi，需要 uvicorn）
+# 用法: ./start.sh [dev|prod|asgi]，或设置环境变量 SERVE_MODE
+MODE=${1:-${SERVE_MODE:-dev}}
+
 # 启动应用
 echo ""
-echo "✓ 启动Flask应用..."
+echo "✓ 启动Flask应用（$MODE）..."
 echo "✓ 访问地址: http://127.0.0.1:5001"
 echo ""
 echo "测试账号："
@@ -33,5 +37,15 @@ echo "按 Ctrl+C 停止服务"
 echo "=========================================="
 echo ""
 
-python app.py
+case "$MODE" in
+    prod)
+        APP_CONFIG=${APP_CONFIG:-production} exec python serve.py
+        ;;
+    asgi)
+        APP_CONFIG=${APP_CONFIG:-production} exec python serve.py --asgi
+        ;;
+    *)
+        exec python app.py
+        ;;
+esac
 
@@ -1,27 +1,41 @@
 // 主JS文件
 
 // 收藏功能
+function isFavorited(productId) {
+    const btn = document.querySelector(`#favorite-btn-${productId}`);
+    if (btn) {
+        return btn.classList.contains('favorited');
+    }
+    const icon = document.getElementById('favorite-icon');
+    return icon ? icon.classList.contains('bi-heart-fill') : false;
+}
+
+function markFavorite(productId, favorited) {
+    const btn = document.querySelector(`#favorite-btn-${productId}`);
+    if (!btn) return;
+    if (favorited) {
+        btn.classList.add('favorited');
+        btn.innerHTML = '<i class="bi bi-heart-fill"></i> 已收藏';
+    } else {
+        btn.classList.remove('favorited');
+        btn.innerHTML = '<i class="bi bi-heart"></i> 收藏';
+    }
+}
+
 function toggleFavorite(productId) {
+    // 提交目标状态而不是"切换"，连续点击或多个标签页同时操作时结果仍与页面显示一致
     fetch(`/product/${productId}/favorite`, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
+        body: JSON.stringify({favorited: !isFavorited(productId)}),
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
             // 更新商品列表页的收藏按钮
-            const btn = document.querySelector(`#favorite-btn-${productId}`);
-            if (btn) {
-                if (data.is_favorited) {
-                    btn.classList.add('favorited');
-                    btn.innerHTML = '<i class="bi bi-heart-fill"></i> 已收藏';
-                } else {
-                    btn.classList.remove('favorited');
-                    btn.innerHTML = '<i class="bi bi-heart"></i> 收藏';
-                }
-            }
+            markFavorite(productId, data.is_favorited);
 
             // 更新商品详情页的收藏按钮
             const icon = document.getElementById('favorite-icon');
@@ -54,6 +68,21 @@ function toggleFavorite(productId) {
     });
 }
 
+// 列表页收藏状态：一次请求查询整页商品
+function loadFavoriteStates() {
+    const buttons = document.querySelectorAll('[data-favorite-product]');
+    if (!buttons.length) return;
+    const ids = Array.from(buttons, btn => btn.dataset.favoriteProduct);
+    fetch(`/api/favorites/state?ids=${ids.join(',')}`)
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            data.favorited.forEach(productId => markFavorite(productId, true));
+        }
+    })
+    .catch(error => console.error('Error:', error));
+}
+
 // 图片预览功能
 function previewImages(input) {
     const preview = document.getElementById('image-preview');
@@ -182,6 +211,12 @@ document.addEventListener('DOMContentLoaded', function() {
     // 初始化图片懒加载
     lazyLoadImages();
 
+    // 未读私信数推送
+    watchUnreadMessages();
+
+    // 列表页收藏状态
+    loadFavoriteStates();
+
     // 自动隐藏提示消息
     setTimeout(() => {
         const alerts = document.querySelectorAll('.alert');
@@ -192,16 +227,66 @@ document.addEventListener('DOMContentLoaded', function() {
     }, 5000);
 });
 
-// 搜索建议（可选功能）
+// 搜索建议
+let suggestionTimer = null;
+
 function searchSuggestion(keyword) {
-    if (keyword.length < 2) return;
-
-    fetch(`/api/search/suggestion?q=${encodeURIComponent(keyword)}`)
-        .then(response => response.json())
-        .then(data => {
-            // 显示搜索建议
-            console.log(data);
-        })
-        .catch(error => console.error('Error:', error));
+    clearTimeout(suggestionTimer);
+    if (keyword.trim().length < 1) return;
+
+    // 输入停顿后再请求，避免每个按键都发请求
+    suggestionTimer = setTimeout(() => {
+        fetch(`/api/search/suggestion?q=${encodeURIComponent(keyword)}`)
+            .then(response => response.json())
+            .then(data => {
+                const list = document.getElementById('search-suggestions');
+                if (!list || !data.success) return;
+                list.innerHTML = '';
+                data.suggestions.forEach(text => {
+                    const option = document.createElement('option');
+                    option.value = text;
+                    list.appendChild(option);
+                });
+            })
+            .catch(error => console.error('Error:', error));
+    }, 150);
+}
+
+// 未读私信数：默认长轮询，服务端只在有新消息时才返回；服务器以 ASGI 方式运行时（页面给出 stream 地址）使用 SSE
+function updateUnreadBadge(count) {
+    const badge = document.getElementById('unread-badge');
+    if (!badge) return;
+    badge.textContent = count > 99 ? '99+' : count;
+    badge.classList.toggle('d-none', !count);
 }
 
+function watchUnreadMessages() {
+    const badge = document.getElementById('unread-badge');
+    if (!badge) return;
+
+    let version = '';
+    const poll = () => {
+        fetch(`${badge.dataset.pollUrl}?since=${version}`)
+            .then(response => response.json())
+            .then(data => {
+                updateUnreadBadge(data.unread);
+                version = data.version;
+                // 服务器等待名额已满时立即返回并给出 retry，稍后再请求
+                setTimeout(poll, (data.retry || 0) * 1000);
+            })
+            .catch(() => setTimeout(poll, 5000));
+    };
+
+    if (window.EventSource && badge.dataset.streamUrl) {
+        const source = new EventSource(badge.dataset.streamUrl);
+        source.addEventListener('unread', event => {
+            updateUnreadBadge(JSON.parse(event.data).unread);
+        });
+        // 服务器拒绝 SSE（204）时连接关闭且不再重连，改用长轮询
+        source.addEventListener('error', () => {
+            if (source.readyState === EventSource.CLOSED) poll();
+        });
+        return;
+    }
+    poll();
+}
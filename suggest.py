@@ -0,0 +1,229 @@
+"""
+搜索建议
+进程内的前缀索引（有序数组 + 二分查找），为 /api/search/suggestion 提供毫秒级以内的响应
+索引只在启动时从数据库加载一次，之后由发布商品、订单状态变化等写路径增量更新
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from models import db, Product, Category
+
+# 待合并缓冲区超过 max(该值, 主数组长度/64) 时并入主数组，使归并开销均摊到常数级
+MERGE_THRESHOLD = 1024
+
+
+def normalize(text):
+    """统一大小写和首尾空白，作为索引键"""
+    return (text or '').strip().lower()
+
+
+class PrefixIndex:
+    """有序数组前缀索引
+
+    主数组 _keys 保持有序，新增的键先放入较小的有序缓冲区 _pending，
+    超过阈值后归并进主数组；删除只减少引用计数，过期键在查询时跳过，
+    数量过多时整体压缩。
+    整体重建期间（begin_load() 之后、load() 之前）的增删按商品ID记下最终状态，换上新数组后与快照比对：
+    快照中没有而最终在售的补上，快照中有而最终下架的移除。快照读取前后提交的写入都只生效一次，
+    不会因为读取数据库与替换之间的写入而丢失，也不会重复计数
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._pending = []
+        self._counts = {}       # 键 -> 在售商品数（同名商品共享一个键）
+        self._display = {}      # 键 -> 展示文本
+        self._stale = 0
+        self._journal = None    # 重建期间的增删记录：ID -> (是否在售, 文本)
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._counts)
+
+    def begin_load(self):
+        """开始整体重建：在读取数据库之前调用，此后的增删会在 load() 之后重放"""
+        with self._lock:
+            self._journal = {}
+
+    def end_load(self):
+        """结束整体重建（load() 失败时丢弃日志）"""
+        with self._lock:
+            self._journal = None
+
+    def load(self, rows):
+        """用给定的 (ID, 文本) 整体重建索引"""
+        counts = {}
+        display = {}
+        snapshot = {}
+        for item_id, title in rows:
+            snapshot[item_id] = title
+            key = normalize(title)
+            if not key:
+                continue
+            counts[key] = counts.get(key, 0) + 1
+            display.setdefault(key, title.strip())
+        keys = sorted(counts)
+        with self._lock:
+            self._keys = keys
+            self._pending = []
+            self._counts = counts
+            self._display = display
+            self._stale = 0
+            self.loaded_at = time.time()
+            journal, self._journal = self._journal or {}, None
+            for item_id, (listed, title) in journal.items():
+                if listed and item_id not in snapshot:
+                    self._add(title)
+                elif not listed and item_id in snapshot:
+                    self._remove(snapshot[item_id])
+
+    def add(self, item_id, title):
+        with self._lock:
+            if self._journal is not None:
+                self._journal[item_id] = (True, title)
+            self._add(title)
+
+    def remove(self, item_id, title):
+        with self._lock:
+            if self._journal is not None:
+                self._journal[item_id] = (False, title)
+            self._remove(title)
+
+    def _add(self, title):
+        key = normalize(title)
+        if not key:
+            return
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        if key in self._display:
+            # 键仍在数组中（可能是已删除的过期键），直接复用
+            if count == 0:
+                self._stale -= 1
+            return
+        self._display[key] = title.strip()
+        insort(self._pending, key)
+        if len(self._pending) > max(MERGE_THRESHOLD, len(self._keys) // 64):
+            self._merge()
+
+    def _remove(self, title):
+        key = normalize(title)
+        count = self._counts.get(key, 0)
+        if count <= 0:
+            return
+        self._counts[key] = count - 1
+        if count == 1:
+            self._stale += 1
+            if self._stale > max(MERGE_THRESHOLD, len(self._keys) // 4):
+                self._compact()
+
+    def _merge(self):
+        self._keys = sorted(self._keys + self._pending)
+        self._pending = []
+
+    def _compact(self):
+        live = [k for k in self._keys + self._pending if self._counts.get(k, 0) > 0]
+        live.sort()
+        self._counts = {k: self._counts[k] for k in live}
+        self._display = {k: self._display[k] for k in live}
+        self._keys = live
+        self._pending = []
+        self._stale = 0
+
+    def lookup(self, prefix, limit):
+        """返回以 prefix 开头的至多 limit 条展示文本（按字典序）"""
+        prefix = normalize(prefix)
+        if not prefix or limit <= 0:
+            return []
+        with self._lock:
+            keys, pending, counts, display = self._keys, self._pending, self._counts, self._display
+            results = []
+            for candidate in _merge_prefix(keys, pending, prefix):
+                if counts.get(candidate, 0) > 0:
+                    results.append(display[candidate])
+                    if len(results) >= limit:
+                        break
+            return results
+
+
+def _iter_prefix(keys, prefix):
+    i = bisect_left(keys, prefix)
+    n = len(keys)
+    while i < n and keys[i].startswith(prefix):
+        yield keys[i]
+        i += 1
+
+
+def _merge_prefix(keys, pending, prefix):
+    """按字典序合并两个有序数组中的前缀匹配项"""
+    a = _iter_prefix(keys, prefix)
+    b = _iter_prefix(pending, prefix)
+    x = next(a, None)
+    y = next(b, None)
+    while x is not None or y is not None:
+        if y is None or (x is not None and x <= y):
+            yield x
+            x = next(a, None)
+        else:
+            yield y
+            y = next(b, None)
+
+
+# ==================== 进程级索引 ====================
+
+title_index = PrefixIndex()
+category_index = PrefixIndex()
+_refreshing = threading.Lock()
+
+
+def load_suggestions():
+    """从数据库加载在售商品标题与分类名称（启动时或定期调用）"""
+    title_index.begin_load()
+    try:
+        rows = db.session.execute(
+            db.select(Product.id, Product.title).where(Product.listed())
+        ).tuples()
+        title_index.load(rows)
+    finally:
+        title_index.end_load()
+    category_index.load(db.session.execute(db.select(Category.id, Category.name)).tuples())
+
+
+def _refresh_in_background(app):
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            with app.app_context():
+                load_suggestions()
+        finally:
+            _refreshing.release()
+
+    threading.Thread(target=run, name='suggest-refresh', daemon=True).start()
+
+
+def suggest(app, prefix, limit):
+    """查询搜索建议；索引为空时同步加载，超过刷新周期时在后台线程重新加载"""
+    if title_index.loaded_at is None:
+        load_suggestions()
+    elif time.time() - title_index.loaded_at > app.config['SUGGEST_REFRESH_INTERVAL']:
+        # 多进程部署时其他进程的增量更新不可见，定期全量刷新兜底
+        title_index.loaded_at = time.time()
+        _refresh_in_background(app)
+
+    categories = category_index.lookup(prefix, limit)
+    return categories + title_index.lookup(prefix, limit - len(categories))
+
+
+def product_listed(product):
+    """商品变为可售（发布、订单取消）"""
+    if title_index.loaded_at is not None:
+        title_index.add(product.id, product.title)
+
+
+def product_unlisted(product):
+    """商品不再可售（被预定、售出、删除）"""
+    if title_index.loaded_at is not None:
+        title_index.remove(product.id, product.title)
@@ -0,0 +1,91 @@
+"""
+用户统计计数
+个人中心的商品数、订单数、收藏数等改为读取 user_stats 汇总表，
+由业务写路径以 SQL 增量（x = x + n）在同一事务内更新，避免每次渲染都执行 COUNT
+reconcile_user_stats() 从原始表重新统计并报告/修复偏差
+"""
+from sqlalchemy import event
+
+from models import db, User, UserStats, Product, Order, Favorite, Message
+
+COUNTER_FIELDS = ('product_count', 'sold_count', 'buy_count', 'sell_count', 'favorite_count',
+                  'unread_message_count')
+
+
+@event.listens_for(User, 'after_insert')
+def _create_stats_row(mapper, connection, target):
+    """新用户注册时在同一事务内创建统计行"""
+    connection.execute(UserStats.__table__.insert().values(
+        user_id=target.id, **{field: 0 for field in COUNTER_FIELDS}
+    ))
+
+
+def bump(user_id, **deltas):
+    """在当前会话事务中增减计数，例如 bump(uid, product_count=1)；由调用方提交"""
+    values = {field: getattr(UserStats, field) + delta
+              for field, delta in deltas.items() if delta}
+    if not values:
+        return
+    result = db.session.execute(
+        db.update(UserStats).where(UserStats.user_id == user_id).values(**values)
+    )
+    if result.rowcount == 0:
+        # 早于统计表创建的老用户：补一行后重试，精确值由对账任务修正
+        db.session.add(UserStats(user_id=user_id, **{field: 0 for field in COUNTER_FIELDS}))
+        db.session.flush()
+        db.session.execute(
+            db.update(UserStats).where(UserStats.user_id == user_id).values(**values)
+        )
+
+
+def get_stats(user_id):
+    """读取用户统计，统计行不存在时返回全零对象"""
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        stats = UserStats(user_id=user_id, **{field: 0 for field in COUNTER_FIELDS})
+    return stats
+
+
+def _actual_counts():
+    """从原始表重新统计，每个计数单独聚合，避免多表连接造成的行数放大"""
+    queries = {
+        'product_count': db.select(Product.seller_id, db.func.count())
+        .where(Product.is_deleted == False).group_by(Product.seller_id),
+        'sold_count': db.select(Product.seller_id, db.func.count())
+        .where(Product.is_deleted == False, Product.status == 'sold').group_by(Product.seller_id),
+        'buy_count': db.select(Order.buyer_id, db.func.count()).group_by(Order.buyer_id),
+        'sell_count': db.select(Order.seller_id, db.func.count()).group_by(Order.seller_id),
+        'favorite_count': db.select(Favorite.user_id, db.func.count()).group_by(Favorite.user_id),
+        'unread_message_count': db.select(Message.receiver_id, db.func.count())
+        .where(Message.is_read == False).group_by(Message.receiver_id),
+    }
+    actual = {}
+    for field, query in queries.items():
+        for user_id, count in db.session.execute(query):
+            actual.setdefault(user_id, {})[field] = count
+    return actual
+
+
+def reconcile_user_stats(fix=True):
+    """重算所有用户的统计计数，返回偏差列表 [(user_id, 字段, 记录值, 实际值)]"""
+    actual = _actual_counts()
+    stored = {s.user_id: s for s in UserStats.query.all()}
+    drift = []
+
+    for user_id in db.session.execute(db.select(User.id)).scalars():
+        expected = actual.get(user_id, {})
+        stats = stored.get(user_id)
+        if stats is None:
+            stats = UserStats(user_id=user_id, **{field: 0 for field in COUNTER_FIELDS})
+            db.session.add(stats)
+        for field in COUNTER_FIELDS:
+            value = expected.get(field, 0)
+            if getattr(stats, field) != value:
+                drift.append((user_id, field, getattr(stats, field), value))
+                setattr(stats, field, value)
+
+    if fix:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return drift
@@ -0,0 +1,103 @@
+"""
+商品浏览量写回缓冲
+详情页只在进程内存中累加浏览次数，由后台线程按时间间隔或累计数量阈值批量写回：
+UPDATE products SET view_count = view_count + ?, hot_score = hot_score + ? WHERE id = ?
+读路径不再产生写事务，也避免了 ORM 读-改-写造成的计数丢失；热度分随浏览量一起累加，
+写回前检查热度分的衰减起点是否需要平移（见 ranking.maybe_rebase()）
+"""
+import atexit
+import os
+import threading
+
+from models import db
+import ranking
+
+FLUSH_SQL = db.text(
+    'UPDATE products SET view_count = view_count + :delta, '
+    f'hot_score = COALESCE(hot_score, 0) + :score * {ranking.EPOCH_GUARD} WHERE id = :id'
+).bindparams(db.bindparam('epoch', type_=db.DateTime), db.bindparam('legacy_epoch', type_=db.DateTime))
+
+
+class ViewCounter:
+    """进程级浏览量聚合器"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._total = 0
+        self._wake = threading.Event()
+        self._worker_pid = None
+        self.app = None
+        self.interval = 5
+        self.threshold = 1000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config['VIEW_COUNT_FLUSH_INTERVAL']
+        self.threshold = app.config['VIEW_COUNT_FLUSH_THRESHOLD']
+        app.extensions['view_counter'] = self
+        # 进程退出时写回剩余计数
+        atexit.register(self.flush)
+
+    def record(self, product_id):
+        """记录一次浏览（不访问数据库）"""
+        with self._lock:
+            self._pending[product_id] = self._pending.get(product_id, 0) + 1
+            self._total += 1
+            reached = self._total >= self.threshold
+        self._ensure_worker()
+        if reached:
+            self._wake.set()
+
+    def pending(self, product_id):
+        """尚未写回数据库的浏览次数"""
+        return self._pending.get(product_id, 0)
+
+    def flush(self):
+        """把缓冲区中的计数批量写回数据库，返回写回的浏览次数"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._total = 0
+        if not batch:
+            return 0
+
+        try:
+            with self.app.app_context():
+                ranking.maybe_rebase()
+                epoch = ranking.hot_epoch()
+                per_view = ranking.score_delta(views=1, epoch=epoch)
+                guard = ranking.epoch_params(epoch)
+                with db.engine.begin() as connection:
+                    connection.execute(FLUSH_SQL,
+                                       [{'id': pid, 'delta': n, 'score': n * per_view, **guard}
+                                        for pid, n in batch.items()])
+        except Exception:
+            # 写回失败时放回缓冲区，下次重试
+            with self._lock:
+                for pid, n in batch.items():
+                    self._pending[pid] = self._pending.get(pid, 0) + n
+                    self._total += n
+            self.app.logger.exception('浏览量写回失败，%d 个商品的计数将在下次重试', len(batch))
+            return 0
+        return sum(batch.values())
+
+    def _ensure_worker(self):
+        # 按进程启动：gunicorn 等预派生模型下，fork 出的子进程需要自己的写回线程
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='view-counter-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+view_counter = ViewCounter()